@@ -3,44 +3,129 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk  # Import ttk here
-import subprocess
 import threading
 import os
 import sys
+import time
 import queue
+from functools import partial
 
-# Define allowed media file extensions
-ALLOWED_EXTENSIONS = {
-    '.mp3', '.wav', '.flac', '.aac', '.m4a', '.ogg', '.wma',
-    '.mp4', '.mkv', '.avi', '.mov', '.wmv', '.webm', '.flv'
-}
+from job_journal import JobJournal
+import pyav_opus
+import run_metrics
+from opus_engine import (MEDIA_EXTENSIONS, EncodePool, EngineError, Rendition, convert_renditions, encode,
+                         iter_media_files, kill_running_encoders, parse_rendition, probe_durations, rendition_name,
+                         require_ffmpeg)
+from throughput_history import ThroughputHistory
+
+# Job journal kept in the converted directory so interrupted batches can be resumed
+JOURNAL_FILENAME = '.f2opus_jobs.sqlite3'
+# Per-file JSONL events of the last batches; the Prometheus summary goes next to it as .prom
+METRICS_FILENAME = '.f2opus_metrics.jsonl'
 
 def check_ffmpeg():
-    """Check if ffmpeg is installed."""
+    """Check that ffmpeg can encode Opus (probed once per ffmpeg binary, then cached)."""
     try:
-        subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-    except (FileNotFoundError, subprocess.CalledProcessError):
-        messagebox.showerror("ffmpeg Not Found", "ffmpeg is not installed or not in PATH.")
+        require_ffmpeg()
+    except EngineError as e:
+        messagebox.showerror("ffmpeg Not Found", str(e))
         sys.exit(1)
 
-def convert_to_opus(input_file, output_file, bitrate, sample_rate):
-    """Convert the input media file to an OPUS file with specified settings."""
-    command = [
-        'ffmpeg',
-        '-i', input_file,
-        '-ar', sample_rate,    # Set audio sample rate
-        '-c:a', 'libopus',
-        '-b:a', bitrate,       # Set audio bitrate
-        '-vbr', 'off',         # Attempt to force constant bitrate (may not be strictly enforced)
-        '-vn',                 # Disable video recording
-        output_file
-    ]
-    try:
-        subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"An error occurred while converting '{input_file}': {e}")
-        return False
+# Minimum interval between progress messages sent to the GUI
+PROGRESS_INTERVAL = 0.25
+
+class ConversionCancelled(Exception):
+    """Raised from a progress callback to abandon an in-process encode."""
+
+class BatchProgress:
+    """Time-based progress, realtime factor and ETA for a batch of encodes.
+
+    Progress is measured in seconds of audio encoded rather than files
+    finished, so a long file advances the bar while it runs.
+    """
+
+    def __init__(self, durations, q):
+        known = [duration for duration in durations if duration]
+        # Files that could not be probed count as an average-length file
+        fallback = sum(known) / len(known) if known else 1.0
+        self.durations = [duration or fallback for duration in durations]
+        self.total_audio = sum(self.durations)
+        self.total_files = len(durations)
+        self.q = q
+        self.lock = threading.Lock()
+        self.finished_audio = 0.0
+        self.finished_files = 0
+        self.running = {}  # File index -> seconds encoded so far
+        self.started = time.monotonic()
+        self.last_report = 0.0
+
+    def update(self, idx, seconds):
+        with self.lock:
+            self.running[idx] = min(seconds, self.durations[idx])
+            self._report(force=False)
+
+    def finish(self, idx):
+        with self.lock:
+            self.running.pop(idx, None)
+            self.finished_audio += self.durations[idx]
+            self.finished_files += 1
+            self._report(force=True)
+
+    def _report(self, force):
+        now = time.monotonic()
+        if not force and now - self.last_report < PROGRESS_INTERVAL:
+            return
+        self.last_report = now
+        encoded = self.finished_audio + sum(self.running.values())
+        elapsed = max(now - self.started, 1e-6)
+        realtime_factor = encoded / elapsed
+        text = f"{self.finished_files} of {self.total_files} files done"
+        if realtime_factor > 0:
+            eta = (self.total_audio - encoded) / realtime_factor
+            text += f" - {realtime_factor:.1f}x realtime, ETA {format_seconds(eta)}"
+        progress = (encoded / self.total_audio) * 100 if self.total_audio else 100
+        self.q.put({'type': 'update', 'text': text, 'progress': progress, 'realtime_factor': realtime_factor})
+
+def format_seconds(seconds):
+    seconds = int(max(seconds, 0))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def rendition_output(output_file, rendition):
+    """Where a ladder rendition of output_file goes, e.g. song.32k.opus beside song.opus."""
+    return f"{os.path.splitext(output_file)[0]}.{rendition_name(rendition)}.opus"
+
+def convert_to_opus(input_file, output_file, bitrate, sample_rate, backend='auto', progress_callback=None,
+                    renditions=()):
+    """Convert the input media file to an OPUS file with specified settings.
+
+    backend is 'ffmpeg', 'pyav' or 'auto' (in-process PyAV for small files);
+    a failed PyAV encode falls back to the ffmpeg CLI. renditions are extra
+    Rendition ladder steps encoded with ffmpeg from the same decode, each to
+    rendition_output(). progress_callback is called with the seconds of
+    audio encoded so far. Returns (success, error_text).
+    """
+    started = time.time()
+    if renditions:
+        outputs = [(output_file, Rendition(bitrate, int(sample_rate), None))]
+        outputs += [(rendition_output(output_file, rendition), rendition) for rendition in renditions]
+        if convert_renditions(input_file, outputs, converter='F2OPUS', progress_callback=progress_callback,
+                              extra_args=['-vbr', 'off']):
+            return True, None
+        return False, "ffmpeg could not encode the rendition ladder (see the log for its output)"
+    if pyav_opus.choose_backend(input_file, backend) == 'pyav':
+        try:
+            pyav_opus.encode_file(input_file, output_file, bitrate, sample_rate, constant_bitrate=True,
+                                  progress_callback=progress_callback)
+            run_metrics.record_file('F2OPUS', input_file, output_file, started, 0, backend='pyav')
+            return True, None
+        except ConversionCancelled:
+            raise
+        except Exception as e:
+            print(f"PyAV could not convert '{input_file}' ({e}); falling back to ffmpeg.", file=sys.stderr)
+    # '-vbr off' attempts to force constant bitrate (may not be strictly enforced)
+    return encode(input_file, [(output_file, Rendition(bitrate, int(sample_rate), None))],
+                  progress_callback=progress_callback, extra_args=['-vbr', 'off'], converter='F2OPUS',
+                  backend='ffmpeg')
 
 def select_directory():
     directory = filedialog.askdirectory()
@@ -48,137 +133,341 @@ def select_directory():
         directory_entry.delete(0, tk.END)
         directory_entry.insert(0, directory)
 
-def start_conversion():
+def read_settings():
+    """Return the validated form values, or None after showing what is wrong."""
     directory = directory_entry.get()
     bitrate = bitrate_entry.get()
     sample_rate = sample_rate_entry.get()
-    recursive = recursive_var.get()
+    workers = workers_entry.get()
+    ladder = renditions_entry.get().replace(',', ' ').split()
 
     if not os.path.isdir(directory):
         messagebox.showerror("Invalid Directory", "Please select a valid directory.")
-        return
+        return None
 
     if not bitrate.endswith('k'):
         messagebox.showerror("Invalid Bitrate", "Bitrate must end with 'k' (e.g., '8k').")
-        return
+        return None
 
     if not sample_rate.isdigit():
         messagebox.showerror("Invalid Sample Rate", "Sample rate must be a numeric value (e.g., '44100').")
+        return None
+
+    if not workers.isdigit() or int(workers) < 1:
+        messagebox.showerror("Invalid Workers", "Workers must be a whole number of at least 1.")
+        return None
+
+    try:
+        renditions = [parse_rendition(spec) for spec in ladder]
+    except ValueError as e:
+        messagebox.showerror("Invalid Renditions", str(e))
+        return None
+    # Ladder steps without their own sample rate use the one above
+    renditions = [Rendition(r.bitrate, r.sample_rate or int(sample_rate), r.channels) for r in renditions]
+
+    return (directory, bitrate, sample_rate, recursive_var.get(), retry_failed_var.get(), backend_var.get(), workers,
+            renditions)
+
+def start_plan():
+    settings = read_settings()
+    if settings is None:
+        return
+    directory, bitrate, sample_rate, recursive, retry_failed, _, workers, renditions = settings
+    start_button.config(state=tk.DISABLED)
+    plan_button.config(state=tk.DISABLED)
+    progress_label.config(text="Measuring files...")
+    q = queue.Queue()
+    threading.Thread(target=plan_directory, args=(directory, bitrate, sample_rate, recursive, q, retry_failed,
+                                                  int(workers), renditions), daemon=True).start()
+    root.after(100, lambda: check_queue(q))
+
+def start_conversion():
+    global cancel_event
+    settings = read_settings()
+    if settings is None:
         return
+    directory, bitrate, sample_rate, recursive, retry_failed, backend, workers, renditions = settings
 
     # Disable the start button to prevent multiple clicks
     start_button.config(state=tk.DISABLED)
+    plan_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
 
-    # Clear progress bar and label
+    # Clear progress bar, label and file list
     progress_bar['value'] = 0
     progress_label.config(text="")
+    files_view.delete(*files_view.get_children())
 
     # Create a queue to communicate with the thread
     q = queue.Queue()
+    cancel_event = threading.Event()
 
     # Run the conversion in a separate thread to keep the GUI responsive
-    threading.Thread(target=convert_directory, args=(directory, bitrate, sample_rate, recursive, q), daemon=True).start()
+    threading.Thread(target=convert_directory, args=(directory, bitrate, sample_rate, recursive, q, retry_failed, backend,
+                                                     int(workers), cancel_event, renditions), daemon=True).start()
 
     # Start monitoring the queue
     root.after(100, lambda: check_queue(q))
 
+def cancel_conversion():
+    """Stop queued jobs and terminate the running ffmpeg children."""
+    if cancel_event is not None:
+        cancel_event.set()
+        kill_running_encoders()
+    cancel_button.config(state=tk.DISABLED)
+    progress_label.config(text="Cancelling...")
+
 def check_queue(q):
-    try:
-        message = q.get_nowait()
+    # Drain everything queued since the last tick so the display never lags behind
+    while True:
+        try:
+            message = q.get_nowait()
+        except queue.Empty:
+            break
         if message['type'] == 'update':
             progress_label.config(text=message['text'])
             progress_bar['value'] = message['progress']
+        elif message['type'] == 'files':
+            for idx, input_file in enumerate(message['files']):
+                files_view.insert('', tk.END, iid=str(idx), values=(os.path.relpath(input_file, message['directory']), 'queued'))
+        elif message['type'] == 'file':
+            files_view.set(str(message['index']), 'status', message['status'])
+            if message['status'] == 'running':
+                files_view.see(str(message['index']))
         elif message['type'] == 'done':
             progress_label.config(text=message['text'])
             start_button.config(state=tk.NORMAL)
+            plan_button.config(state=tk.NORMAL)
+            cancel_button.config(state=tk.DISABLED)
             return
-    except queue.Empty:
-        pass
     # Continue checking the queue
     root.after(100, lambda: check_queue(q))
 
-def convert_directory(directory, bitrate, sample_rate, recursive, q):
-    check_ffmpeg()
+def collect_files(directory, recursive):
+    """Return (input_file, output_file) pairs for the media files in directory; outputs go beside their inputs."""
+    return [(input_file, output_file) for _, input_file, output_file
+            in iter_media_files(directory, directory, extensions=MEDIA_EXTENSIONS, recursive=recursive)]
 
-    files_to_convert = []
+def batch_settings(bitrate, sample_rate, recursive, renditions=()):
+    """The journal settings of a batch; a rendition ladder makes it a different batch."""
+    settings = {'bitrate': bitrate, 'sample_rate': sample_rate, 'recursive': recursive}
+    if renditions:
+        settings['renditions'] = [rendition_name(rendition) for rendition in renditions]
+    return settings
 
-    if recursive:
-        for root_dir, dirs, files in os.walk(directory):
-            for filename in files:
-                base, ext = os.path.splitext(filename)
-                if ext.lower() in ALLOWED_EXTENSIONS:
-                    input_file = os.path.join(root_dir, filename)
-                    output_file = os.path.join(root_dir, base + '.opus')
-                    files_to_convert.append((input_file, output_file))
+def plan_directory(directory, bitrate, sample_rate, recursive, q, retry_failed=False, workers=1, renditions=()):
+    """Probe what convert_directory would encode and estimate how long it would take.
+
+    Nothing is encoded and the journal is only read; the report is sent as
+    the 'done' message. A file counts its duration once per rendition.
+    """
+    files = collect_files(directory, recursive)
+    states = {}
+    journal_path = os.path.join(directory, JOURNAL_FILENAME)
+    if os.path.exists(journal_path):
+        journal = JobJournal(journal_path)
+        batch_id = journal.find_batch(os.path.abspath(directory),
+                                      batch_settings(bitrate, sample_rate, recursive, renditions))
+        if batch_id is not None:
+            states = journal.states(batch_id)
+        journal.close()
+    if retry_failed:
+        to_run = [input_file for input_file, _ in files if states.get(input_file) == 'failed']
     else:
-        for filename in os.listdir(directory):
-            base, ext = os.path.splitext(filename)
-            if ext.lower() in ALLOWED_EXTENSIONS:
-                input_file = os.path.join(directory, filename)
-                output_file = os.path.join(directory, base + '.opus')
-                files_to_convert.append((input_file, output_file))
+        to_run = [input_file for input_file, _ in files if states.get(input_file) not in ('done', 'failed')]
+    durations = probe_durations(to_run)
+    known = [duration * (1 + len(renditions)) for duration in durations if duration is not None]
+    lines = ThroughputHistory().plan_report('F2OPUS', len(files), len(files) - len(to_run), known, workers,
+                                            unprobed=len(to_run) - len(known))
+    q.put({'type': 'done', 'text': "\n".join(lines)})
+
+def convert_directory(directory, bitrate, sample_rate, recursive, q, retry_failed=False, backend='auto',
+                      workers=1, cancel_event=None, renditions=()):
+    """Convert the media files in directory with up to workers encodes at once.
+
+    renditions adds a ladder of extra Renditions per file, all encoded from
+    one decode (see convert_to_opus).
+
+    Setting cancel_event stops queued jobs; running encodes are abandoned
+    and left pending in the journal so the next run picks them up. A batch
+    that runs to completion is added to this machine's throughput history.
+    Every encode is logged to METRICS_FILENAME in directory, with a
+    Prometheus summary of the batch written beside it.
+    """
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    if renditions or backend != 'pyav' or not pyav_opus.available():
+        check_ffmpeg()
+
+    files_to_convert = collect_files(directory, recursive)
+
+    # Record the batch so a closed GUI or hung ffmpeg can be resumed where it stopped
+    journal = JobJournal(os.path.join(directory, JOURNAL_FILENAME))
+    batch_id = journal.get_batch(os.path.abspath(directory),
+                                 batch_settings(bitrate, sample_rate, recursive, renditions))
+    journal.add_jobs(batch_id, files_to_convert)
+    files_to_convert = journal.jobs_to_run(batch_id, retry_failed)
 
     total_files = len(files_to_convert)
-    success_count = 0
+    q.put({'type': 'files', 'directory': directory, 'files': [input_file for input_file, _ in files_to_convert]})
+    q.put({'type': 'update', 'text': f"Measuring {total_files} files...", 'progress': 0})
+    durations = probe_durations([input_file for input_file, _ in files_to_convert])
+    progress = BatchProgress(durations, q)
+    started = time.monotonic()
+    run_metrics.start_run(os.path.join(directory, METRICS_FILENAME))
+
+    def progress_callback(idx, seconds):
+        if cancel_event.is_set():
+            raise ConversionCancelled()
+        progress.update(idx, seconds)
+
+    def convert_job(idx, input_file, output_file):
+        if cancel_event.is_set():
+            q.put({'type': 'file', 'index': idx, 'status': 'cancelled'})
+            return False
+        q.put({'type': 'file', 'index': idx, 'status': 'running'})
+        journal.mark_running(batch_id, input_file)
+        try:
+            result, error = convert_to_opus(input_file, output_file, bitrate, sample_rate, backend,
+                                            progress_callback=lambda seconds: progress_callback(idx, seconds),
+                                            renditions=renditions)
+        except ConversionCancelled:
+            result, error = False, None
+        if cancel_event.is_set() and not result:
+            # Leave the job pending for the next run and drop any partial output; the backends
+            # only replace output_file on success, so an output from an earlier run is kept
+            journal.mark_pending(batch_id, input_file)
+            for path in [output_file] + [rendition_output(output_file, rendition) for rendition in renditions]:
+                if os.path.exists(path + '.part'):
+                    os.remove(path + '.part')
+            q.put({'type': 'file', 'index': idx, 'status': 'cancelled'})
+            return False
+        journal.mark_finished(batch_id, input_file, error)
+        progress.finish(idx)
+        q.put({'type': 'file', 'index': idx, 'status': 'done' if result else 'failed'})
+        return result
+
+    results = [False] * total_files
+
+    def job_done(idx, future):
+        # An unexpected error must not escape into the pool, which would stop the batch before 'done'
+        try:
+            results[idx] = future.result()
+        except Exception as e:
+            input_file = files_to_convert[idx][0]
+            print(f"Error converting '{input_file}': {e!r}", file=sys.stderr)
+            try:
+                journal.mark_finished(batch_id, input_file, repr(e))
+            except Exception:
+                pass  # The journal may be what failed; the job is then retried as interrupted
+            q.put({'type': 'file', 'index': idx, 'status': 'failed'})
+
+    with EncodePool(workers, 'threads') as pool:
+        for idx, (input_file, output_file) in enumerate(files_to_convert):
+            pool.submit(convert_job, idx, input_file, output_file, on_done=partial(job_done, idx))
+    success_count = sum(results)
+    run_metrics.finish_run()
+
+    if not cancel_event.is_set():
+        audio_seconds = sum(duration or 0.0 for duration, result in zip(durations, results) if result)
+        audio_seconds *= 1 + len(renditions)
+        ThroughputHistory().record('F2OPUS', int(workers), success_count, audio_seconds, time.monotonic() - started)
 
-    for idx, (input_file, output_file) in enumerate(files_to_convert, 1):
-        result = convert_to_opus(input_file, output_file, bitrate, sample_rate)
-        progress_percentage = (idx / total_files) * 100
-        if result:
-            success_count += 1
-        # Put update message in the queue
-        q.put({'type': 'update', 'text': f"Converting {idx} of {total_files} files...", 'progress': progress_percentage})
+    counts = journal.summary(batch_id)
+    journal.close()
 
     # Put completion message in the queue
-    q.put({'type': 'done', 'text': f"Conversion completed: {success_count}/{total_files} files converted."})
+    status = "cancelled" if cancel_event.is_set() else "completed"
+    q.put({'type': 'done', 'text': f"Conversion {status}: {success_count}/{total_files} files converted "
+                                   f"({counts.get('done', 0)} done, {counts.get('failed', 0)} failed in batch)."})
 
 def on_closing():
     if messagebox.askokcancel("Quit", "Do you want to quit?"):
         root.destroy()
         sys.exit(0)
 
-# Create the main window
-root = tk.Tk()
-root.title("Media to OPUS Converter")
-
-# Directory selection
-directory_label = tk.Label(root, text="Select Directory:")
-directory_label.grid(row=0, column=0, padx=5, pady=5, sticky='e')
-directory_entry = tk.Entry(root, width=50)
-directory_entry.grid(row=0, column=1, padx=5, pady=5)
-browse_button = tk.Button(root, text="Browse...", command=select_directory)
-browse_button.grid(row=0, column=2, padx=5, pady=5)
-
-# Bitrate input
-bitrate_label = tk.Label(root, text="Audio Bitrate (e.g., 8k):")
-bitrate_label.grid(row=1, column=0, padx=5, pady=5, sticky='e')
-bitrate_entry = tk.Entry(root)
-bitrate_entry.insert(0, '8k')
-bitrate_entry.grid(row=1, column=1, padx=5, pady=5, sticky='w')
-
-# Sample rate input
-sample_rate_label = tk.Label(root, text="Sample Rate (e.g., 44100):")
-sample_rate_label.grid(row=2, column=0, padx=5, pady=5, sticky='e')
-sample_rate_entry = tk.Entry(root)
-sample_rate_entry.insert(0, '44100')
-sample_rate_entry.grid(row=2, column=1, padx=5, pady=5, sticky='w')
-
-# Recursive option
-recursive_var = tk.BooleanVar()
-recursive_check = tk.Checkbutton(root, text="Process subdirectories recursively", variable=recursive_var)
-recursive_check.grid(row=3, column=1, padx=5, pady=5, sticky='w')
-
-# Start button
-start_button = tk.Button(root, text="Start Conversion", command=start_conversion)
-start_button.grid(row=4, column=1, padx=5, pady=10)
-
-# Progress display
-progress_label = tk.Label(root, text="")
-progress_label.grid(row=5, column=0, columnspan=3, padx=5, pady=5)
-progress_bar = ttk.Progressbar(root, orient='horizontal', length=400, mode='determinate')
-progress_bar.grid(row=6, column=0, columnspan=3, padx=5, pady=5)
-
-# Set window close protocol
-root.protocol("WM_DELETE_WINDOW", on_closing)
-
-root.mainloop()
+if __name__ == "__main__":
+    # Create the main window
+    root = tk.Tk()
+    root.title("Media to OPUS Converter")
+
+    # Directory selection
+    directory_label = tk.Label(root, text="Select Directory:")
+    directory_label.grid(row=0, column=0, padx=5, pady=5, sticky='e')
+    directory_entry = tk.Entry(root, width=50)
+    directory_entry.grid(row=0, column=1, padx=5, pady=5)
+    browse_button = tk.Button(root, text="Browse...", command=select_directory)
+    browse_button.grid(row=0, column=2, padx=5, pady=5)
+
+    # Bitrate input
+    bitrate_label = tk.Label(root, text="Audio Bitrate (e.g., 8k):")
+    bitrate_label.grid(row=1, column=0, padx=5, pady=5, sticky='e')
+    bitrate_entry = tk.Entry(root)
+    bitrate_entry.insert(0, '8k')
+    bitrate_entry.grid(row=1, column=1, padx=5, pady=5, sticky='w')
+
+    # Sample rate input
+    sample_rate_label = tk.Label(root, text="Sample Rate (e.g., 44100):")
+    sample_rate_label.grid(row=2, column=0, padx=5, pady=5, sticky='e')
+    sample_rate_entry = tk.Entry(root)
+    sample_rate_entry.insert(0, '44100')
+    sample_rate_entry.grid(row=2, column=1, padx=5, pady=5, sticky='w')
+
+    # Encoder backend
+    backend_label = tk.Label(root, text="Encoder:")
+    backend_label.grid(row=3, column=0, padx=5, pady=5, sticky='e')
+    backend_var = tk.StringVar(value='auto')
+    backend_menu = ttk.Combobox(root, textvariable=backend_var, values=('auto', 'ffmpeg', 'pyav'), state='readonly', width=10)
+    backend_menu.grid(row=3, column=1, padx=5, pady=5, sticky='w')
+
+    # Rendition ladder: extra encodes of every file from the same decode, e.g. "32k, 64k, 128k"
+    renditions_label = tk.Label(root, text="Extra renditions (e.g., 32k, 64k):")
+    renditions_label.grid(row=4, column=0, padx=5, pady=5, sticky='e')
+    renditions_entry = tk.Entry(root)
+    renditions_entry.grid(row=4, column=1, padx=5, pady=5, sticky='w')
+
+    # Concurrent encodes
+    workers_label = tk.Label(root, text="Workers:")
+    workers_label.grid(row=5, column=0, padx=5, pady=5, sticky='e')
+    workers_entry = tk.Spinbox(root, from_=1, to=64, width=5)
+    workers_entry.delete(0, tk.END)
+    workers_entry.insert(0, str(os.cpu_count() or 1))
+    workers_entry.grid(row=5, column=1, padx=5, pady=5, sticky='w')
+
+    # Recursive option
+    recursive_var = tk.BooleanVar()
+    recursive_check = tk.Checkbutton(root, text="Process subdirectories recursively", variable=recursive_var)
+    recursive_check.grid(row=6, column=1, padx=5, pady=5, sticky='w')
+
+    # Retry option (otherwise unfinished jobs from the last run are resumed)
+    retry_failed_var = tk.BooleanVar()
+    retry_failed_check = tk.Checkbutton(root, text="Only retry files that failed last time", variable=retry_failed_var)
+    retry_failed_check.grid(row=7, column=1, padx=5, pady=5, sticky='w')
+
+    # Start and cancel buttons
+    start_button = tk.Button(root, text="Start Conversion", command=start_conversion)
+    start_button.grid(row=8, column=1, padx=5, pady=10)
+    plan_button = tk.Button(root, text="Plan", command=start_plan)
+    plan_button.grid(row=8, column=0, padx=5, pady=10)
+    cancel_button = tk.Button(root, text="Cancel", command=cancel_conversion, state=tk.DISABLED)
+    cancel_button.grid(row=8, column=2, padx=5, pady=10)
+    cancel_event = None
+
+    # Progress display
+    progress_label = tk.Label(root, text="")
+    progress_label.grid(row=9, column=0, columnspan=3, padx=5, pady=5)
+    progress_bar = ttk.Progressbar(root, orient='horizontal', length=400, mode='determinate')
+    progress_bar.grid(row=10, column=0, columnspan=3, padx=5, pady=5)
+
+    # Per-file status
+    files_view = ttk.Treeview(root, columns=('file', 'status'), show='headings', height=10)
+    files_view.heading('file', text="File")
+    files_view.heading('status', text="Status")
+    files_view.column('file', width=420)
+    files_view.column('status', width=90)
+    files_view.grid(row=11, column=0, columnspan=3, padx=5, pady=5, sticky='nsew')
+
+    # Set window close protocol
+    root.protocol("WM_DELETE_WINDOW", on_closing)
+
+    root.mainloop()
@@ -3,6 +3,10 @@ import sys
 import random
 import copy
 import time
+import argparse
+
+import chess_search
+from GPTChess2 import FEN_CASTLING, parse_fen
 
 # Initialize Pygame
 pygame.init()
@@ -30,6 +34,12 @@ pygame.display.set_caption("Chess AI vs. Chess AI")
 WHITE_PIECES = ['K', 'Q', 'R', 'B', 'N', 'P']
 BLACK_PIECES = ['k', 'q', 'r', 'b', 'n', 'p']
 EMPTY = ' '
+ALL_CASTLING = 'KQkq'  # Castling rights as in FEN: K/Q white kingside/queenside, k/q black
+# Per right: (king row, rook column, columns that must be empty, column the king crosses, king destination column)
+CASTLING_PATHS = {'K': (7, 7, (5, 6), 5, 6), 'Q': (7, 0, (1, 2, 3), 3, 2),
+                  'k': (0, 7, (5, 6), 5, 6), 'q': (0, 0, (1, 2, 3), 3, 2)}
+# King and rook squares of each right
+CASTLING_SQUARES = {right: {(row, 4), (row, rook_y)} for right, (row, rook_y, *_) in CASTLING_PATHS.items()}
 
 # Fonts
 INFO_FONT = pygame.font.SysFont('Arial', 24)
@@ -52,10 +62,45 @@ def initialize_board():
     ]
     return board
 
+def board_from_fen(fen):
+    """Return (board, color to move, castling rights) for a FEN string."""
+    pieces, color, castling = parse_fen(fen)
+    board = [[EMPTY] * 8 for _ in range(8)]
+    for piece_color, piece_type, x, y in pieces:
+        board[x][y] = piece_type if piece_color == 'white' else piece_type.lower()
+    return board, color, ''.join(right for right, bit in FEN_CASTLING.items() if castling & bit)
+
 def is_in_bounds(x, y):
     return 0 <= x < 8 and 0 <= y < 8
 
-def get_all_possible_moves(board, color):
+def offset_squares(offsets):
+    """For every (x, y), the on-board squares one of offsets away."""
+    return [[[(x + dx, y + dy) for dx, dy in offsets if is_in_bounds(x + dx, y + dy)] for y in range(8)]
+            for x in range(8)]
+
+def ray_squares(directions):
+    """For every (x, y), one list per direction of the squares out to the edge, nearest first."""
+    table = [[[] for _ in range(8)] for _ in range(8)]
+    for x in range(8):
+        for y in range(8):
+            for dx, dy in directions:
+                ray = []
+                nx, ny = x + dx, y + dy
+                while is_in_bounds(nx, ny):
+                    ray.append((nx, ny))
+                    nx, ny = nx + dx, ny + dy
+                if ray:
+                    table[x][y].append(ray)
+    return table
+
+# Precomputed attack geometry for check detection
+KNIGHT_SQUARES = offset_squares([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING_SQUARES = offset_squares([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+STRAIGHT_RAYS = ray_squares([(-1, 0), (1, 0), (0, -1), (0, 1)])
+DIAGONAL_RAYS = ray_squares([(-1, -1), (-1, 1), (1, -1), (1, 1)])
+
+def get_all_possible_moves(board, color, castling=''):
+    """Moves of color that may leave its own king in check; castling lists the rights still held."""
     moves = []
     for i in range(8):
         for j in range(8):
@@ -63,23 +108,25 @@ def get_all_possible_moves(board, color):
             if piece == EMPTY:
                 continue
             if color == 'white' and piece in WHITE_PIECES:
-                piece_moves = get_piece_moves(board, i, j, piece, color)
+                piece_moves = get_piece_moves(board, i, j, piece, color, castling)
                 for move in piece_moves:
                     moves.append(((i, j), move))
             elif color == 'black' and piece in BLACK_PIECES:
-                piece_moves = get_piece_moves(board, i, j, piece, color)
+                piece_moves = get_piece_moves(board, i, j, piece, color, castling)
                 for move in piece_moves:
                     moves.append(((i, j), move))
     return moves
 
-def get_piece_moves(board, x, y, piece, color):
+def get_piece_moves(board, x, y, piece, color, castling=''):
     directions = []
     moves = []
     if piece.upper() == 'P':
         if color == 'white':
-            # Move forward
+            # Move forward, two squares from the starting rank
             if is_in_bounds(x-1, y) and board[x-1][y] == EMPTY:
                 moves.append((x-1, y))
+                if x == 6 and board[x-2][y] == EMPTY:
+                    moves.append((x-2, y))
             # Capture diagonally
             if y > 0 and is_in_bounds(x-1, y-1) and board[x-1][y-1] in BLACK_PIECES:
                 moves.append((x-1, y-1))
@@ -88,6 +135,8 @@ def get_piece_moves(board, x, y, piece, color):
         else:
             if is_in_bounds(x+1, y) and board[x+1][y] == EMPTY:
                 moves.append((x+1, y))
+                if x == 1 and board[x+2][y] == EMPTY:
+                    moves.append((x+2, y))
             if y > 0 and is_in_bounds(x+1, y-1) and board[x+1][y-1] in WHITE_PIECES:
                 moves.append((x+1, y-1))
             if y < 7 and is_in_bounds(x+1, y+1) and board[x+1][y+1] in WHITE_PIECES:
@@ -118,6 +167,17 @@ def get_piece_moves(board, x, y, piece, color):
                 target = board[nx][ny]
                 if target == EMPTY or (color == 'white' and target in BLACK_PIECES) or (color == 'black' and target in WHITE_PIECES):
                     moves.append((nx, ny))
+        # Castling: the right is held, the squares between are empty and the king is not in or passing through check
+        opponent = 'black' if color == 'white' else 'white'
+        rook = 'R' if color == 'white' else 'r'
+        for right in castling:
+            if (right in WHITE_PIECES) != (color == 'white'):
+                continue
+            row, rook_y, between, crossed_y, to_y = CASTLING_PATHS[right]
+            if ((x, y) == (row, 4) and board[row][rook_y] == rook and all(board[row][c] == EMPTY for c in between)
+                    and not square_attacked(board, row, 4, opponent)
+                    and not square_attacked(board, row, crossed_y, opponent)):
+                moves.append((row, to_y))
     if directions:
         for dx, dy in directions:
             nx, ny = x + dx, y + dy
@@ -138,6 +198,17 @@ def make_move(board, move):
     piece = board[x1][y1]
     board[x2][y2] = piece
     board[x1][y1] = EMPTY
+    if piece in ('K', 'k') and abs(y2 - y1) == 2:
+        # Castling: the rook jumps to the square the king crossed
+        rook_from, rook_to = (7, 5) if y2 > y1 else (0, 3)
+        board[x1][rook_to] = board[x1][rook_from]
+        board[x1][rook_from] = EMPTY
+    elif piece in ('P', 'p') and x2 in (0, 7):
+        board[x2][y2] = 'Q' if piece == 'P' else 'q'  # Promote to a queen
+
+def update_castling(castling, move):
+    """The castling rights left after move: moving a king or rook, or capturing a rook, loses them."""
+    return ''.join(right for right in castling if not {move[0], move[1]} & CASTLING_SQUARES[right])
 
 def find_king(board, color):
     king = 'K' if color == 'white' else 'k'
@@ -147,37 +218,106 @@ def find_king(board, color):
                 return (i, j)
     return None
 
-def is_in_check(board, color):
-    king_pos = find_king(board, color)
+def square_attacked(board, x, y, by_color):
+    """Return True if a piece of by_color attacks (x, y), looking outward from the square."""
+    if by_color == 'white':
+        pawn, knight, bishop, rook, queen, king = 'P', 'N', 'B', 'R', 'Q', 'K'
+        pawn_x = x + 1  # White pawns capture upward, so an attacker sits one row below
+    else:
+        pawn, knight, bishop, rook, queen, king = 'p', 'n', 'b', 'r', 'q', 'k'
+        pawn_x = x - 1
+    if is_in_bounds(pawn_x, y) and ((y > 0 and board[pawn_x][y-1] == pawn) or (y < 7 and board[pawn_x][y+1] == pawn)):
+        return True
+    for nx, ny in KNIGHT_SQUARES[x][y]:
+        if board[nx][ny] == knight:
+            return True
+    for nx, ny in KING_SQUARES[x][y]:
+        if board[nx][ny] == king:
+            return True
+    for rays, slider in ((STRAIGHT_RAYS, rook), (DIAGONAL_RAYS, bishop)):
+        for ray in rays[x][y]:
+            for nx, ny in ray:
+                target = board[nx][ny]
+                if target != EMPTY:
+                    if target == slider or target == queen:
+                        return True
+                    break
+    return False
+
+def king_after(move, king_pos):
+    """Where the king stands after move, given where it stood before."""
+    return move[1] if move[0] == king_pos else king_pos
+
+def is_in_check(board, color, king_pos=None):
+    """Return True if color's king is attacked; pass king_pos when it is already known to skip the search."""
+    king_pos = king_pos or find_king(board, color)
     if not king_pos:
         return True  # King is missing, considered in check
     opponent = 'black' if color == 'white' else 'white'
-    opponent_moves = get_all_possible_moves(board, opponent)
-    for move in opponent_moves:
-        _, (x, y) = move
-        if (x, y) == king_pos:
-            return True
-    return False
+    return square_attacked(board, king_pos[0], king_pos[1], opponent)
 
-def has_any_moves(board, color):
-    moves = get_all_possible_moves(board, color)
+def has_any_moves(board, color, castling=''):
+    moves = get_all_possible_moves(board, color, castling)
+    king_pos = find_king(board, color)
     for move in moves:
         temp_board = copy.deepcopy(board)
         make_move(temp_board, move)
-        if not is_in_check(temp_board, color):
+        if not is_in_check(temp_board, color, king_after(move, king_pos)):
             return True
     return False
 
-def is_checkmate(board, color):
-    if is_in_check(board, color) and not has_any_moves(board, color):
+def is_checkmate(board, color, castling=''):
+    if is_in_check(board, color) and not has_any_moves(board, color, castling):
         return True
     return False
 
-def is_stalemate(board, color):
-    if not is_in_check(board, color) and not has_any_moves(board, color):
+def is_stalemate(board, color, castling=''):
+    if not is_in_check(board, color) and not has_any_moves(board, color, castling):
         return True
     return False
 
+class SearchBoard:
+    """The GPTChess2.Board move API over a board of this module, so chess_search can play it."""
+
+    def __init__(self, board, castling=ALL_CASTLING):
+        self.board = board
+        self.castling = castling
+        self.undo_stack = []
+
+    def get_all_legal_moves(self, color):
+        return get_all_possible_moves(self.board, color, self.castling)
+
+    def make_move(self, from_pos, to_pos):
+        (x1, y1), (x2, y2) = from_pos, to_pos
+        self.undo_stack.append((from_pos, to_pos, self.board[x1][y1], self.board[x2][y2], self.castling))
+        make_move(self.board, (from_pos, to_pos))
+        self.castling = update_castling(self.castling, (from_pos, to_pos))
+
+    def unmake_move(self):
+        (x1, y1), (x2, y2), piece, target, self.castling = self.undo_stack.pop()
+        self.board[x1][y1] = piece  # The pawn, if the move promoted it
+        self.board[x2][y2] = target
+        if piece in ('K', 'k') and abs(y2 - y1) == 2:
+            rook_from, rook_to = (7, 5) if y2 > y1 else (0, 3)
+            self.board[x1][rook_from] = self.board[x1][rook_to]
+            self.board[x1][rook_to] = EMPTY
+
+    def is_in_check(self, color):
+        return is_in_check(self.board, color)
+
+    def piece_at(self, row, col):
+        piece = self.board[row][col]
+        if piece == EMPTY:
+            return None
+        return ('white' if piece.isupper() else 'black'), piece.upper()
+
+    def iter_pieces(self):
+        for i in range(8):
+            for j in range(8):
+                piece = self.board[i][j]
+                if piece != EMPTY:
+                    yield ('white' if piece.isupper() else 'black'), piece.upper(), i, j
+
 def draw_board(win, board, selected_move=None):
     # Draw squares
     for row in range(ROWS):
@@ -253,8 +393,10 @@ def display_info(win, text):
     text_rect = info_text.get_rect(center=(WIDTH//2, HEIGHT + 50))
     win.blit(info_text, text_rect)
 
-def main():
+def main(ai='random', think_time=1.0):
+    """Run the game window; ai is 'random' or 'search' (alpha-beta with think_time seconds per move)."""
     board = initialize_board()
+    castling = ALL_CASTLING
     clock = pygame.time.Clock()
     current_color = 'white'
     move_count = 1
@@ -272,12 +414,13 @@ def main():
 
         if not game_over:
             # Get all legal moves
-            all_moves = get_all_possible_moves(board, current_color)
+            all_moves = get_all_possible_moves(board, current_color, castling)
+            king_pos = find_king(board, current_color)
             legal_moves = []
             for move in all_moves:
                 temp_board = copy.deepcopy(board)
                 make_move(temp_board, move)
-                if not is_in_check(temp_board, current_color):
+                if not is_in_check(temp_board, current_color, king_after(move, king_pos)):
                     legal_moves.append(move)
             
             if not legal_moves:
@@ -288,9 +431,15 @@ def main():
                     info = "Stalemate! It's a draw."
                 game_over = True
             else:
-                # AI selects a random move
-                selected_move = random.choice(legal_moves)
+                # AI selects a move
+                if ai == 'search':
+                    result = chess_search.search(SearchBoard(board, castling), current_color, max_time=think_time)
+                    print(f"{current_color.capitalize()}: {chess_search.format_result(result)}")
+                    selected_move = result.move
+                else:
+                    selected_move = random.choice(legal_moves)
                 make_move(board, selected_move)
+                castling = update_castling(castling, selected_move)
                 (x1, y1), (x2, y2) = selected_move
                 piece = board[x2][y2]
                 from_square = f"{chr(y1 + ord('a'))}{8 - x1}"
@@ -300,10 +449,10 @@ def main():
 
                 # Check for checkmate or stalemate after the move
                 opponent = 'black' if current_color == 'white' else 'white'
-                if is_checkmate(board, opponent):
+                if is_checkmate(board, opponent, castling):
                     info = f"Checkmate! {current_color.capitalize()} wins!"
                     game_over = True
-                elif is_stalemate(board, opponent):
+                elif is_stalemate(board, opponent, castling):
                     info = "Stalemate! It's a draw."
                     game_over = True
                 else:
@@ -325,4 +474,9 @@ def main():
     sys.exit()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Watch two chess AIs play each other')
+    parser.add_argument('--ai', choices=('random', 'search'), default='random',
+                        help="Move picker: random moves or alpha-beta search")
+    parser.add_argument('--time', type=float, default=chess_search.DEFAULT_TIME, help='Seconds of search per move')
+    args = parser.parse_args()
+    main(args.ai, args.time)
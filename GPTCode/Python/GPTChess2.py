@@ -1,5 +1,5 @@
 import random
-import copy
+import argparse
 
 # Define constants for piece types and colors
 WHITE, BLACK = 'white', 'black'
@@ -15,6 +15,85 @@ piece_names = {
     'K': 'King'
 }
 
+def offset_squares(offsets):
+    """For every (row, col), the on-board squares one of offsets away."""
+    return [[[(row + dr, col + dc) for dr, dc in offsets if 0 <= row + dr < 8 and 0 <= col + dc < 8]
+             for col in range(8)] for row in range(8)]
+
+def ray_squares(directions):
+    """For every (row, col), one list per direction of the squares out to the edge, nearest first."""
+    table = [[[] for _ in range(8)] for _ in range(8)]
+    for row in range(8):
+        for col in range(8):
+            for dr, dc in directions:
+                ray = []
+                r, c = row + dr, col + dc
+                while 0 <= r < 8 and 0 <= c < 8:
+                    ray.append((r, c))
+                    r, c = r + dr, c + dc
+                if ray:
+                    table[row][col].append(ray)
+    return table
+
+# Castling rights, one bit per king and side
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+ALL_CASTLING = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+# Rights kept when a move starts or ends on a square (row * 8 + col): moving a king or rook, or capturing a rook, loses them
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[60] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[63] &= ~WHITE_KINGSIDE
+CASTLING_MASK[56] &= ~WHITE_QUEENSIDE
+CASTLING_MASK[4] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[7] &= ~BLACK_KINGSIDE
+CASTLING_MASK[0] &= ~BLACK_QUEENSIDE
+# King and rook squares of each castling right
+CASTLING_SQUARES = {WHITE_KINGSIDE: ((7, 4), (7, 7)), WHITE_QUEENSIDE: ((7, 4), (7, 0)),
+                    BLACK_KINGSIDE: ((0, 4), (0, 7)), BLACK_QUEENSIDE: ((0, 4), (0, 0))}
+FEN_CASTLING = {'K': WHITE_KINGSIDE, 'Q': WHITE_QUEENSIDE, 'k': BLACK_KINGSIDE, 'q': BLACK_QUEENSIDE}
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Zobrist keys: a position's key is the XOR of one random 64-bit number per piece on its square, its castling
+# rights and the side to move. Seeded, so keys are the same in every run and on both board backends.
+zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = {color: {piece_type: [zobrist_random.getrandbits(64) for _ in range(64)] for piece_type in piece_names}
+                  for color in (WHITE, BLACK)}
+ZOBRIST_CASTLING = [zobrist_random.getrandbits(64) for _ in range(16)]
+ZOBRIST_SIDE = zobrist_random.getrandbits(64)  # XORed in when black is to move
+
+# Precomputed attack geometry for check detection
+KNIGHT_SQUARES = offset_squares([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING_SQUARES = offset_squares([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+STRAIGHT_RAYS = ray_squares([(-1, 0), (1, 0), (0, -1), (0, 1)])
+DIAGONAL_RAYS = ray_squares([(-1, -1), (-1, 1), (1, -1), (1, 1)])
+
+def parse_fen(fen):
+    """Split a FEN string into ([(color, type, row, col), ...], color to move, castling rights).
+
+    The en passant square and move counters are ignored; the boards do not play en passant.
+    """
+    fields = fen.split()
+    ranks = fields[0].split('/') if fields else []
+    if len(ranks) != 8:
+        raise ValueError(f"FEN needs 8 ranks: {fen!r}")
+    pieces = []
+    for row, rank in enumerate(ranks):
+        col = 0
+        for char in rank:
+            if char.isdigit():
+                col += int(char)
+            elif char.upper() in piece_names:
+                pieces.append((WHITE if char.isupper() else BLACK, char.upper(), row, col))
+                col += 1
+            else:
+                raise ValueError(f"Bad piece {char!r} in FEN: {fen!r}")
+        if col != 8:
+            raise ValueError(f"Rank {8 - row} does not have 8 squares in FEN: {fen!r}")
+    color = BLACK if len(fields) > 1 and fields[1] == 'b' else WHITE
+    castling = 0
+    for char in fields[2] if len(fields) > 2 else '':
+        castling |= FEN_CASTLING.get(char, 0)
+    return pieces, color, castling
+
 class Piece:
     def __init__(self, type, color):
         self.type = type  # 'P', 'N', 'B', 'R', 'Q', 'K'
@@ -28,7 +107,37 @@ class Board:
     def __init__(self):
         self.board = self.create_initial_board()
         self.current_turn = WHITE
+        self.first_turn = WHITE  # Side to move before the first move in move_history
         self.move_history = []
+        self.undo_stack = []  # State make_move changed beyond the squares, for unmake_move
+        self.king_positions = {WHITE: (7, 4), BLACK: (0, 4)}  # Kept up to date by make_move/unmake_move
+        self.castling = ALL_CASTLING  # Castling rights, for the Zobrist key
+        self.zobrist_key = self.compute_zobrist_key()
+        self.key_history = []  # Zobrist key before each move, for repetition detection
+
+    def load_fen(self, fen):
+        """Set up the position of a FEN string, with an empty move history."""
+        pieces, color, castling = parse_fen(fen)
+        self.board = [[None for _ in range(8)] for _ in range(8)]
+        self.king_positions = {WHITE: None, BLACK: None}
+        for piece_color, piece_type, row, col in pieces:
+            piece = Piece(piece_type, piece_color)
+            # Pawns off their starting rank cannot push two squares; kings and rooks may castle only with the right
+            piece.has_moved = row != (6 if piece_color == WHITE else 1) if piece_type == PAWN else True
+            self.board[row][col] = piece
+            if piece_type == KING:
+                self.king_positions[piece_color] = (row, col)
+        for right, squares in CASTLING_SQUARES.items():
+            if castling & right:
+                for row, col in squares:
+                    if self.board[row][col]:
+                        self.board[row][col].has_moved = False
+        self.current_turn = self.first_turn = color
+        self.move_history = []
+        self.undo_stack = []
+        self.castling = castling
+        self.zobrist_key = self.compute_zobrist_key()
+        self.key_history = []
 
     def create_initial_board(self):
         # Initialize an 8x8 board with starting positions
@@ -58,6 +167,35 @@ class Board:
         print("  +------------------------+")
         print("    a b c d e f g h\n")
 
+    def iter_pieces(self):
+        """Yield (color, type, row, col) for every piece on the board."""
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece:
+                    yield piece.color, piece.type, row, col
+
+    def piece_at(self, row, col):
+        """(color, type) of the piece on (row, col), or None."""
+        piece = self.board[row][col]
+        return (piece.color, piece.type) if piece else None
+
+    def compute_zobrist_key(self):
+        """Zobrist key of the position from scratch; make_move keeps zobrist_key up to date incrementally."""
+        key = ZOBRIST_CASTLING[self.castling]
+        if len(self.move_history) % 2 != (self.first_turn == BLACK):
+            key ^= ZOBRIST_SIDE
+        for color, piece_type, row, col in self.iter_pieces():
+            key ^= ZOBRIST_PIECES[color][piece_type][row * 8 + col]
+        return key
+
+    def repetitions(self):
+        """How many times the current position occurred earlier with the same side to move."""
+        return self.key_history[-2::-2].count(self.zobrist_key)
+
+    def is_threefold_repetition(self):
+        return self.repetitions() >= 2
+
     def is_in_bounds(self, row, col):
         return 0 <= row < 8 and 0 <= col < 8
 
@@ -121,17 +259,20 @@ class Board:
                     target = self.board[new_row][new_col]
                     if not target or target.color != piece.color:
                         moves.append((new_row, new_col))
-            # Castling (simplified, not checking all conditions)
-            if not piece.has_moved:
+            # Castling: never out of or through check (landing in check is filtered like any other move)
+            opponent = BLACK if piece.color == WHITE else WHITE
+            if not piece.has_moved and not self.is_square_attacked(row, col, opponent):
                 # Kingside
                 if all(self.board[row][c] is None for c in range(col+1, 7)):
                     rook = self.board[row][7]
-                    if rook and rook.type == ROOK and not rook.has_moved:
+                    if (rook and rook.type == ROOK and not rook.has_moved
+                            and not self.is_square_attacked(row, col + 1, opponent)):
                         moves.append((row, col + 2))
                 # Queenside
                 if all(self.board[row][c] is None for c in range(1, col)):
                     rook = self.board[row][0]
-                    if rook and rook.type == ROOK and not rook.has_moved:
+                    if (rook and rook.type == ROOK and not rook.has_moved
+                            and not self.is_square_attacked(row, col - 1, opponent)):
                         moves.append((row, col - 2))
         return moves
 
@@ -153,49 +294,106 @@ class Board:
         # Move the piece
         self.board[to_row][to_col] = piece
         self.board[from_row][from_col] = None
+        had_moved = piece.has_moved
         piece.has_moved = True
+        from_square = from_row * 8 + from_col
+        to_square = to_row * 8 + to_col
+        piece_keys = ZOBRIST_PIECES[piece.color][piece.type]
+        key = self.zobrist_key ^ ZOBRIST_SIDE ^ piece_keys[from_square] ^ piece_keys[to_square]
+        if target:
+            key ^= ZOBRIST_PIECES[target.color][target.type][to_square]
+        if piece.type == KING:
+            self.king_positions[piece.color] = to_pos
+        if target and target.type == KING:
+            self.king_positions[target.color] = None
         # Handle castling (move the rook)
+        rook_move = None
         if piece.type == KING and abs(to_col - from_col) == 2:
-            if to_col > from_col:  # Kingside
-                rook = self.board[from_row][7]
-                self.board[from_row][5] = rook
-                self.board[from_row][7] = None
-                rook.has_moved = True
-            else:  # Queenside
-                rook = self.board[from_row][0]
-                self.board[from_row][3] = rook
-                self.board[from_row][0] = None
-                rook.has_moved = True
-        # Handle pawn promotion (auto promote to Queen)
+            rook_from, rook_to = (7, 5) if to_col > from_col else (0, 3)  # Kingside or queenside
+            rook = self.board[from_row][rook_from]
+            self.board[from_row][rook_to] = rook
+            self.board[from_row][rook_from] = None
+            rook_move = (rook_from, rook_to, rook.has_moved)
+            rook.has_moved = True
+            rook_keys = ZOBRIST_PIECES[piece.color][ROOK]
+            key ^= rook_keys[from_row * 8 + rook_from] ^ rook_keys[from_row * 8 + rook_to]
+        # Handle pawn promotion (auto promote to Queen); unmake_move puts the pawn back
         if piece.type == PAWN and (to_row == 0 or to_row == 7):
             self.board[to_row][to_col] = Piece(QUEEN, piece.color)
+            key ^= piece_keys[to_square] ^ ZOBRIST_PIECES[piece.color][QUEEN][to_square]
+        castling = self.castling & CASTLING_MASK[from_square] & CASTLING_MASK[to_square]
+        key ^= ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_CASTLING[castling]
         # Record the move
         self.move_history.append((from_pos, to_pos, piece, target))
+        self.undo_stack.append((had_moved, rook_move, self.castling))
+        self.key_history.append(self.zobrist_key)
+        self.castling = castling
+        self.zobrist_key = key
 
-    def is_in_check(self, color):
-        # Find the king
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece and piece.type == KING and piece.color == color:
-                    king_pos = (row, col)
-                    break
-        # Check all opponent's moves to see if any can capture the king
-        opponent = BLACK if color == WHITE else WHITE
-        opponent_moves = self.get_all_legal_moves(opponent)
-        for move in opponent_moves:
-            _, to_pos = move
-            if to_pos == king_pos:
+    def unmake_move(self):
+        """Take back the last move made with make_move, restoring captures, flags, castling and promotion."""
+        from_pos, to_pos, piece, target = self.move_history.pop()
+        had_moved, rook_move, self.castling = self.undo_stack.pop()
+        self.zobrist_key = self.key_history.pop()
+        from_row, from_col = from_pos
+        to_row, to_col = to_pos
+        self.board[from_row][from_col] = piece
+        self.board[to_row][to_col] = target
+        piece.has_moved = had_moved
+        if piece.type == KING:
+            self.king_positions[piece.color] = from_pos
+        if target and target.type == KING:
+            self.king_positions[target.color] = to_pos
+        if rook_move is not None:
+            rook_from, rook_to, rook_had_moved = rook_move
+            rook = self.board[from_row][rook_to]
+            self.board[from_row][rook_from] = rook
+            self.board[from_row][rook_to] = None
+            rook.has_moved = rook_had_moved
+
+    def is_square_attacked(self, row, col, by_color):
+        """Return True if a piece of by_color attacks (row, col), looking outward from the square."""
+        board = self.board
+        # Pawns capture toward the other side, so an attacking pawn sits one row back toward its own side
+        pawn_row = row + 1 if by_color == WHITE else row - 1
+        if 0 <= pawn_row < 8:
+            for pawn_col in (col - 1, col + 1):
+                if 0 <= pawn_col < 8:
+                    piece = board[pawn_row][pawn_col]
+                    if piece and piece.type == PAWN and piece.color == by_color:
+                        return True
+        for r, c in KNIGHT_SQUARES[row][col]:
+            piece = board[r][c]
+            if piece and piece.type == KNIGHT and piece.color == by_color:
+                return True
+        for r, c in KING_SQUARES[row][col]:
+            piece = board[r][c]
+            if piece and piece.type == KING and piece.color == by_color:
                 return True
+        for rays, sliders in ((STRAIGHT_RAYS, (ROOK, QUEEN)), (DIAGONAL_RAYS, (BISHOP, QUEEN))):
+            for ray in rays[row][col]:
+                for r, c in ray:
+                    piece = board[r][c]
+                    if piece:
+                        if piece.color == by_color and piece.type in sliders:
+                            return True
+                        break
         return False
 
+    def is_in_check(self, color):
+        king_pos = self.king_positions[color]
+        if king_pos is None:
+            return False
+        return self.is_square_attacked(king_pos[0], king_pos[1], BLACK if color == WHITE else WHITE)
+
     def has_legal_moves(self, color):
         moves = self.get_all_legal_moves(color)
         for move in moves:
-            # Make the move on a copy of the board and check for check
-            board_copy = copy.deepcopy(self)
-            board_copy.make_move(move[0], move[1])
-            if not board_copy.is_in_check(color):
+            # Try the move in place and check for check
+            self.make_move(move[0], move[1])
+            in_check = self.is_in_check(color)
+            self.unmake_move()
+            if not in_check:
                 return True
         return False
 
@@ -208,27 +406,34 @@ class Board:
 def select_random_move(moves):
     return random.choice(moves) if moves else None
 
-def play_game():
-    board = Board()
+def play_game(board_class=None, choose_move=None):
+    """Play a game; board_class picks the backend (default: Board).
+
+    choose_move(board, color, safe_moves) returns the move to play; the
+    default picks a random one.
+    """
+    board = (board_class or Board)()
     board.print_board()
     while True:
         current_color = board.current_turn
-        legal_moves = board.get_all_legal_moves(current_color)
-        # Filter out moves that would put the king in check
-        safe_moves = []
-        for move in legal_moves:
-            board_copy = copy.deepcopy(board)
-            board_copy.make_move(move[0], move[1])
-            if not board_copy.is_in_check(current_color):
-                safe_moves.append(move)
+        if hasattr(board, 'get_safe_moves'):
+            safe_moves = board.get_safe_moves(current_color)
+        else:
+            # Filter out moves that would put the king in check
+            safe_moves = []
+            for move in board.get_all_legal_moves(current_color):
+                board.make_move(move[0], move[1])
+                if not board.is_in_check(current_color):
+                    safe_moves.append(move)
+                board.unmake_move()
         if not safe_moves:
             if board.is_in_check(current_color):
                 print(f"Checkmate! {BLACK if current_color == WHITE else WHITE} wins.")
             else:
                 print("Stalemate! It's a draw.")
             break
-        # Select a random move
-        move = select_random_move(safe_moves)
+        # Select a move (random unless a move picker was given)
+        move = choose_move(board, current_color, safe_moves) if choose_move else select_random_move(safe_moves)
         from_pos, to_pos = move
         board.make_move(from_pos, to_pos)
         print(f"{current_color.capitalize()} moves from {pos_to_notation(from_pos)} to {pos_to_notation(to_pos)}")
@@ -241,6 +446,9 @@ def play_game():
         if board.is_stalemate(opponent):
             print("Stalemate! It's a draw.")
             break
+        if board.is_threefold_repetition():
+            print("Draw by threefold repetition.")
+            break
         # Switch turns
         board.current_turn = opponent
 
@@ -249,4 +457,26 @@ def pos_to_notation(pos):
     return f"{chr(ord('a') + col)}{8 - row}"
 
 if __name__ == "__main__":
-    play_game()
+    parser = argparse.ArgumentParser(description='Play a game of computer chess against itself')
+    parser.add_argument('--backend', choices=('list', 'bitboard'), default='list',
+                        help="Board representation: 8x8 list of pieces or 64-bit bitboards")
+    parser.add_argument('--ai', choices=('random', 'search'), default='random',
+                        help="Move picker: random moves or alpha-beta search")
+    parser.add_argument('--depth', type=int, default=None, help='Deepest search depth in plies')
+    parser.add_argument('--nodes', type=int, default=None, help='Nodes searched per move')
+    parser.add_argument('--time', type=float, default=None, help='Seconds of search per move (default: 1)')
+    args = parser.parse_args()
+    board_class = Board
+    if args.backend == 'bitboard':
+        from chess_bitboard import BitBoard
+        board_class = BitBoard
+    choose_move = None
+    if args.ai == 'search':
+        import chess_search
+        tt = chess_search.TranspositionTable()
+
+        def choose_move(board, color, safe_moves):
+            result = chess_search.search(board, color, args.depth or chess_search.MAX_DEPTH, args.nodes, args.time, tt)
+            print(f"Search: {chess_search.format_result(result)}")
+            return result.move
+    play_game(board_class, choose_move)
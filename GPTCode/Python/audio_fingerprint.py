@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+"""Cheap acoustic fingerprints for spotting the same track in different files.
+
+A fingerprint is the duration, the loudness of the first two minutes, one
+bit per 100 ms frame set when the frame is louder than the one before it,
+and one byte per frame giving its brightness: the frequency of a sine with
+the same ratio of slope energy to signal energy, a cheap spectral centroid.
+Audio is decoded at 8 kHz, below every lossy codec's low-pass, so a FLAC
+rip, a WAV export and an M4A copy of one track land within a few bits and
+a few Hz of each other. The contour tells tracks apart by rhythm, the
+brightness by timbre and pitch; tones or silence with a flat contour only
+match when their spectra do too, and near-silent files never match.
+
+Fingerprints only propose groups: confirm_groups() keeps a duplicate only
+when its decoded PCM correlates with the canonical file's.
+"""
+
+import array
+import json
+import math
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+FINGERPRINT_FILENAME = '.opus_fingerprints.json'
+FINGERPRINT_VERSION = 2
+SAMPLE_RATE = 8000
+FRAME_SAMPLES = 800  # 100 ms frames
+MAX_SECONDS = 120
+MAX_BIT_DIFFERENCE = 0.05  # Share of differing bits still considered the same audio
+MIN_FRAMES = 20  # Clips shorter than 2 s are too short to compare reliably
+BRIGHTNESS_STEP = 16  # Hz per brightness byte (0-255 covers 0-4 kHz)
+MAX_BRIGHTNESS_DIFFERENCE = 60.0  # Mean Hz difference still considered the same audio
+SILENCE_RMS = 100  # Below about -50 dBFS a file is treated as silent and never grouped
+CONFIRM_SECONDS = 30  # Decoded audio compared by confirm_same_audio
+MAX_LAG_SECONDS = 0.5  # Largest offset between two copies (encoder delay, padding, a trimmed start)
+MIN_CORRELATION = 0.9
+LOSSLESS_EXTENSIONS = ('.flac', '.wav', '.aiff', '.alac', '.ape')
+
+def decode_pcm(input_file, seconds=None):
+    """Decode the first audio stream of input_file to mono 16-bit samples at SAMPLE_RATE, or None."""
+    cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-i', input_file, '-map', '0:a:0']
+    if seconds:
+        cmd += ['-t', str(seconds)]
+    cmd += ['-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-']
+    try:
+        result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    samples = array.array('h')
+    samples.frombytes(result.stdout[:len(result.stdout) // 2 * 2])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+def brightness(frame, energy):
+    """Frequency (Hz) of the sine whose slope-to-signal energy ratio matches frame's."""
+    if not energy:
+        return 0.0
+    slope = sum((b - a) * (b - a) for a, b in zip(frame, frame[1:]))
+    # For a sine of angular frequency w, mean (x[n] - x[n-1])^2 / mean x^2 = 2 - 2 cos w
+    ratio = min(slope / energy, 4.0)
+    return math.acos(1 - ratio / 2) * SAMPLE_RATE / (2 * math.pi)
+
+def fingerprint_file(input_file):
+    """Return (duration, bit_count, bits, rms, brightness) for input_file, or None if it cannot be decoded.
+
+    duration is measured on the decoded audio (capped at MAX_SECONDS for the
+    other fields, but the full length is reported), bits is an int
+    bit-string of the loudness contour, rms the loudness of the analysed
+    audio and brightness a bytes object with one BRIGHTNESS_STEP value per frame.
+    """
+    samples = decode_pcm(input_file)
+    if samples is None:
+        return None
+    duration = len(samples) / SAMPLE_RATE
+    energies = []
+    bright = bytearray()
+    for start in range(0, min(len(samples), MAX_SECONDS * SAMPLE_RATE) - FRAME_SAMPLES + 1, FRAME_SAMPLES):
+        frame = samples[start:start + FRAME_SAMPLES]
+        energy = sum(value * value for value in frame)
+        energies.append(energy)
+        bright.append(min(255, round(brightness(frame, energy) / BRIGHTNESS_STEP)))
+    bits = 0
+    for previous, current in zip(energies, energies[1:]):
+        bits = (bits << 1) | (current > previous)
+    rms = math.sqrt(sum(energies) / (len(energies) * FRAME_SAMPLES)) if energies else 0.0
+    return duration, max(len(energies) - 1, 0), bits, rms, bytes(bright)
+
+class FingerprintCache:
+    """Fingerprints stored next to the outputs, keyed by source path and revalidated by size/mtime."""
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, FINGERPRINT_FILENAME)
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == FINGERPRINT_VERSION:
+                self.entries = data.get('entries', {})
+        except (OSError, ValueError):
+            pass
+
+    def get(self, key, input_file):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(input_file)
+        except OSError:
+            return None
+        if entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+            return None
+        return (entry['duration'], entry['bit_count'], int(entry['bits'], 16), entry['rms'],
+                bytes.fromhex(entry['brightness']))
+
+    def put(self, key, input_file, fingerprint):
+        st = os.stat(input_file)
+        duration, bit_count, bits, rms, bright = fingerprint
+        self.entries[key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                             'duration': duration, 'bit_count': bit_count, 'bits': format(bits, 'x'),
+                             'rms': rms, 'brightness': bright.hex()}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': FINGERPRINT_VERSION, 'entries': self.entries}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+def fingerprint_files(files, cache, max_workers=None):
+    """Fingerprint (key, input_file) pairs in parallel, reusing cached results.
+
+    Returns {key: fingerprint} for every file that could be decoded.
+    """
+    fingerprints = {}
+    missing = []
+    for key, input_file in files:
+        cached = cache.get(key, input_file)
+        if cached is not None:
+            fingerprints[key] = cached
+        else:
+            missing.append((key, input_file))
+    if missing:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(fingerprint_file, [input_file for _, input_file in missing], chunksize=4)
+            for (key, input_file), fingerprint in zip(missing, results):
+                if fingerprint is not None:
+                    fingerprints[key] = fingerprint
+                    cache.put(key, input_file, fingerprint)
+        cache.save()
+    return fingerprints
+
+def same_audio(a, b):
+    """Return True if two fingerprints describe the same audio."""
+    duration_a, count_a, bits_a, rms_a, bright_a = a
+    duration_b, count_b, bits_b, rms_b, bright_b = b
+    if abs(duration_a - duration_b) > 1.0 or min(count_a, count_b) < MIN_FRAMES:
+        return False
+    if rms_a < SILENCE_RMS or rms_b < SILENCE_RMS:
+        return False  # Silence matches any other silence; never treat it as a duplicate
+    count = min(count_a, count_b)
+    # Compare the common prefix of the two contours
+    bits_a >>= count_a - count
+    bits_b >>= count_b - count
+    if bin(bits_a ^ bits_b).count('1') > count * MAX_BIT_DIFFERENCE:
+        return False
+    frames = min(len(bright_a), len(bright_b))
+    difference = sum(abs(x - y) for x, y in zip(bright_a, bright_b)) * BRIGHTNESS_STEP / frames
+    return difference <= MAX_BRIGHTNESS_DIFFERENCE
+
+def correlation(a, b, lag, start, length):
+    """Normalised correlation of a[start:start + length] with b shifted by lag samples."""
+    if start + lag < 0:
+        start = -lag
+    length = min(length, len(a) - start, len(b) - start - lag)
+    if length <= 0:
+        return 0.0
+    x = a[start:start + length]
+    y = b[start + lag:start + lag + length]
+    energy = math.sqrt(sum(v * v for v in x) * sum(v * v for v in y))
+    return sum(p * q for p, q in zip(x, y)) / energy if energy else 0.0
+
+def block_envelope(samples, block):
+    return [sum(v * v for v in samples[i:i + block]) for i in range(0, len(samples) - block + 1, block)]
+
+def confirm_same_audio(file_a, file_b):
+    """Decode the start of both files and return True if their PCM correlates at some small offset.
+
+    The offset is found coarsely on 10 ms energy envelopes, then to the
+    sample; the copies must then correlate by at least MIN_CORRELATION.
+    """
+    a = decode_pcm(file_a, CONFIRM_SECONDS)
+    b = decode_pcm(file_b, CONFIRM_SECONDS)
+    if not a or not b:
+        return False
+    block = SAMPLE_RATE // 100
+    env_a, env_b = block_envelope(a, block), block_envelope(b, block)
+    max_blocks = int(MAX_LAG_SECONDS * 100)
+    coarse = max(range(-max_blocks, max_blocks + 1), key=lambda lag: correlation(env_a, env_b, lag, 0, len(env_a)))
+    # Refine to the sample on one loud second, then check the whole decoded stretch
+    loudest = max(range(len(env_a)), key=env_a.__getitem__) * block
+    start = max(0, loudest - SAMPLE_RATE // 2)
+    lag = max(range(coarse * block - block, coarse * block + block + 1),
+              key=lambda lag: correlation(a, b, lag, start, SAMPLE_RATE))
+    return correlation(a, b, lag, 0, len(a)) >= MIN_CORRELATION
+
+def _confirm_pair(pair):
+    return confirm_same_audio(*pair)
+
+def confirm_groups(groups, input_files, max_workers=None):
+    """Keep only the duplicates whose decoded audio matches their canonical file.
+
+    groups is find_duplicates' {canonical_key: [duplicate_key, ...]} and
+    input_files maps keys to paths. Rejected duplicates drop out of the
+    result, so they are encoded like any other file.
+    """
+    pairs = [(canonical, key) for canonical, duplicates in groups.items() for key in duplicates]
+    if not pairs:
+        return {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(_confirm_pair, [(input_files[c], input_files[k]) for c, k in pairs], chunksize=2)
+        confirmed = {}
+        for (canonical, key), same in zip(pairs, results):
+            if same:
+                confirmed.setdefault(canonical, []).append(key)
+            else:
+                print(f'Not a duplicate after comparing audio: {input_files[key]} vs {input_files[canonical]}')
+    return confirmed
+
+def canonical_order(input_file):
+    """Sort key preferring lossless sources, then larger files, as the copy to encode."""
+    lossless = input_file.lower().endswith(LOSSLESS_EXTENSIONS)
+    try:
+        size = os.path.getsize(input_file)
+    except OSError:
+        size = 0
+    return (not lossless, -size, input_file)
+
+def find_duplicates(files, fingerprints):
+    """Group (key, input_file) pairs whose audio matches.
+
+    Returns {canonical_key: [duplicate_key, ...]} for every group with more
+    than one member; the canonical file is the best source to encode.
+    """
+    ordered = sorted((item for item in files if item[0] in fingerprints), key=lambda item: canonical_order(item[1]))
+    buckets = {}  # Rounded duration -> canonical keys, so only similar lengths are compared
+    groups = {}
+    for key, _ in ordered:
+        fingerprint = fingerprints[key]
+        bucket = round(fingerprint[0])
+        match = None
+        for nearby in (bucket - 1, bucket, bucket + 1):
+            for canonical in buckets.get(nearby, ()):
+                if same_audio(fingerprints[canonical], fingerprint):
+                    match = canonical
+                    break
+            if match:
+                break
+        if match:
+            groups[match].append(key)
+        else:
+            buckets.setdefault(bucket, []).append(key)
+            groups[key] = []
+    return {canonical: duplicates for canonical, duplicates in groups.items() if duplicates}
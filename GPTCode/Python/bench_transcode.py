@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""Benchmark the Opus converters on a reproducible synthetic corpus.
+
+The corpus is generated offline with ffmpeg's sine and noise sources, so
+every machine benchmarks the same audio. Each converter runs in a fresh
+Python process per worker count, which gives clean peak-RSS numbers.
+
+    python bench_transcode.py --workers 1,2,4 --output results.json
+    python bench_transcode.py --baseline results.json   # exit 1 on regression
+"""
+
+import argparse
+import json
+import os
+import queue
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+CORPUS_VERSION = 1
+CORPUS_MANIFEST = 'corpus.json'
+CONVERTERS = ('flac_to_opusHT2', 'flac_to_opusHT2-threads', 'F2OPUS', 'flac_to_opus')
+DEFAULT_THRESHOLD = 0.10  # Flag a regression when files/sec drops by more than this fraction
+
+# (duration in seconds, share of the corpus): mostly short clips plus a few long tracks
+DURATION_MIX = ((2, 0.5), (15, 0.3), (60, 0.15), (300, 0.05))
+FORMATS = (('.flac', ['-c:a', 'flac']), ('.wav', ['-c:a', 'pcm_s16le']), ('.mp3', ['-c:a', 'libmp3lame', '-b:a', '192k']))
+
+def corpus_plan(files, seed):
+    """Return the deterministic list of corpus entries for files and seed."""
+    rng = random.Random(seed)
+    plan = []
+    for idx in range(files):
+        duration = rng.choices([d for d, _ in DURATION_MIX], weights=[w for _, w in DURATION_MIX])[0]
+        ext, _ = rng.choice(FORMATS)
+        depth = rng.randint(0, 3)
+        rel_dir = '/'.join(f'd{rng.randint(0, 2)}' for _ in range(depth))
+        source = 'sine' if rng.random() < 0.5 else 'noise'
+        plan.append({
+            'path': os.path.join(rel_dir, f'track{idx:04d}{ext}'),
+            'duration': duration,
+            'source': source,
+            'frequency': rng.randint(110, 1760),
+            'seed': rng.randint(0, 2 ** 31 - 1),
+        })
+    return plan
+
+def generate_corpus(corpus_dir, files=40, seed=1234, scale=1.0):
+    """Generate (or reuse) the synthetic corpus and return its manifest."""
+    manifest_path = os.path.join(corpus_dir, CORPUS_MANIFEST)
+    settings = {'version': CORPUS_VERSION, 'files': files, 'seed': seed, 'scale': scale}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['settings'] == settings:
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    entries = corpus_plan(files, seed)
+    for entry in entries:
+        entry['duration'] = round(entry['duration'] * scale, 3)
+        if entry['source'] == 'sine':
+            lavfi = f"sine=frequency={entry['frequency']}:duration={entry['duration']}:sample_rate=44100"
+        else:
+            lavfi = f"anoisesrc=duration={entry['duration']}:color=pink:seed={entry['seed']}:sample_rate=44100"
+        output = os.path.join(corpus_dir, entry['path'])
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        codec = dict(FORMATS)[os.path.splitext(output)[1]]
+        cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+               '-f', 'lavfi', '-i', lavfi, '-ac', '2'] + codec + [output]
+        subprocess.run(cmd, check=True)
+    manifest = {
+        'settings': settings,
+        'files': entries,
+        'total_duration': sum(entry['duration'] for entry in entries),
+        'total_bytes': sum(os.path.getsize(os.path.join(corpus_dir, entry['path'])) for entry in entries),
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+def run_converter(converter, input_dir, output_dir, workers):
+    """Run one converter in this process (the child side of measure())."""
+    if converter.startswith('flac_to_opusHT2'):
+        import flac_to_opusHT2
+        supervisor = 'threads' if converter.endswith('-threads') else 'processes'
+        flac_to_opusHT2.convert_audio_to_opus_multiprocess(input_dir, output_dir, workers, supervisor=supervisor)
+    elif converter == 'F2OPUS':
+        import F2OPUS
+        # measure() has already copied the corpus here, since F2OPUS writes next to its inputs
+        F2OPUS.convert_directory(output_dir, '128k', '48000', True, queue.Queue(), workers=workers, backend='ffmpeg')
+    elif converter == 'flac_to_opus':
+        import flac_to_opus
+        flac_to_opus.convert_flac_to_opus(input_dir, output_dir, workers)
+    else:
+        raise ValueError(f'Unknown converter {converter}')
+
+def count_outputs(output_dir):
+    return sum(1 for _, _, files in os.walk(output_dir) for name in files if name.endswith('.opus'))
+
+def measure(converter, corpus_dir, manifest, workers):
+    """Time one converter run in a fresh process and return its metrics."""
+    with tempfile.TemporaryDirectory(prefix='bench_opus_') as output_dir, tempfile.TemporaryDirectory() as home_dir:
+        if converter == 'F2OPUS':
+            # F2OPUS writes next to its inputs, so it converts a private copy made outside the timing
+            shutil.copytree(corpus_dir, output_dir, dirs_exist_ok=True)
+        cmd = [sys.executable, os.path.abspath(__file__), '--run-one', converter,
+               '--corpus', corpus_dir, '--run-output', output_dir, '--workers', str(workers)]
+        with tempfile.TemporaryFile(mode='w+') as stderr_file:
+            start = time.perf_counter()
+            # A private HOME keeps benchmark runs out of the real throughput history in ~/.cache
+            proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=stderr_file,
+                                    env=dict(os.environ, HOME=home_dir))
+            _, status, usage = os.wait4(proc.pid, 0)
+            wall_time = time.perf_counter() - start
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            stderr_file.seek(0)
+            stderr = stderr_file.read()
+        if proc.returncode != 0:
+            raise RuntimeError(f'{converter} failed with status {proc.returncode}:\n{stderr}')
+        # The runner reports the peak RSS of itself and its children on its last stderr line
+        peak_rss_kib = max(usage.ru_maxrss, int(stderr.strip().splitlines()[-1]))
+        files = count_outputs(output_dir)
+    converted_duration = manifest['total_duration'] if converter != 'flac_to_opus' else sum(
+        entry['duration'] for entry in manifest['files'] if entry['path'].endswith('.flac'))
+    return {
+        'converter': converter,
+        'workers': workers,
+        'files': files,
+        'wall_time': round(wall_time, 3),
+        'files_per_sec': round(files / wall_time, 3),
+        'realtime_factor': round(converted_duration / wall_time, 2),
+        'peak_rss_mb': round(peak_rss_kib / 1024, 1),
+    }
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Return messages for results whose files/sec fell more than threshold below baseline."""
+    previous = {(r['converter'], r['workers']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        old = previous.get((result['converter'], result['workers']))
+        if old is None or not old['files_per_sec']:
+            continue
+        change = result['files_per_sec'] / old['files_per_sec'] - 1
+        if change < -threshold:
+            regressions.append(f"{result['converter']} x{result['workers']}: {old['files_per_sec']} -> "
+                               f"{result['files_per_sec']} files/sec ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Opus converters on a synthetic corpus')
+    parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'opus_bench_corpus'),
+                        help='Corpus directory (generated if missing or stale)')
+    parser.add_argument('--files', type=int, default=40, help='Number of corpus files (default: 40)')
+    parser.add_argument('--seed', type=int, default=1234, help='Corpus random seed')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply every corpus duration by this')
+    parser.add_argument('--converters', default=','.join(CONVERTERS),
+                        help=f"Comma-separated converters to run (default: {','.join(CONVERTERS)})")
+    parser.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts (default: 1,2,4)')
+    parser.add_argument('--output', help='Write results JSON here')
+    parser.add_argument('--baseline', help='Compare against a previous results JSON and exit 1 on regression')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Allowed files/sec drop before flagging a regression (default: 0.10)')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--run-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_converter(args.run_one, args.corpus, args.run_output, int(args.workers))
+        peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        print(peak, file=sys.stderr)
+        return
+
+    manifest = generate_corpus(args.corpus, args.files, args.seed, args.scale)
+    print(f"Corpus: {len(manifest['files'])} files, {manifest['total_duration'] / 60:.1f} min of audio in {args.corpus}")
+    results = []
+    for converter in args.converters.split(','):
+        for workers in [int(w) for w in args.workers.split(',')]:
+            result = measure(converter, args.corpus, manifest, workers)
+            results.append(result)
+            print(f"{converter:>24} x{workers:<3} {result['wall_time']:8.2f} s  {result['files_per_sec']:7.2f} files/s  "
+                  f"{result['realtime_factor']:8.1f}x realtime  {result['peak_rss_mb']:7.1f} MB peak")
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': os.uname().nodename,
+        'cpu_count': os.cpu_count(),
+        'corpus': manifest['settings'],
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('corpus') != manifest['settings']:
+            print('Warning: baseline was recorded on a different corpus.')
+        regressions = find_regressions(results, baseline, args.threshold)
+        for message in regressions:
+            print(f'REGRESSION {message}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions against baseline.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Perft for the chess move generators: count the positions reached from a
+position to a fixed depth and compare with known counts.
+
+Every backend is driven through the GPTChess2.Board move API
+(get_all_legal_moves, make_move, unmake_move, is_in_check), keeping the
+moves that do not leave the mover's king in check; boards with
+get_safe_moves (BitBoard) generate those directly. The last ply is counted
+without making its moves.
+
+    list      GPTChess2.Board
+    bitboard  chess_bitboard.BitBoard
+    gptchess  GPTChess.py's board, through GPTChess.SearchBoard
+
+None of the boards play en passant or underpromotions, so PERFT_POSITIONS
+only lists the depths whose published counts contain neither. That stops
+kiwipete at depth 1, so the rooks-and-kings positions check castling.
+
+    python chess_perft.py                                  # check every backend against PERFT_POSITIONS
+    python chess_perft.py --divide 3 --fen "<FEN>"         # per-move counts, to find where two generators differ
+    python chess_perft.py --bench --depth 4 --repeat 3     # nodes/s of each backend
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from GPTChess2 import WHITE, BLACK, START_FEN
+from chess_search import legal_moves
+
+BACKENDS = ('list', 'bitboard', 'gptchess')
+# (name, FEN, {depth: nodes}) from the standard perft suites (chessprogramming.org/Perft_Results)
+PERFT_POSITIONS = [
+    ('start', START_FEN, {1: 20, 2: 400, 3: 8902, 4: 197281}),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', {1: 48}),
+    ('position 3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', {1: 14, 2: 191}),
+    ('position 4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', {1: 6}),
+    ('position 4 mirrored', 'r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1', {1: 6}),
+    ('position 6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     {1: 46, 2: 2079, 3: 89890}),
+    # Rooks and kings only (perftsuite.epd), so every depth checks castling rights and castling
+    # out of and through check without en passant or promotions
+    ('castling', 'r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1', {1: 26, 2: 568, 3: 13744, 4: 314346}),
+    ('castling black', 'r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1', {1: 26, 2: 568, 3: 13744, 4: 314346}),
+    ('castling 1R2K2R', 'r3k2r/8/8/8/8/8/8/1R2K2R w Kkq - 0 1', {1: 25, 2: 567, 3: 14095, 4: 328965}),
+    ('castling 2r1k2r', '2r1k2r/8/8/8/8/8/8/R3K2R w KQk - 0 1', {1: 25, 2: 560, 3: 13592, 4: 317324}),
+]
+
+def new_board(backend, fen):
+    """Return (board, color to move) for fen on the named backend."""
+    if backend == 'list':
+        from GPTChess2 import Board
+        board = Board()
+    elif backend == 'bitboard':
+        from chess_bitboard import BitBoard
+        board = BitBoard()
+    else:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # GPTChess opens its window on import
+        import GPTChess
+        squares, color, castling = GPTChess.board_from_fen(fen)
+        return GPTChess.SearchBoard(squares, castling), color
+    board.load_fen(fen)
+    return board, board.current_turn
+
+def perft(board, color, depth):
+    """Number of legal move sequences of depth plies from the position, color to move."""
+    if depth == 0:
+        return 1
+    moves = legal_moves(board, color)
+    if depth == 1:
+        return len(moves)
+    opponent = BLACK if color == WHITE else WHITE
+    nodes = 0
+    for from_pos, to_pos in moves:
+        board.make_move(from_pos, to_pos)
+        nodes += perft(board, opponent, depth - 1)
+        board.unmake_move()
+    return nodes
+
+def divide(board, color, depth):
+    """perft split by root move: [(move, nodes)] for every legal move."""
+    opponent = BLACK if color == WHITE else WHITE
+    counts = []
+    for from_pos, to_pos in legal_moves(board, color):
+        board.make_move(from_pos, to_pos)
+        counts.append(((from_pos, to_pos), perft(board, opponent, depth - 1)))
+        board.unmake_move()
+    return counts
+
+def move_notation(move):
+    return ''.join(f"{chr(ord('a') + col)}{8 - row}" for row, col in move)
+
+def available_backends(backends):
+    """The backends that can be loaded here, reporting the ones that cannot."""
+    usable = []
+    for backend in backends:
+        try:
+            new_board(backend, START_FEN)
+        except ImportError as e:
+            print(f"{backend}: skipped ({e})")
+            continue
+        usable.append(backend)
+    return usable
+
+def check(backends, max_depth):
+    """Run PERFT_POSITIONS up to max_depth on each backend; return the number of wrong counts."""
+    failures = 0
+    for backend in backends:
+        total_nodes, total_seconds = 0, 0.0
+        for name, fen, counts in PERFT_POSITIONS:
+            for depth, expected in sorted(counts.items()):
+                if depth > max_depth:
+                    break
+                board, color = new_board(backend, fen)
+                started = time.perf_counter()
+                nodes = perft(board, color, depth)
+                seconds = time.perf_counter() - started
+                total_nodes += nodes
+                total_seconds += seconds
+                status = 'ok' if nodes == expected else f'FAIL (expected {expected})'
+                failures += nodes != expected
+                print(f"{backend:<9} {name:<20} depth {depth} {nodes:>9} nodes {seconds:>7.2f} s  {status}")
+        print(f"{backend:<9} {'total':<20}         {total_nodes:>9} nodes {total_seconds:>7.2f} s  "
+              f"({total_nodes / total_seconds if total_seconds else 0:.0f} nodes/s)")
+    return failures
+
+def bench(backends, fen, depth, repeat):
+    """Time perft(depth) of fen repeat times per backend and print the best nodes/s."""
+    for backend in backends:
+        best = None
+        for _ in range(repeat):
+            board, color = new_board(backend, fen)
+            started = time.perf_counter()
+            nodes = perft(board, color, depth)
+            seconds = time.perf_counter() - started
+            best = seconds if best is None else min(best, seconds)
+        print(f"{backend:<9} depth {depth} {nodes:>9} nodes {best:>7.2f} s  ({nodes / best if best else 0:.0f} nodes/s)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and time the chess move generators with perft')
+    parser.add_argument('--backend', choices=BACKENDS, action='append',
+                        help='Board backend to run (repeatable; default: all)')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='Deepest perft depth to check, or the depth to benchmark (default: 3)')
+    parser.add_argument('--divide', type=int, metavar='DEPTH', help='Print perft(DEPTH) per root move of --fen')
+    parser.add_argument('--fen', default=START_FEN, help='Position for --divide and --bench (default: start)')
+    parser.add_argument('--bench', action='store_true', help='Report nodes/s of each backend on --fen')
+    parser.add_argument('--repeat', type=int, default=1, help='Benchmark runs per backend; the best is reported')
+    args = parser.parse_args()
+    backends = available_backends(args.backend or BACKENDS)
+    if args.divide is not None:
+        for backend in backends:
+            board, color = new_board(backend, args.fen)
+            counts = divide(board, color, args.divide)
+            print(f"{backend}:")
+            for move, nodes in sorted(counts, key=lambda item: move_notation(item[0])):
+                print(f"  {move_notation(move)}: {nodes}")
+            print(f"  moves: {len(counts)}, nodes: {sum(nodes for _, nodes in counts)}")
+    elif args.bench:
+        bench(backends, args.fen, args.depth, args.repeat)
+    elif check(backends, args.depth):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,484 @@
+"""Alpha-beta search for the chess AIs in GPTChess.py and GPTChess2.py.
+
+search() works on any board with the GPTChess2.Board move API:
+get_all_legal_moves(color) returning pseudo-legal ((row, col), (row, col))
+moves, make_move(from_pos, to_pos), unmake_move(), is_in_check(color),
+iter_pieces() yielding (color, type, row, col) and piece_at(row, col)
+returning (color, type) or None. GPTChess2.Board, chess_bitboard.BitBoard
+and GPTChess.SearchBoard all provide it.
+
+Moves are searched by negamax with alpha-beta pruning, one depth at a time
+until the node or time budget runs out, with a quiescence search of
+captures at the horizon; positions are scored by material plus
+piece-square tables. Boards that keep a Zobrist key (zobrist_key,
+repetitions()) also get a transposition table and repetition draws.
+
+Run as a script to count the nodes each benchmark position needs to reach
+a depth, with and without move ordering and quiescence:
+
+    python chess_search.py --depth 4 --backend bitboard --compare
+"""
+
+import argparse
+import time
+from array import array
+from collections import namedtuple
+
+WHITE, BLACK = 'white', 'black'
+PIECE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+# Piece-square bonuses from white's side, row 0 = rank 8 (the simplified evaluation function tables)
+PIECE_SQUARE_TABLES = {
+    'P': [0, 0, 0, 0, 0, 0, 0, 0,
+          50, 50, 50, 50, 50, 50, 50, 50,
+          10, 10, 20, 30, 30, 20, 10, 10,
+          5, 5, 10, 25, 25, 10, 5, 5,
+          0, 0, 0, 20, 20, 0, 0, 0,
+          5, -5, -10, 0, 0, -10, -5, 5,
+          5, 10, 10, -20, -20, 10, 10, 5,
+          0, 0, 0, 0, 0, 0, 0, 0],
+    'N': [-50, -40, -30, -30, -30, -30, -40, -50,
+          -40, -20, 0, 0, 0, 0, -20, -40,
+          -30, 0, 10, 15, 15, 10, 0, -30,
+          -30, 5, 15, 20, 20, 15, 5, -30,
+          -30, 0, 15, 20, 20, 15, 0, -30,
+          -30, 5, 10, 15, 15, 10, 5, -30,
+          -40, -20, 0, 5, 5, 0, -20, -40,
+          -50, -40, -30, -30, -30, -30, -40, -50],
+    'B': [-20, -10, -10, -10, -10, -10, -10, -20,
+          -10, 0, 0, 0, 0, 0, 0, -10,
+          -10, 0, 5, 10, 10, 5, 0, -10,
+          -10, 5, 5, 10, 10, 5, 5, -10,
+          -10, 0, 10, 10, 10, 10, 0, -10,
+          -10, 10, 10, 10, 10, 10, 10, -10,
+          -10, 5, 0, 0, 0, 0, 5, -10,
+          -20, -10, -10, -10, -10, -10, -10, -20],
+    'R': [0, 0, 0, 0, 0, 0, 0, 0,
+          5, 10, 10, 10, 10, 10, 10, 5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          0, 0, 0, 5, 5, 0, 0, 0],
+    'Q': [-20, -10, -10, -5, -5, -10, -10, -20,
+          -10, 0, 0, 0, 0, 0, 0, -10,
+          -10, 0, 5, 5, 5, 5, 0, -10,
+          -5, 0, 5, 5, 5, 5, 0, -5,
+          0, 0, 5, 5, 5, 5, 0, -5,
+          -10, 5, 5, 5, 5, 5, 0, -10,
+          -10, 0, 5, 0, 0, 0, 0, -10,
+          -20, -10, -10, -5, -5, -10, -10, -20],
+    'K': [-30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -20, -30, -30, -40, -40, -30, -30, -20,
+          -10, -20, -20, -20, -20, -20, -20, -10,
+          20, 20, 0, 0, 0, 0, 20, 20,
+          20, 30, 10, 0, 0, 10, 30, 20],
+}
+# Material plus square bonus for each color, piece type and square, negative for black
+SQUARE_VALUES = {
+    WHITE: {piece_type: [PIECE_VALUES[piece_type] + bonus for bonus in table]
+            for piece_type, table in PIECE_SQUARE_TABLES.items()},
+    BLACK: {piece_type: [-PIECE_VALUES[piece_type] - table[(7 - square // 8) * 8 + square % 8] for square in range(64)]
+            for piece_type, table in PIECE_SQUARE_TABLES.items()},
+}
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_DEPTH = 64
+DEFAULT_TIME = 1.0  # Seconds per move when no budget is given
+TIME_CHECK_NODES = 1024  # Look at the clock this often
+MATE_BOUND = MATE_SCORE - 1000  # Scores beyond this are mates in some number of plies
+TT_SIZE_MB = 16
+EXACT, LOWER, UPPER = 1, 2, 3  # Transposition table bounds
+# Move ordering: hash move, then captures and promotions, then killers, then quiet moves by history
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 20
+PROMOTION_SCORE = 64
+KILLER_SCORE = CAPTURE_SCORE - 1
+HISTORY_LIMIT = 1 << 16
+ORDER_VALUES = {'P': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}  # MVV-LVA ranks
+
+SearchResult = namedtuple('SearchResult', 'move score depth nodes seconds nps')
+
+class SearchAborted(Exception):
+    """Raised inside the search when the node or time budget runs out."""
+
+def encode_move(move):
+    """Pack ((row, col), (row, col)) into 12 bits."""
+    (from_row, from_col), (to_row, to_col) = move
+    return (from_row * 8 + from_col) << 6 | to_row * 8 + to_col
+
+def decode_move(code):
+    from_square, to_square = code >> 6, code & 63
+    return (divmod(from_square, 8), divmod(to_square, 8))
+
+class TranspositionTable:
+    """Fixed-size table of searched positions, two slots per bucket.
+
+    Slot 0 of each bucket keeps the deepest result (or any result from an
+    older search), slot 1 always takes the newest. Keys and packed entries
+    live in two array('Q') columns, 16 bytes per slot:
+    score + INFINITY (21 bits) | depth (7) | bound (2) | move + 1 (13) | age (6).
+    """
+
+    def __init__(self, size_mb=TT_SIZE_MB):
+        buckets = 1
+        while buckets * 2 * 32 <= size_mb * 1024 * 1024:
+            buckets *= 2
+        self.mask = buckets - 1
+        self.keys = array('Q', bytes(buckets * 2 * 8))
+        self.data = array('Q', bytes(buckets * 2 * 8))
+        self.age = 0
+
+    def new_search(self):
+        """Mark earlier entries as stale so slot 0 can be reused."""
+        self.age = (self.age + 1) & 63
+
+    def clear(self):
+        self.keys = array('Q', bytes(len(self.keys) * 8))
+        self.data = array('Q', bytes(len(self.data) * 8))
+
+    def probe(self, key, ply):
+        """Return (score, depth, bound, move) stored for key, or None."""
+        index = (key & self.mask) << 1
+        keys = self.keys
+        if keys[index] != key:
+            index += 1
+            if keys[index] != key:
+                return None
+        entry = self.data[index]
+        score = (entry & 0x1FFFFF) - INFINITY
+        # Mates are stored relative to the position; make them relative to the root again
+        if score > MATE_BOUND:
+            score -= ply
+        elif score < -MATE_BOUND:
+            score += ply
+        move = (entry >> 30) & 0x1FFF
+        return score, (entry >> 21) & 0x7F, (entry >> 28) & 3, decode_move(move - 1) if move else None
+
+    def store(self, key, depth, bound, score, move, ply):
+        if score > MATE_BOUND:
+            score += ply
+        elif score < -MATE_BOUND:
+            score -= ply
+        entry = ((score + INFINITY) | min(depth, 127) << 21 | bound << 28
+                 | (encode_move(move) + 1 if move else 0) << 30 | self.age << 43)
+        index = (key & self.mask) << 1
+        old = self.data[index]
+        if self.keys[index] != key and (old >> 43) == self.age and ((old >> 21) & 0x7F) > depth:
+            index += 1  # Slot 0 holds a deeper result from this search
+        self.keys[index] = key
+        self.data[index] = entry
+
+    def usage(self):
+        """Fraction of slots filled."""
+        return 1 - self.keys.count(0) / len(self.keys)
+
+def evaluate(board, color):
+    """Score the position in centipawns from color's point of view."""
+    score = 0
+    for piece_color, piece_type, row, col in board.iter_pieces():
+        score += SQUARE_VALUES[piece_color][piece_type][row * 8 + col]
+    return score if color == WHITE else -score
+
+class Searcher:
+    """One search's state: the board, its budget, the transposition table and the move ordering tables.
+
+    With ordering, moves are tried hash move first, then captures and
+    promotions by MVV-LVA (most valuable victim, least valuable attacker),
+    then the two killer moves of the ply, then quiet moves by history score.
+    With quiescence, the horizon searches captures and promotions until the
+    position is quiet instead of scoring it mid-exchange.
+    """
+
+    def __init__(self, board, max_nodes=None, max_time=None, tt=None, ordering=True, quiescence=True):
+        self.board = board
+        self.tt = tt if tt and hasattr(board, 'zobrist_key') else None
+        # Boards with get_safe_moves only generate moves that keep the king out of check
+        self.safe_moves = hasattr(board, 'get_safe_moves')
+        self.max_nodes = max_nodes
+        self.deadline = time.perf_counter() + max_time if max_time else None
+        self.ordering = ordering
+        self.quiescence = quiescence
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(MAX_DEPTH + 1)]
+        self.history = {WHITE: [0] * 4096, BLACK: [0] * 4096}  # Indexed by encode_move
+
+    def count_node(self):
+        self.nodes += 1
+        if self.max_nodes and self.nodes >= self.max_nodes:
+            raise SearchAborted()
+        if self.deadline and self.nodes % TIME_CHECK_NODES == 0 and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+    def tactical_score(self, move):
+        """MVV-LVA score of a capture or promotion, or None for a quiet move."""
+        (from_row, from_col), (to_row, to_col) = move
+        attacker = self.board.piece_at(from_row, from_col)[1]
+        victim = self.board.piece_at(to_row, to_col)
+        score = ORDER_VALUES[victim[1]] * 8 - ORDER_VALUES[attacker] if victim else None
+        if attacker == 'P' and (to_row == 0 or to_row == 7):
+            score = (score or 0) + PROMOTION_SCORE
+        return score
+
+    def order_moves(self, moves, color, ply, hash_move):
+        """Sort moves best first for the search at ply."""
+        killers = self.killers[ply]
+        history = self.history[color]
+        piece_at = self.board.piece_at
+
+        def move_score(move):
+            if move == hash_move:
+                return HASH_MOVE_SCORE
+            (from_row, from_col), (to_row, to_col) = move
+            if piece_at(to_row, to_col) is not None or (
+                    (to_row == 0 or to_row == 7) and piece_at(from_row, from_col)[1] == 'P'):
+                return CAPTURE_SCORE + self.tactical_score(move)
+            if move == killers[0]:
+                return KILLER_SCORE
+            if move == killers[1]:
+                return KILLER_SCORE - 1
+            return history[(from_row * 8 + from_col) << 6 | to_row * 8 + to_col]
+
+        moves.sort(key=move_score, reverse=True)
+        return moves
+
+    def record_cutoff(self, move, color, depth, ply):
+        """Remember a quiet move that caused a beta cutoff as a killer and in the history table."""
+        if self.tactical_score(move) is not None:
+            return
+        killers = self.killers[ply]
+        if move != killers[0]:
+            killers[1], killers[0] = killers[0], move
+        history = self.history[color]
+        index = encode_move(move)
+        history[index] += depth * depth
+        if history[index] >= HISTORY_LIMIT:
+            # Age the whole table so history scores stay below the killers
+            self.history[color] = [value // 2 for value in history]
+
+    def quiesce(self, alpha, beta, color, ply):
+        """Score of the position once captures and promotions have played out."""
+        self.count_node()
+        board = self.board
+        best = evaluate(board, color)  # Standing pat: color need not capture
+        if best >= beta:
+            return best
+        if best > alpha:
+            alpha = best
+        opponent = BLACK if color == WHITE else WHITE
+        tactical = []
+        for move in board.get_safe_moves(color) if self.safe_moves else board.get_all_legal_moves(color):
+            score = self.tactical_score(move)
+            if score is not None:
+                tactical.append((score, move))
+        tactical.sort(key=lambda item: item[0], reverse=True)
+        for _, (from_pos, to_pos) in tactical:
+            board.make_move(from_pos, to_pos)
+            try:
+                if not self.safe_moves and board.is_in_check(color):
+                    continue  # Leaves our king in check
+                score = -self.quiesce(-beta, -alpha, opponent, ply + 1)
+            finally:
+                board.unmake_move()
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best
+
+    def negamax(self, depth, alpha, beta, color, ply):
+        """Score of the position for color to move, searched depth plies deep."""
+        board = self.board
+        if depth == 0 and self.quiescence:
+            return self.quiesce(alpha, beta, color, ply)
+        self.count_node()
+        tt = self.tt
+        hash_move = None
+        if tt is not None:
+            if board.repetitions():
+                return 0  # Repeating a position can at best be held to a draw
+            key = board.zobrist_key
+            entry = tt.probe(key, ply)
+            if entry is not None:
+                score, entry_depth, bound, hash_move = entry
+                if entry_depth >= depth and (bound == EXACT or (bound == LOWER and score >= beta)
+                                             or (bound == UPPER and score <= alpha)):
+                    return score
+        if depth == 0:
+            return evaluate(board, color)
+        opponent = BLACK if color == WHITE else WHITE
+        original_alpha = alpha
+        best, best_move = -INFINITY, None
+        moves = board.get_safe_moves(color) if self.safe_moves else board.get_all_legal_moves(color)
+        if self.ordering:
+            self.order_moves(moves, color, ply, hash_move)
+        for from_pos, to_pos in moves:
+            board.make_move(from_pos, to_pos)
+            try:
+                if not self.safe_moves and board.is_in_check(color):
+                    continue  # Leaves our king in check
+                score = -self.negamax(depth - 1, -beta, -alpha, opponent, ply + 1)
+            finally:
+                board.unmake_move()
+            if score > best:
+                best, best_move = score, (from_pos, to_pos)
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if self.ordering:
+                            self.record_cutoff(best_move, color, depth, ply)
+                        break
+        if best == -INFINITY:
+            # No legal move: checkmate (sooner is worse) or stalemate
+            best = -MATE_SCORE + ply if board.is_in_check(color) else 0
+        if tt is not None:
+            bound = LOWER if best >= beta else UPPER if best <= original_alpha else EXACT
+            tt.store(key, depth, bound, best, best_move, ply)
+        return best
+
+    def search_root(self, moves, depth, color):
+        """Return (best_move, score) over the legal root moves, searched to depth."""
+        board = self.board
+        opponent = BLACK if color == WHITE else WHITE
+        alpha, best_move = -INFINITY, None
+        for move in moves:
+            board.make_move(move[0], move[1])
+            try:
+                score = -self.negamax(depth - 1, -INFINITY, -alpha, opponent, 1)
+            finally:
+                board.unmake_move()
+            if score > alpha:
+                alpha, best_move = score, move
+        return best_move, alpha
+
+def legal_moves(board, color):
+    """The moves of color that do not leave its own king in check."""
+    if hasattr(board, 'get_safe_moves'):
+        return board.get_safe_moves(color)
+    moves = []
+    for move in board.get_all_legal_moves(color):
+        board.make_move(move[0], move[1])
+        if not board.is_in_check(color):
+            moves.append(move)
+        board.unmake_move()
+    return moves
+
+def search(board, color, max_depth=MAX_DEPTH, max_nodes=None, max_time=None, tt=None, ordering=True,
+           quiescence=True):
+    """Pick a move for color by iterative deepening; the board is left as it was.
+
+    Each depth is searched in full before the next starts, with the last
+    best move tried first. When max_nodes or max_time (seconds) runs out
+    the move from the deepest finished depth is returned. Without any
+    budget the search gets DEFAULT_TIME seconds. Returns a SearchResult;
+    its move is None when color has no legal move.
+
+    Pass the same TranspositionTable to every search of a game to reuse
+    its results; without one each search gets a fresh table, and with
+    tt=False the search runs without one.
+    """
+    if max_nodes is None and max_time is None and max_depth == MAX_DEPTH:
+        max_time = DEFAULT_TIME
+    started = time.perf_counter()
+    if tt is None and hasattr(board, 'zobrist_key'):
+        tt = TranspositionTable()
+    elif tt:
+        tt.new_search()
+    searcher = Searcher(board, max_nodes, max_time, tt, ordering, quiescence)
+    moves = legal_moves(board, color)
+    if ordering:
+        searcher.order_moves(moves, color, 0, None)
+    best_move, best_score, depth_reached = (moves[0] if moves else None), 0, 0
+    try:
+        for depth in range(1, max_depth + 1):
+            if not moves:
+                break
+            move, score = searcher.search_root(moves, depth, color)
+            best_move, best_score, depth_reached = move, score, depth
+            moves.remove(move)
+            moves.insert(0, move)
+            if abs(score) >= MATE_SCORE - MAX_DEPTH:
+                break  # A forced mate was found; deeper searches cannot change it
+    except SearchAborted:
+        pass
+    seconds = time.perf_counter() - started
+    return SearchResult(best_move, best_score, depth_reached, searcher.nodes, seconds,
+                        searcher.nodes / seconds if seconds > 0 else 0.0)
+
+def format_result(result):
+    """One-line summary of a SearchResult for the front ends."""
+    return (f"depth {result.depth}, score {result.score}, {result.nodes} nodes in {result.seconds:.2f} s "
+            f"({result.nps:.0f} nodes/s)")
+
+# Benchmark positions: opening lines in coordinate notation, played from the start position
+BENCHMARK_POSITIONS = [
+    ('start', ''),
+    ('italian', 'e2e4 e7e5 g1f3 b8c6 f1c4 f8c5 c2c3 g8f6 d2d3 d7d6 e1g1 e8g8'),
+    ('ruy lopez', 'e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 f1e1 b7b5 a4b3 d7d6'),
+    ('sicilian', 'e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3 a7a6 c1e3 e7e5 d4b3 c8e6'),
+    ('queens gambit', 'd2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c1g5 f8e7 e2e3 e8g8 g1f3 b8d7 a1c1 c7c6'),
+    ('kings indian', 'd2d4 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4 d7d6 g1f3 e8g8 f1e2 e7e5 e1g1 b8c6 d4d5 c6e7'),
+    ('open tactics', 'e2e4 e7e5 g1f3 b8c6 d2d4 e5d4 f3d4 g8f6 d4c6 b7c6 e4e5 d8e7 d1e2 f6d5 c2c4 c8a6'),
+]
+
+def parse_move(text):
+    """((row, col), (row, col)) for a move such as e2e4."""
+    return tuple((8 - int(text[i + 1]), ord(text[i]) - ord('a')) for i in (0, 2))
+
+def play_moves(board, moves):
+    """Play space-separated coordinate moves on board; return the color to move next."""
+    color = WHITE
+    for text in moves.split():
+        board.make_move(*parse_move(text))
+        color = BLACK if color == WHITE else WHITE
+    board.current_turn = color
+    return color
+
+def bench(board_class, depth, ordering=True, quiescence=True, use_tt=True):
+    """Search every benchmark position to depth; return [(name, SearchResult)]."""
+    results = []
+    for name, moves in BENCHMARK_POSITIONS:
+        board = board_class()
+        color = play_moves(board, moves)
+        results.append((name, search(board, color, depth, tt=None if use_tt else False, ordering=ordering,
+                                     quiescence=quiescence)))
+    return results
+
+def print_bench(label, results):
+    print(label)
+    for name, result in results:
+        print(f"  {name:<14} {result.nodes:>9} nodes {result.seconds:>7.2f} s  score {result.score:>6}")
+    nodes = sum(result.nodes for _, result in results)
+    seconds = sum(result.seconds for _, result in results)
+    print(f"  {'total':<14} {nodes:>9} nodes {seconds:>7.2f} s  ({nodes / seconds if seconds else 0:.0f} nodes/s)")
+    return nodes
+
+def main():
+    parser = argparse.ArgumentParser(description='Count the nodes the search needs on the benchmark positions')
+    parser.add_argument('--backend', choices=('list', 'bitboard'), default='list',
+                        help="Board representation: 8x8 list of pieces or 64-bit bitboards")
+    parser.add_argument('--depth', type=int, default=4, help='Search depth in plies (default: 4)')
+    parser.add_argument('--no-ordering', action='store_true', help='Search moves in generation order')
+    parser.add_argument('--no-quiescence', action='store_true', help='Score the horizon without resolving captures')
+    parser.add_argument('--no-tt', action='store_true', help='Search without a transposition table')
+    parser.add_argument('--compare', action='store_true',
+                        help='Run again with moves in generation order and compare node counts')
+    args = parser.parse_args()
+    if args.backend == 'bitboard':
+        from chess_bitboard import BitBoard as board_class
+    else:
+        from GPTChess2 import Board as board_class
+    nodes = print_bench(f"Depth {args.depth}, {args.backend} board",
+                        bench(board_class, args.depth, not args.no_ordering, not args.no_quiescence, not args.no_tt))
+    if args.compare:
+        unordered = print_bench("Without move ordering",
+                                bench(board_class, args.depth, False, not args.no_quiescence, not args.no_tt))
+        print(f"Move ordering searched {unordered / nodes if nodes else 0:.1f}x fewer nodes ({nodes} vs {unordered})")
+
+if __name__ == '__main__':
+    main()
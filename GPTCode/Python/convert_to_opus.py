@@ -1,39 +1,68 @@
 #!/usr/bin/env python3
 
 import argparse
-import subprocess
 import sys
 import os
+import time
+
+import pyav_opus
+import run_metrics
+from opus_engine import (EngineError, Rendition, encode, parse_rendition, rendition_name, convert_renditions,
+                         require_ffmpeg)
 
 def check_ffmpeg():
-    """Check if ffmpeg is installed."""
+    """Check that ffmpeg can encode Opus (probed once per ffmpeg binary, then cached)."""
     try:
-        subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except FileNotFoundError:
-        print("ffmpeg is not installed or not in PATH.")
+        require_ffmpeg()
+    except EngineError as e:
+        print(e)
         sys.exit(1)
 
-def convert_to_opus(input_file, output_file):
-    """Convert the input media file to an OPUS file."""
-    command = [
-        'ffmpeg',
-        '-i', input_file,
-        '-c:a', 'libopus',
-        '-b:a', '128k',  # Set audio bitrate (adjust as needed)
-        '-vn',           # Disable video recording
-        output_file
-    ]
-    try:
-        subprocess.run(command, check=True)
-        print(f"Converted {input_file} to {output_file}")
-    except subprocess.CalledProcessError as e:
-        print(f"An error occurred while converting {input_file}: {e}")
+def convert_to_opus(input_file, output_file, backend='auto'):
+    """Convert the input media file to an OPUS file.
+
+    backend is 'ffmpeg', 'pyav' or 'auto' (PyAV for small files when it is
+    installed). A failed PyAV encode falls back to the ffmpeg CLI.
+    """
+    started = time.time()
+    if pyav_opus.choose_backend(input_file, backend) == 'pyav':
+        try:
+            pyav_opus.encode_file(input_file, output_file, '128k')
+            print(f"Converted {input_file} to {output_file}")
+            run_metrics.record_file('convert_to_opus', input_file, output_file, started, 0, backend='pyav')
+            return
+        except Exception as e:
+            print(f"PyAV could not convert {input_file} ({e}); falling back to ffmpeg.")
+    check_ffmpeg()
+    ok, _ = encode(input_file, [(output_file, Rendition('128k', None, None))], converter='convert_to_opus',
+                   backend='ffmpeg')
+    if not ok:
+        sys.exit(1)
+    print(f"Converted {input_file} to {output_file}")
+
+def convert_to_renditions(input_file, output_dir, renditions):
+    """Encode every rendition of input_file from one decode, into output_dir/<rendition>/."""
+    check_ffmpeg()
+    name = os.path.splitext(os.path.basename(input_file))[0] + '.opus'
+    outputs = []
+    for rendition in renditions:
+        rendition_dir = os.path.join(output_dir, rendition_name(rendition))
+        os.makedirs(rendition_dir, exist_ok=True)
+        outputs.append((os.path.join(rendition_dir, name), rendition))
+    if not convert_renditions(input_file, outputs, converter='convert_to_opus'):
         sys.exit(1)
 
 def main():
     parser = argparse.ArgumentParser(description="Convert any media file to OPUS using ffmpeg")
     parser.add_argument('input', help='Input media file')
-    parser.add_argument('output', nargs='?', help='Output OPUS file')
+    parser.add_argument('output', nargs='?', help='Output OPUS file (output directory with --rendition)')
+    parser.add_argument('--backend', choices=('auto', 'ffmpeg', 'pyav'), default='auto',
+                        help='Encoder: ffmpeg CLI, in-process PyAV, or auto by file size (default)')
+    parser.add_argument('--rendition', action='append', type=parse_rendition, dest='renditions',
+                        metavar='BITRATE[:RATE[:CHANNELS]]',
+                        help='Write this rendition to OUTPUT/<rendition>/; repeat to encode a ladder from one decode')
+    parser.add_argument('--metrics-log', metavar='PATH',
+                        help='Append a JSONL event for this encode to PATH and write a Prometheus summary next to it')
     args = parser.parse_args()
 
     input_file = args.input
@@ -41,14 +70,30 @@ def main():
         print(f"Input file '{input_file}' does not exist.")
         sys.exit(1)
 
+    if args.metrics_log:
+        run_metrics.start_run(args.metrics_log)
+    try:
+        convert(args)
+    finally:
+        if args.metrics_log:
+            run_metrics.finish_run()
+
+def convert(args):
+    input_file = args.input
+    if args.renditions:
+        convert_to_renditions(input_file, args.output or os.path.dirname(input_file) or '.', args.renditions)
+        return
+
     if args.output:
         output_file = args.output
     else:
         base, _ = os.path.splitext(input_file)
         output_file = base + '.opus'
 
-    check_ffmpeg()
-    convert_to_opus(input_file, output_file)
+    if args.backend == 'pyav' and not pyav_opus.available():
+        print("PyAV is not installed; install it with 'pip install av' or use --backend ffmpeg.")
+        sys.exit(1)
+    convert_to_opus(input_file, output_file, args.backend)
 
 if __name__ == "__main__":
     main()
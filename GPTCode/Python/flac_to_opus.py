@@ -1,31 +1,31 @@
 import os
 import sys
-import subprocess
-
-def convert_flac_to_opus(input_dir, output_dir):
-    """Recursively convert FLAC files from input_dir to Opus in output_dir, preserving directory structure."""
-    for root, dirs, files in os.walk(input_dir):
-        for filename in files:
-            if filename.lower().endswith('.flac'):
-                flac_file = os.path.join(root, filename)
-                # Determine relative path to maintain folder structure
-                rel_path = os.path.relpath(root, input_dir)
-                output_subdir = os.path.join(output_dir, rel_path)
-                os.makedirs(output_subdir, exist_ok=True)
-                opus_filename = os.path.splitext(filename)[0] + '.opus'
-                opus_file = os.path.join(output_subdir, opus_filename)
-                cmd = [
-                    'ffmpeg',
-                    '-i', flac_file,
-                    '-c:a', 'libopus',
-                    '-b:a', '128k',  # Adjust the bitrate as needed
-                    opus_file
-                ]
-                print(f'Converting: {flac_file} to {opus_file}')
-                try:
-                    subprocess.run(cmd, check=True)
-                except subprocess.CalledProcessError as e:
-                    print(f'Error converting {flac_file}: {e}')
+from functools import partial
+
+from opus_engine import (EncodePool, EngineError, Rendition, TranscodeCache, convert_file, iter_media_files,
+                         rendition_settings, require_ffmpeg)
+
+def convert_flac_to_opus(input_dir, output_dir, max_workers=None):
+    """Recursively convert FLAC files from input_dir to Opus in output_dir, preserving directory structure.
+
+    Files already converted by an earlier run are skipped; the rest are
+    encoded on max_workers workers (default: available cores minus load).
+    """
+    cache = TranscodeCache(output_dir, rendition_settings(Rendition('128k', None, None)))
+
+    def finish(key, flac_file, opus_file, future):
+        if future.result():
+            cache.record(key, flac_file, opus_file)
+
+    try:
+        with EncodePool(max_workers, 'threads') as pool:
+            for key, flac_file, opus_file in iter_media_files(input_dir, output_dir, cache, extensions=('.flac',)):
+                os.makedirs(os.path.dirname(opus_file), exist_ok=True)
+                pool.submit(convert_file, flac_file, opus_file, '128k', None, 'flac_to_opus',
+                            on_done=partial(finish, key, flac_file, opus_file))
+    finally:
+        if cache.dirty:
+            cache.save()
 
 if __name__ == '__main__':
     if len(sys.argv) < 3:
@@ -38,6 +38,12 @@ if __name__ == '__main__':
         print(f'The input directory {input_dir} does not exist.')
         sys.exit(1)
 
+    try:
+        require_ffmpeg()
+    except EngineError as e:
+        print(e)
+        sys.exit(1)
+
     # Create the output directory if it doesn't exist
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
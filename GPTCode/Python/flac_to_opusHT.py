@@ -1,67 +1,103 @@
 import os
 import sys
-import subprocess
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+from functools import partial
 
-def convert_file(flac_file, opus_file):
-    """Convert a single FLAC file to Opus format."""
-    cmd = [
-        'ffmpeg',
-        '-i', flac_file,
-        '-c:a', 'libopus',
-        '-b:a', '128k',  # Adjust the bitrate as needed
-        opus_file
-    ]
-    print(f'Converting: {flac_file} to {opus_file}')
-    try:
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        print(f'Error converting {flac_file}: {e}')
+import run_metrics
+from opus_engine import (EncodePool, Rendition, SegmentedEncode, TranscodeCache, convert_file as engine_convert_file,
+                         encode_segment, iter_media_files, prefetch_iter, rendition_settings, segment_plan)
+
+def convert_file(flac_file, opus_file, timeout=None):
+    """Convert a single FLAC file to Opus format. Returns True on success."""
+    return engine_convert_file(flac_file, opus_file, '128k', timeout, converter='flac_to_opusHT')
+
+def convert_flac_to_opus_multiprocess(input_dir, output_dir, max_workers=None, supervisor='processes', timeout=None,
+                                      segment_over=None):
+    """Convert FLAC files to Opus format using multiprocessing.
+
+    Files are submitted as the directory walk finds them, with a bounded
+    number of jobs in flight; files already converted by an earlier run are
+    skipped. max_workers defaults to the available cores minus the load
+    average. supervisor='threads' runs ffmpeg children directly from a
+    thread pool instead of wrapping each one in a worker process; timeout
+    kills encoders that hang. Files longer than segment_over seconds are
+    split into segments encoded on separate workers and joined into one
+    Ogg Opus stream.
+    """
+    rendition = Rendition('128k', None, None)
+    cache = TranscodeCache(output_dir, rendition_settings(rendition))
+    created_dirs = set()
 
-def collect_flac_files(input_dir, output_dir):
-    """Collect all FLAC files and their corresponding output paths."""
-    flac_files = []
-    for root, dirs, files in os.walk(input_dir):
-        for filename in files:
-            if filename.lower().endswith('.flac'):
-                flac_file = os.path.join(root, filename)
-                # Determine relative path to maintain folder structure
-                rel_path = os.path.relpath(root, input_dir)
-                output_subdir = os.path.join(output_dir, rel_path)
-                os.makedirs(output_subdir, exist_ok=True)
-                opus_filename = os.path.splitext(filename)[0] + '.opus'
-                opus_file = os.path.join(output_subdir, opus_filename)
-                flac_files.append((flac_file, opus_file))
-    return flac_files
+    def finish_file(key, flac_file, opus_file, future):
+        try:
+            if future.result():
+                cache.record(key, flac_file, opus_file)
+        except Exception as e:
+            print(f'Error converting {flac_file}: {e}')
 
-def convert_flac_to_opus_multiprocess(input_dir, output_dir, max_workers=None):
-    """Convert FLAC files to Opus format using multiprocessing."""
-    flac_files = collect_flac_files(input_dir, output_dir)
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        future_to_file = {
-            executor.submit(convert_file, flac_file, opus_file): (flac_file, opus_file)
-            for flac_file, opus_file in flac_files
-        }
-        for future in as_completed(future_to_file):
-            flac_file, _ = future_to_file[future]
-            try:
-                future.result()
-            except Exception as e:
-                print(f'Error converting {flac_file}: {e}')
+    def finish_segment(key, job, future):
+        result = job.segment_done(future)
+        if result is None:
+            return
+        ok, error = result
+        if ok:
+            cache.record(key, job.input_file, job.output_file)
+            run_metrics.record_file('flac_to_opusHT', job.input_file, job.output_file, job.started, 0,
+                                    segments=len(job.plan))
+        elif error:
+            run_metrics.record_file('flac_to_opusHT', job.input_file, job.output_file, job.started, None, error,
+                                    segments=len(job.plan))
+
+    try:
+        with EncodePool(max_workers, supervisor) as pool:
+            files = iter_media_files(input_dir, output_dir, cache, extensions=('.flac',))
+            for key, flac_file, opus_file in prefetch_iter(files, pool.max_in_flight):
+                # Create output directories lazily, once, when the first file needs them
+                output_subdir = os.path.dirname(opus_file)
+                if output_subdir not in created_dirs:
+                    os.makedirs(output_subdir, exist_ok=True)
+                    created_dirs.add(output_subdir)
+                plan = segment_plan(flac_file, segment_over, pool.max_workers)
+                if plan is None:
+                    pool.submit(convert_file, flac_file, opus_file, timeout,
+                                on_done=partial(finish_file, key, flac_file, opus_file))
+                    continue
+                print(f'Converting: {flac_file} to {opus_file} in {len(plan)} segments')
+                job = SegmentedEncode(flac_file, opus_file, rendition, plan, timeout)
+                for args in job.segment_args():
+                    pool.submit(encode_segment, *args, on_done=partial(finish_segment, key, job))
+    finally:
+        if cache.dirty:
+            cache.save()
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print('Usage: python flac_to_opus.py input_directory output_directory')
-        sys.exit(1)
-    input_dir = sys.argv[1]
-    output_dir = sys.argv[2]
+    parser = argparse.ArgumentParser(description='Convert a directory tree of FLAC files to Opus')
+    parser.add_argument('input_dir', help='Input directory')
+    parser.add_argument('output_dir', help='Output directory')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of concurrent encodes (default: available cores minus load average)')
+    parser.add_argument('--supervisor', choices=('processes', 'threads'), default='processes',
+                        help="'threads' supervises ffmpeg from threads without per-file worker processes")
+    parser.add_argument('--timeout', type=float, default=None, help='Kill an encode after this many seconds')
+    parser.add_argument('--segment-over', type=float, default=None, metavar='SECONDS',
+                        help='Split inputs longer than this into segments encoded in parallel and joined losslessly')
+    parser.add_argument('--metrics-log', metavar='PATH',
+                        help='Append a JSONL event per encoded file to PATH and write a Prometheus summary at the end')
+    args = parser.parse_args()
 
-    if not os.path.isdir(input_dir):
-        print(f'The input directory {input_dir} does not exist.')
+    if not os.path.isdir(args.input_dir):
+        print(f'The input directory {args.input_dir} does not exist.')
         sys.exit(1)
 
     # Create the output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
 
-    convert_flac_to_opus_multiprocess(input_dir, output_dir)
+    if args.metrics_log:
+        run_metrics.start_run(args.metrics_log)
+    try:
+        convert_flac_to_opus_multiprocess(args.input_dir, args.output_dir, args.workers, args.supervisor,
+                                          args.timeout, args.segment_over)
+    finally:
+        if args.metrics_log:
+            run_metrics.finish_run()
@@ -1,71 +1,456 @@
 import os
 import sys
-import subprocess
-from concurrent.futures import ProcessPoolExecutor, as_completed
-
-def convert_file(input_file, output_file):
-    """Convert a single audio file to Opus format."""
-    cmd = [
-        'ffmpeg',
-        '-i', input_file,
-        '-c:a', 'libopus',
-        '-b:a', '128k',  # Adjust the bitrate as needed
-        output_file
-    ]
-    print(f'Converting: {input_file} to {output_file}')
+import json
+import time
+import tempfile
+import argparse
+import shutil
+import threading
+from collections import deque
+from functools import partial
+
+import ogg_opus
+import run_metrics
+from throughput_history import ThroughputHistory
+from audio_fingerprint import FingerprintCache, fingerprint_files, find_duplicates, confirm_groups
+from concurrent.futures import ThreadPoolExecutor
+from opus_engine import (Rendition, TranscodeCache, EncodePool, SegmentedEncode, parse_rendition, rendition_name,
+                         rendition_settings, convert_renditions, encode_segment, iter_media_files, prefetch_iter,
+                         probe_durations, segment_plan, default_worker_count)
+
+DUPLICATES_FILENAME = 'duplicates.json'
+READ_AHEAD_BUDGET = 1024 * 1024 * 1024  # Bytes of source files read ahead of the encoders
+READ_AHEAD_WORKERS = 2
+
+def iter_jobs(input_dir, trees):
+    """Yield (cache_key, input_file, stale) for each audio file with outputs left to produce.
+
+    trees is a list of (tree_dir, rendition, cache); stale lists the
+    (cache, output_file, rendition) entries that are missing or out of date.
+    """
+    for key, input_file, rel_output in iter_media_files(input_dir, ''):
+        stale = []
+        for tree_dir, rendition, cache in trees:
+            output_file = os.path.join(tree_dir, rel_output)
+            if not cache.is_current(key, input_file, output_file):
+                stale.append((cache, output_file, rendition))
+        if stale:
+            yield key, input_file, stale
+        else:
+            print(f'Skipping up-to-date file: {input_file}')
+
+def find_duplicate_files(input_dir, output_dir, max_workers=None):
+    """Fingerprint every audio file under input_dir and group acoustic duplicates.
+
+    Returns ({canonical_key: [duplicate_key, ...]}, {key: input_file}). The
+    fingerprints are cached in output_dir, so later runs only decode new or
+    changed files. Every proposed duplicate is confirmed by comparing its
+    decoded audio with the canonical file's before it is grouped.
+    """
+    files = [(key, input_file) for key, input_file, _ in iter_media_files(input_dir, '')]
+    fingerprints = fingerprint_files(files, FingerprintCache(output_dir), max_workers)
+    input_files = dict(files)
+    return confirm_groups(find_duplicates(files, fingerprints), input_files, max_workers), input_files
+
+def link_output(source, target):
+    """Make target a hard link to source (or a copy where links are unsupported)."""
+    tmp_path = target + '.part'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
     try:
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-        print(f'Error converting {input_file}: {e}')
-
-def collect_audio_files(input_dir, output_dir):
-    """Collect all audio files and their corresponding output paths, skipping existing output files."""
-    audio_extensions = ('.flac', '.mp3', '.wav', '.aac', '.m4a', '.ogg', '.wma', '.alac', '.aiff', '.ape')
-    audio_files = []
-    for root, dirs, files in os.walk(input_dir):
-        for filename in files:
-            if filename.lower().endswith(audio_extensions):
-                input_file = os.path.join(root, filename)
-                # Determine relative path to maintain folder structure
-                rel_path = os.path.relpath(root, input_dir)
-                output_subdir = os.path.join(output_dir, rel_path)
-                os.makedirs(output_subdir, exist_ok=True)
-                opus_filename = os.path.splitext(filename)[0] + '.opus'
-                output_file = os.path.join(output_subdir, opus_filename)
-                if not os.path.exists(output_file):
-                    audio_files.append((input_file, output_file))
-                else:
-                    print(f'Skipping existing file: {output_file}')
-    return audio_files
-
-def convert_audio_to_opus_multiprocess(input_dir, output_dir, max_workers=None):
-    """Convert audio files to Opus format using multiprocessing."""
-    audio_files = collect_audio_files(input_dir, output_dir)
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        future_to_file = {
-            executor.submit(convert_file, input_file, output_file): (input_file, output_file)
-            for input_file, output_file in audio_files
-        }
-        for future in as_completed(future_to_file):
-            input_file, _ = future_to_file[future]
-            try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+
+class ReadAhead:
+    """Read source files ahead of the encoders, for inputs on slow or network storage.
+
+    mode 'scratch' copies each upcoming file to a local scratch directory and
+    the encoder reads the copy; mode 'cache' reads the file once with
+    posix_fadvise hints so the encoder is served from the page cache. At most
+    budget bytes are held at a time (one oversized file is always allowed)
+    and they are released as each encode finishes. Files acquire budget in
+    job order, so a later file can never starve the one the encoders need next.
+    """
+
+    def __init__(self, mode='scratch', budget=READ_AHEAD_BUDGET, workers=READ_AHEAD_WORKERS, scratch_dir=None):
+        self.mode = mode
+        self.budget = budget
+        self.workers = workers
+        self.scratch_dir = tempfile.mkdtemp(prefix='opus_readahead_', dir=scratch_dir) if mode == 'scratch' else None
+        self.condition = threading.Condition()
+        self.used = 0
+        self.next_ticket = 0
+        self.serving = 0
+        self.fetched = {}  # input_file -> [local_path, size, encodes still to read it]
+
+    def fetch(self, ticket, input_file):
+        try:
+            size = os.path.getsize(input_file)
+        except OSError:
+            size = 0
+        with self.condition:
+            self.condition.wait_for(lambda: self.serving == ticket and (self.used == 0 or
+                                                                        self.used + size <= self.budget))
+            self.used += size
+            self.serving += 1
+            self.condition.notify_all()
+        local_path = input_file
+        try:
+            if self.mode == 'scratch':
+                local_path = os.path.join(self.scratch_dir, f'{ticket}{os.path.splitext(input_file)[1]}')
+                shutil.copyfile(input_file, local_path)
+            else:
+                with open(input_file, 'rb') as f:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                    while f.read(1 << 20):
+                        pass
+        except OSError as e:
+            print(f'Read-ahead failed for {input_file}, reading it directly: {e}')
+            if local_path != input_file and os.path.exists(local_path):
+                os.remove(local_path)
+            local_path = input_file
+        with self.condition:
+            self.fetched[input_file] = [local_path, size, 0]
+
+    def iter(self, jobs, input_of=lambda job: job[1]):
+        """Yield jobs in order, each once its source file has been read ahead."""
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for job in jobs:
+                pending.append((job, executor.submit(self.fetch, self.next_ticket, input_of(job))))
+                self.next_ticket += 1
+                # Keep a few files queued per reader; the byte budget bounds how far they get
+                while len(pending) > self.workers * 4 or pending[0][1].done():
+                    job, future = pending.popleft()
+                    future.result()
+                    yield job
+                    if not pending:
+                        break
+            while pending:
+                job, future = pending.popleft()
                 future.result()
-            except Exception as e:
-                print(f'Error converting {input_file}: {e}')
+                yield job
+
+    def local_path(self, input_file):
+        """Return the path the encoder should read for input_file."""
+        with self.condition:
+            return self.fetched[input_file][0]
+
+    def add_users(self, input_file, count):
+        """Note that count encodes will read input_file; each calls release() when it finishes."""
+        with self.condition:
+            self.fetched[input_file][2] += count
+
+    def release(self, input_file):
+        """Drop the read-ahead copy of input_file once the last encode reading it has finished."""
+        with self.condition:
+            entry = self.fetched[input_file]
+            entry[2] -= 1
+            if entry[2] > 0:
+                return
+            local_path, size, _ = self.fetched.pop(input_file)
+            self.used -= size
+            self.condition.notify_all()
+        try:
+            if local_path != input_file:
+                os.remove(local_path)
+            elif self.mode == 'cache':
+                with open(local_path, 'rb') as f:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+    def close(self):
+        if self.scratch_dir:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+
+
+def schedule_longest_first(jobs, workers, history=None):
+    """Order jobs from iter_jobs longest first to minimise makespan, and report the predicted finish.
+
+    A job's length is its duration times the renditions it still needs; the
+    finish is predicted from history's model of this machine, or its
+    defaults when no runs are recorded yet.
+    """
+    history = history or ThroughputHistory()
+    durations = probe_durations([job[1] for job in jobs])
+    unknown = sum(1 for duration in durations if duration is None)
+    # Files that could not be probed go last; ffmpeg will report their errors
+    ranked = sorted(((duration * len(job[2]) if duration is not None else None, job)
+                     for duration, job in zip(durations, jobs)), key=lambda item: -(item[0] or 0.0))
+    known = [work for work, _ in ranked if work is not None]
+    makespan = history.estimate('flac_to_opusHT2', known, workers)
+    finish_at = time.strftime('%H:%M:%S', time.localtime(time.time() + makespan))
+    print(f'Scheduled {len(jobs)} files ({sum(known) / 3600:.1f} h of audio, {unknown} unprobed) '
+          f'on {workers} workers; predicted finish {finish_at} ({makespan:.0f} s)')
+    return [job for _, job in ranked]
+
+def make_trees(output_dir, bitrate='128k', renditions=None, use_hash=False):
+    """Return (tree_dir, rendition, cache) for each output tree of a run."""
+    if renditions:
+        trees = [(os.path.join(output_dir, rendition_name(rendition)), rendition) for rendition in renditions]
+    else:
+        trees = [(output_dir, Rendition(bitrate, None, None))]
+    return [(tree_dir, rendition, TranscodeCache(tree_dir, rendition_settings(rendition), use_hash=use_hash))
+            for tree_dir, rendition in trees]
+
+def plan_conversion(input_dir, output_dir, max_workers=None, bitrate='128k', use_hash=False, renditions=None,
+                    history=None):
+    """Report what a run would do and how long it should take, without encoding anything.
+
+    Durations are probed in parallel; a file needing several renditions
+    counts its duration once per rendition.
+    """
+    trees = make_trees(output_dir, bitrate, renditions, use_hash)
+    max_workers = max_workers or default_worker_count()
+    history = history or ThroughputHistory()
+    total = 0
+    stale_files = []
+    for key, input_file, rel_output in iter_media_files(input_dir, ''):
+        total += 1
+        stale = sum(1 for tree_dir, _, cache in trees
+                    if not cache.is_current(key, input_file, os.path.join(tree_dir, rel_output)))
+        if stale:
+            stale_files.append((input_file, stale))
+    durations = probe_durations([input_file for input_file, _ in stale_files])
+    known = [duration * stale for duration, (_, stale) in zip(durations, stale_files) if duration is not None]
+    for line in history.plan_report('flac_to_opusHT2', total, total - len(stale_files), known, max_workers,
+                                    unprobed=len(stale_files) - len(known)):
+        print(line)
+
+def convert_audio_to_opus_multiprocess(input_dir, output_dir, max_workers=None, bitrate='128k', use_hash=False,
+                                       schedule='walk', supervisor='processes', timeout=None, renditions=None,
+                                       segment_over=None, dedupe='off', read_ahead=None, history=None):
+    """Convert audio files to Opus format using multiprocessing.
+
+    With schedule='walk', discovery runs on its own thread and feeds the
+    process pool through a bounded queue, so encoding starts with the first
+    file found and memory stays flat however large the tree is. With
+    schedule='longest', every file is probed first and the longest jobs are
+    started first, so one long file found late cannot stretch the run.
+
+    supervisor='threads' runs ffmpeg children directly from a thread pool
+    instead of wrapping each one in a worker process; timeout kills encoders
+    that hang.
+
+    renditions, a list of Rendition, produces every rendition from one decode
+    per file into parallel trees under output_dir (one directory per
+    rendition). Without it a single tree at bitrate is written to output_dir.
+
+    segment_over, in seconds, splits longer inputs into time segments that
+    are encoded on separate workers and joined into one Ogg Opus stream, so
+    a single long recording uses every core. Each rendition is segmented
+    separately.
+
+    dedupe fingerprints the whole tree before encoding and encodes only one
+    file of each group of acoustic duplicates (preferring lossless, then
+    larger sources). 'link' hard-links the duplicates' outputs to that
+    encode; 'report' leaves them out and lists the groups in
+    duplicates.json in output_dir.
+
+    read_ahead, a ReadAhead, reads source files ahead of the encoders so
+    workers on network-mounted inputs do not stall on reads; its own worker
+    count sets the read concurrency independently of max_workers.
+
+    history, a ThroughputHistory, gets this run's throughput when it
+    completes, so later --plan estimates learn from it.
+    """
+    trees = make_trees(output_dir, bitrate, renditions, use_hash)
+    encoded = set()  # Keys of the inputs with a finished encode, however many outputs each has
+    totals = {'audio_seconds': 0.0}
+    max_workers = max_workers or default_worker_count()
+    max_in_flight = max_workers * 2
+    duplicate_groups, input_files, duplicate_of = {}, {}, {}
+    if dedupe != 'off':
+        duplicate_groups, input_files = find_duplicate_files(input_dir, output_dir, max_workers)
+        duplicate_of = {dup: canonical for canonical, dups in duplicate_groups.items() for dup in dups}
+        print(f'Found {len(duplicate_of)} duplicate files in {len(duplicate_groups)} groups')
+        if dedupe == 'report':
+            with open(os.path.join(output_dir, DUPLICATES_FILENAME), 'w', encoding='utf-8') as f:
+                json.dump(duplicate_groups, f, indent=1)
+    jobs = (job for job in iter_jobs(input_dir, trees) if job[0] not in duplicate_of)
+    if schedule == 'longest':
+        jobs = schedule_longest_first(list(jobs), max_workers, history)
+    else:
+        jobs = prefetch_iter(jobs, max_in_flight)
+    if read_ahead is not None:
+        jobs = read_ahead.iter(jobs)
+    created_dirs = set()
+
+    def count_output(output_file):
+        try:
+            totals['audio_seconds'] += ogg_opus.stream_duration(output_file)
+        except (OSError, ValueError):
+            pass
+
+    def finish_file(key, input_file, stale, future):
+        try:
+            if future.result():
+                encoded.add(key)
+                for cache, output_file, _ in stale:
+                    cache.record(key, input_file, output_file)
+                    count_output(output_file)
+        except Exception as e:
+            print(f'Error converting {input_file}: {e}')
+
+    def finish_segment(key, cache, job, future):
+        result = job.segment_done(future)
+        if result is None:
+            return
+        ok, error = result
+        if ok:
+            cache.record(key, job.input_file, job.output_file)
+            encoded.add(key)
+            count_output(job.output_file)
+            run_metrics.record_file('flac_to_opusHT2', job.input_file, job.output_file, job.started, 0,
+                                    segments=len(job.plan))
+        elif error:
+            run_metrics.record_file('flac_to_opusHT2', job.input_file, job.output_file, job.started, None, error,
+                                    segments=len(job.plan))
+
+    def submit(pool, input_file, on_done, fn, *args):
+        future = pool.submit(fn, *args, on_done=on_done)
+        if read_ahead is not None:
+            # Released from the callback so the budget frees up even while the main thread waits on read-ahead
+            future.add_done_callback(lambda _: read_ahead.release(input_file))
+
+    def link_duplicates():
+        """Point each duplicate's output at its canonical file's finished encode."""
+        for canonical, duplicates in duplicate_groups.items():
+            rel_output = os.path.splitext(canonical)[0] + '.opus'
+            for tree_dir, _, cache in trees:
+                canonical_output = os.path.join(tree_dir, rel_output)
+                if not cache.is_current(canonical, input_files[canonical], canonical_output):
+                    continue
+                for key in duplicates:
+                    output_file = os.path.join(tree_dir, os.path.splitext(key)[0] + '.opus')
+                    if cache.is_current(key, input_files[key], output_file):
+                        continue
+                    try:
+                        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                        link_output(canonical_output, output_file)
+                        cache.record(key, input_files[key], output_file)
+                        print(f'Linked duplicate: {output_file} -> {canonical_output}')
+                    except OSError as e:
+                        print(f'Error linking {output_file}: {e}')
+
+    try:
+        # The history models encoding, so fingerprinting and probing above are left out of the wall time
+        started = time.monotonic()
+        with EncodePool(max_workers, supervisor, max_in_flight) as pool:
+            for key, input_file, stale in jobs:
+                # Create output directories lazily, once, when the first file needs them
+                for _, output_file, _ in stale:
+                    output_subdir = os.path.dirname(output_file)
+                    if output_subdir not in created_dirs:
+                        os.makedirs(output_subdir, exist_ok=True)
+                        created_dirs.add(output_subdir)
+                source = input_file
+                if read_ahead is not None:
+                    source = read_ahead.local_path(input_file)
+                plan = segment_plan(source, segment_over, max_workers)
+                if read_ahead is not None:
+                    read_ahead.add_users(input_file, len(stale) * len(plan) if plan else 1)
+                if plan is None:
+                    outputs = [(output_file, rendition) for _, output_file, rendition in stale]
+                    # The scratch copy is only read; messages and metrics name the library file
+                    submit(pool, input_file, partial(finish_file, key, input_file, stale),
+                           partial(convert_renditions, label=input_file), source, outputs, timeout)
+                    continue
+                print(f'Converting: {input_file} in {len(plan)} segments')
+                for cache, output_file, rendition in stale:
+                    job = SegmentedEncode(input_file, output_file, rendition, plan, timeout, source)
+                    for args in job.segment_args():
+                        submit(pool, input_file, partial(finish_segment, key, cache, job), encode_segment, *args)
+        wall_seconds = time.monotonic() - started
+        if dedupe == 'link':
+            link_duplicates()
+        if history is not None:
+            history.record('flac_to_opusHT2', max_workers, len(encoded), totals['audio_seconds'], wall_seconds)
+    finally:
+        for _, _, cache in trees:
+            if cache.dirty:
+                cache.save()
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print('Usage: python audio_to_opus.py input_directory output_directory')
-        sys.exit(1)
-    input_dir = sys.argv[1]
-    output_dir = sys.argv[2]
+    parser = argparse.ArgumentParser(description='Convert a directory tree of audio files to Opus')
+    parser.add_argument('input_dir', help='Input directory')
+    parser.add_argument('output_dir', help='Output directory')
+    parser.add_argument('--bitrate', default='128k', help='Opus bitrate (default: 128k)')
+    parser.add_argument('--rendition', action='append', type=parse_rendition, dest='renditions',
+                        metavar='BITRATE[:RATE[:CHANNELS]]',
+                        help='Produce this rendition in its own tree under output_dir; repeat for a ladder '
+                             '(all renditions come from a single decode per file)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes (default: available cores minus load average)')
+    parser.add_argument('--schedule', choices=('walk', 'longest'), default='walk',
+                        help="'walk' streams files in discovery order; 'longest' probes durations and runs the longest first")
+    parser.add_argument('--hash', action='store_true',
+                        help='Store content hashes so touched-but-unchanged files are not re-encoded')
+    parser.add_argument('--supervisor', choices=('processes', 'threads'), default='processes',
+                        help="'threads' supervises ffmpeg from threads without per-file worker processes")
+    parser.add_argument('--timeout', type=float, default=None, help='Kill an encode after this many seconds')
+    parser.add_argument('--segment-over', type=float, default=None, metavar='SECONDS',
+                        help='Split inputs longer than this into segments encoded in parallel and joined losslessly')
+    parser.add_argument('--dedupe', choices=('off', 'link', 'report'), default='off',
+                        help="Encode acoustic duplicates once: 'link' hard-links their outputs, "
+                             "'report' skips them and writes duplicates.json")
+    parser.add_argument('--read-ahead', choices=('off', 'scratch', 'cache'), default='off',
+                        help="Read sources ahead of the encoders: 'scratch' copies them to local disk, "
+                             "'cache' pulls them into the page cache (for network-mounted inputs)")
+    parser.add_argument('--read-workers', type=int, default=READ_AHEAD_WORKERS,
+                        help=f'Concurrent read-ahead reads (default: {READ_AHEAD_WORKERS})')
+    parser.add_argument('--read-ahead-mb', type=int, default=READ_AHEAD_BUDGET // (1024 * 1024),
+                        help=f'Most source data held ahead of the encoders (default: {READ_AHEAD_BUDGET // (1024 * 1024)})')
+    parser.add_argument('--scratch-dir', default=None, help='Where scratch copies go (default: system temp dir)')
+    parser.add_argument('--metrics-log', metavar='PATH',
+                        help='Append a JSONL event per encoded file to PATH and write a Prometheus summary at the end')
+    parser.add_argument('--metrics-summary', metavar='PATH',
+                        help='Where the Prometheus summary goes (default: the metrics log with a .prom extension)')
+    parser.add_argument('--plan', action='store_true',
+                        help='Probe the batch and estimate its run time from past runs on this machine, without encoding')
+    parser.add_argument('--watch', action='store_true',
+                        help='After converting, keep watching input_dir and convert new files as they arrive')
+    args = parser.parse_args()
+    if args.watch:
+        # The watch daemon keeps one rendition per source and encodes every file on its own
+        unsupported = [flag for flag, used in (('--rendition', args.renditions), ('--dedupe', args.dedupe != 'off'),
+                                               ('--segment-over', args.segment_over is not None),
+                                               ('--read-ahead', args.read_ahead != 'off'),
+                                               ('--metrics-log', args.metrics_log)) if used]
+        if unsupported:
+            parser.error(f"--watch cannot be combined with {', '.join(unsupported)}")
 
-    if not os.path.isdir(input_dir):
-        print(f'The input directory {input_dir} does not exist.')
+    if not os.path.isdir(args.input_dir):
+        print(f'The input directory {args.input_dir} does not exist.')
         sys.exit(1)
 
+    if args.plan:
+        plan_conversion(args.input_dir, args.output_dir, args.workers, args.bitrate, args.hash, args.renditions)
+        sys.exit(0)
+
     # Create the output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
 
-    convert_audio_to_opus_multiprocess(input_dir, output_dir)
+    if args.metrics_log:
+        run_metrics.start_run(args.metrics_log)
+    read_ahead = None
+    if args.read_ahead != 'off':
+        read_ahead = ReadAhead(args.read_ahead, args.read_ahead_mb * 1024 * 1024, args.read_workers, args.scratch_dir)
+    try:
+        convert_audio_to_opus_multiprocess(args.input_dir, args.output_dir, args.workers, args.bitrate, args.hash,
+                                           args.schedule, args.supervisor, args.timeout, args.renditions,
+                                           args.segment_over, args.dedupe, read_ahead, ThroughputHistory())
+    finally:
+        if read_ahead is not None:
+            read_ahead.close()
+        if args.metrics_log:
+            run_metrics.finish_run(args.metrics_summary)
+    if args.watch:
+        import opus_watch
+        opus_watch.watch(args.input_dir, args.output_dir, args.bitrate, args.workers, args.hash,
+                         timeout=args.timeout, initial_scan=False)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import threading
+import json
+import time
+import sys
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    directory TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (directory, settings)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    batch_id INTEGER NOT NULL REFERENCES batches(id),
+    input_file TEXT NOT NULL,
+    output_file TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    finished REAL,
+    duration REAL,
+    error TEXT,
+    source_size INTEGER,
+    source_mtime REAL,
+    PRIMARY KEY (batch_id, input_file)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (batch_id, state);
+"""
+
+# Columns added after the first release, created on journals written before them
+ADDED_COLUMNS = (('source_size', 'INTEGER'), ('source_mtime', 'REAL'))
+
+def source_stat(input_file):
+    """Return (size, mtime) of input_file, or (None, None) if it cannot be read."""
+    try:
+        st = os.stat(input_file)
+    except OSError:
+        return None, None
+    return st.st_size, st.st_mtime
+
+class JobJournal:
+    """SQLite record of conversion jobs so a batch can be resumed or inspected.
+
+    A batch is identified by its directory and encoder settings; each job row
+    tracks one input file through pending -> running -> done/failed, along
+    with the size and mtime its source had when the job was registered.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+        for column, kind in ADDED_COLUMNS:
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            cur = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cur
+
+    def get_batch(self, directory, settings):
+        """Return the id of the batch for directory+settings, creating it if needed."""
+        settings_json = json.dumps(settings, sort_keys=True)
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR IGNORE INTO batches (directory, settings, created) VALUES (?, ?, ?)',
+                (directory, settings_json, time.time()))
+            self.conn.commit()
+            row = self.conn.execute(
+                'SELECT id FROM batches WHERE directory = ? AND settings = ?',
+                (directory, settings_json)).fetchone()
+        return row[0]
+
+    def find_batch(self, directory, settings):
+        """Return the id of the batch for directory+settings, or None if it was never run."""
+        with self.lock:
+            row = self.conn.execute('SELECT id FROM batches WHERE directory = ? AND settings = ?',
+                                    (directory, json.dumps(settings, sort_keys=True))).fetchone()
+        return row[0] if row else None
+
+    def states(self, batch_id):
+        """Return {input_file: state} for every job in a batch.
+
+        A finished job whose source has changed since is reported as pending,
+        as add_jobs() would make it.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT input_file, state, source_size, source_mtime FROM jobs '
+                                     'WHERE batch_id = ?', (batch_id,)).fetchall()
+        states = {}
+        for input_file, state, size, mtime in rows:
+            if state in (DONE, FAILED) and size is not None and source_stat(input_file) != (size, mtime):
+                state = PENDING
+            states[input_file] = state
+        return states
+
+    def add_jobs(self, batch_id, files):
+        """Register (input_file, output_file) pairs; files already known keep their state.
+
+        A done or failed job whose source size or mtime differs from the one
+        recorded is put back to pending, so an edited file is encoded again.
+        """
+        rows = [(input_file, output_file) + source_stat(input_file) for input_file, output_file in files]
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO jobs (batch_id, input_file, output_file, source_size, source_mtime) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(batch_id,) + row for row in rows])
+            # Changed sources go back to pending; rows from journals without source stats just get them filled in
+            self.conn.executemany(
+                'UPDATE jobs SET state = CASE WHEN source_size IS NULL THEN state ELSE ? END, '
+                'source_size = ?, source_mtime = ? '
+                'WHERE batch_id = ? AND input_file = ? AND (source_size IS NOT ? OR source_mtime IS NOT ?)',
+                [(PENDING, size, mtime, batch_id, input_file, size, mtime)
+                 for input_file, _, size, mtime in rows if size is not None])
+            # Jobs left running by a crashed or closed session go back to the queue
+            self.conn.execute('UPDATE jobs SET state = ? WHERE batch_id = ? AND state = ?',
+                              (PENDING, batch_id, RUNNING))
+            self.conn.commit()
+
+    def jobs_to_run(self, batch_id, retry_failed=False):
+        """Return (input_file, output_file) pairs still to do.
+
+        By default this resumes pending jobs; with retry_failed only the failed ones are returned.
+        """
+        state = FAILED if retry_failed else PENDING
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT input_file, output_file FROM jobs WHERE batch_id = ? AND state = ? ORDER BY input_file',
+                (batch_id, state)).fetchall()
+        return rows
+
+    def mark_running(self, batch_id, input_file):
+        self._execute(
+            'UPDATE jobs SET state = ?, attempts = attempts + 1, started = ?, finished = NULL, error = NULL '
+            'WHERE batch_id = ? AND input_file = ?',
+            (RUNNING, time.time(), batch_id, input_file))
+
+    def mark_pending(self, batch_id, input_file):
+        """Put a job back in the queue, e.g. after it was cancelled."""
+        self._execute('UPDATE jobs SET state = ?, started = NULL WHERE batch_id = ? AND input_file = ?',
+                      (PENDING, batch_id, input_file))
+
+    def mark_finished(self, batch_id, input_file, error=None):
+        """Mark a job done, or failed with the given error text."""
+        now = time.time()
+        self._execute(
+            'UPDATE jobs SET state = ?, finished = ?, duration = ? - started, error = ? '
+            'WHERE batch_id = ? AND input_file = ?',
+            (FAILED if error else DONE, now, now, error, batch_id, input_file))
+
+    def summary(self, batch_id=None):
+        """Return {state: count} for one batch, or for the whole journal."""
+        sql = 'SELECT state, COUNT(*) FROM jobs'
+        params = ()
+        if batch_id is not None:
+            sql += ' WHERE batch_id = ?'
+            params = (batch_id,)
+        with self.lock:
+            return dict(self.conn.execute(sql + ' GROUP BY state', params).fetchall())
+
+    def failures(self, batch_id=None):
+        """Return (input_file, attempts, error) for every failed job."""
+        sql = 'SELECT input_file, attempts, error FROM jobs WHERE state = ?'
+        params = (FAILED,)
+        if batch_id is not None:
+            sql += ' AND batch_id = ?'
+            params += (batch_id,)
+        with self.lock:
+            return self.conn.execute(sql + ' ORDER BY input_file', params).fetchall()
+
+    def batches(self):
+        with self.lock:
+            return self.conn.execute('SELECT id, directory, settings, created FROM batches ORDER BY id').fetchall()
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python job_journal.py journal.sqlite3')
+        sys.exit(1)
+    journal = JobJournal(sys.argv[1])
+    for batch_id, directory, settings, created in journal.batches():
+        counts = journal.summary(batch_id)
+        started = time.strftime('%Y-%m-%d %H:%M', time.localtime(created))
+        print(f"Batch {batch_id}: {directory} {settings} (created {started})")
+        print('  ' + ', '.join(f"{state}: {counts.get(state, 0)}" for state in (PENDING, RUNNING, DONE, FAILED)))
+        for input_file, attempts, error in journal.failures(batch_id):
+            print(f"  FAILED after {attempts} attempt(s): {input_file}\n    {error}")
+    journal.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""Minimal Ogg Opus packet reader/writer used to stitch segment encodes.
+
+Only what the segment-parallel encoder needs: reading the packets and final
+granule position of a single-stream .opus file, and writing packets back out
+as one logical stream with fresh granule positions (RFC 3533, RFC 7845).
+"""
+
+import os
+import struct
+
+# Granule positions are always counted at 48 kHz in Ogg Opus
+OPUS_RATE = 48000
+MAX_PAGE_BODY = 4096  # Target page payload, like libogg's default
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+CRC_TABLE = _crc_table()
+
+def ogg_crc(data):
+    """Ogg's CRC-32 (polynomial 0x04C11DB7, no reflection, zero initial value)."""
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+def packet_samples(packet):
+    """Return the number of 48 kHz samples an Opus packet decodes to (RFC 6716 section 3.1)."""
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        frame_size = (480, 960, 1920, 2880)[config % 4]
+    elif config < 16:
+        frame_size = (480, 960)[config % 2]
+    else:
+        frame_size = (120, 240, 480, 960)[config % 4]
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F
+    return frame_size * frames
+
+def read_packets(path):
+    """Read a single-stream Ogg Opus file.
+
+    Returns (head, tags, packets, final_granule) where head and tags are the
+    OpusHead and OpusTags packets and packets are the audio packets in order.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    packets = []
+    pending = b''
+    final_granule = 0
+    pos = 0
+    while pos < len(data):
+        if data[pos:pos + 4] != b'OggS':
+            raise ValueError(f'{path}: lost Ogg sync at byte {pos}')
+        granule, = struct.unpack_from('<q', data, pos + 6)
+        segment_count = data[pos + 26]
+        lacing = data[pos + 27:pos + 27 + segment_count]
+        pos += 27 + segment_count
+        for size in lacing:
+            pending += data[pos:pos + size]
+            pos += size
+            if size < 255:
+                packets.append(pending)
+                pending = b''
+        if granule != -1:
+            final_granule = granule
+    if len(packets) < 2 or not packets[0].startswith(b'OpusHead') or not packets[1].startswith(b'OpusTags'):
+        raise ValueError(f'{path}: not an Ogg Opus stream')
+    return packets[0], packets[1], packets[2:], final_granule
+
+def pre_skip(head):
+    """Return the pre-skip (encoder priming samples at 48 kHz) from an OpusHead packet."""
+    return struct.unpack_from('<H', head, 10)[0]
+
+class OggWriter:
+    """Write packets to one logical Ogg stream."""
+
+    def __init__(self, f, serial):
+        self.f = f
+        self.serial = serial
+        self.sequence = 0
+        self.packets = []  # Packets buffered for the current page
+        self.body_size = 0
+
+    def _lacing(self, packet):
+        if len(packet) >= 255 * 255:
+            raise ValueError('Packet too large for a single Ogg page')
+        return [255] * (len(packet) // 255) + [len(packet) % 255]
+
+    def write_page(self, packets, granule, header_type=0):
+        lacing = [value for packet in packets for value in self._lacing(packet)]
+        header = struct.pack('<4sBBqIIIB', b'OggS', 0, header_type, granule, self.serial, self.sequence, 0, len(lacing))
+        page = bytearray(header + bytes(lacing) + b''.join(packets))
+        struct.pack_into('<I', page, 22, ogg_crc(page))
+        self.f.write(page)
+        self.sequence += 1
+
+    def add_packet(self, packet, granule):
+        """Buffer an audio packet, flushing a page when it is full."""
+        segments = sum(len(self._lacing(p)) for p in self.packets) + len(self._lacing(packet))
+        if self.packets and (segments > 255 or self.body_size + len(packet) > MAX_PAGE_BODY):
+            self.write_page(self.packets, self.granule)
+            self.packets, self.body_size = [], 0
+        self.packets.append(packet)
+        self.body_size += len(packet)
+        self.granule = granule
+
+    def finish(self, final_granule):
+        """Write the last page with the end-of-stream flag and the trimmed final granule."""
+        self.write_page(self.packets, final_granule, header_type=0x04)
+        self.packets, self.body_size = [], 0
+
+def write_stream(path, head, tags, packets, final_granule, serial=None):
+    """Write head, tags and audio packets as an Ogg Opus file.
+
+    Granule positions are recomputed from the packet durations; the last page
+    carries final_granule so the decoder trims any padding at the end.
+    """
+    if serial is None:
+        serial = struct.unpack('<I', os.urandom(4))[0]
+    with open(path, 'wb') as f:
+        writer = OggWriter(f, serial)
+        writer.write_page([head], 0, header_type=0x02)
+        writer.write_page([tags], 0)
+        granule = 0
+        for packet in packets:
+            granule += packet_samples(packet)
+            writer.add_packet(packet, granule)
+        writer.finish(min(final_granule, granule))
+
+def stream_duration(path):
+    """Return the playable length of an Ogg Opus file in seconds, reading only its first and last pages."""
+    with open(path, 'rb') as f:
+        first = f.read(27 + 255 + 19)
+        if first[:4] != b'OggS':
+            raise ValueError(f'{path}: not an Ogg stream')
+        head = first[27 + first[26]:]
+        if not head.startswith(b'OpusHead'):
+            raise ValueError(f'{path}: not an Ogg Opus stream')
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        # A page is at most 27 + 255 + 255 * 255 bytes, so the last one starts within this tail
+        f.seek(max(0, size - (27 + 255 + 255 * 255)))
+        tail = f.read()
+    pos = tail.rfind(b'OggS')
+    while pos >= 0:
+        granule, = struct.unpack_from('<q', tail, pos + 6)
+        if granule != -1:
+            return max(granule - pre_skip(head), 0) / OPUS_RATE
+        pos = tail.rfind(b'OggS', 0, pos)
+    raise ValueError(f'{path}: no granule position found')
@@ -0,0 +1,698 @@
+#!/usr/bin/env python3
+
+"""Shared transcoding engine behind every Opus converter in this directory.
+
+One place for the pieces each entry point used to carry its own copy of:
+the extension registry, a capability probe that is cached per ffmpeg
+binary, ffmpeg command building and supervision (timeouts, progress,
+kill on interrupt), the skip-if-current manifest, streaming discovery,
+the bounded encode pool and segment-parallel encoding of long inputs. A
+speed or robustness fix made here reaches convert_to_opus.py,
+flac_to_opus.py, flac_to_opusHT.py, flac_to_opusHT2.py and F2OPUS.py at
+once.
+
+    python opus_engine.py      # show what this machine can do
+"""
+
+import hashlib
+import importlib.util
+import json
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import ogg_opus
+import run_metrics
+
+# Extension registry: every converter picks its inputs from these
+AUDIO_EXTENSIONS = ('.flac', '.mp3', '.wav', '.aac', '.m4a', '.ogg', '.wma', '.alac', '.aiff', '.ape')
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.wmv', '.webm', '.flv')
+MEDIA_EXTENSIONS = AUDIO_EXTENSIONS + VIDEO_EXTENSIONS
+
+CACHE_FILENAME = '.opus_cache.json'
+CACHE_VERSION = 1
+CACHE_SAVE_INTERVAL = 500  # Flush the manifest after this many finished files
+CAPABILITIES_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'opus_engine_capabilities.json')
+PROBE_WORKERS = 16  # ffprobe is I/O bound, so probe with more threads than cores
+STDERR_TAIL_LINES = 5
+CANCEL_POLL_SECONDS = 0.5  # How often a worker process's encode looks for a cancel from its pool
+SEGMENT_MIN_BYTES = 16 * 1024 * 1024  # Only files at least this big are probed for segmenting
+MIN_SEGMENT_SECONDS = 60  # Never cut segments shorter than this
+SEGMENT_WARMUP_PACKETS = 4  # Packets encoded before each cut and then dropped, so the encoder is primed
+PACKET_SAMPLES = 960  # 20 ms Opus frames at 48 kHz
+
+# One output of a multi-rendition encode; sample_rate/channels of None keep the input's
+Rendition = namedtuple('Rendition', 'bitrate sample_rate channels')
+
+class EngineError(RuntimeError):
+    """The encoder this engine needs is missing or unusable."""
+
+_capabilities = None
+
+def capabilities():
+    """Return what this machine can encode with, probing ffmpeg once per binary.
+
+    The result of `ffmpeg -version` / `-encoders` is stored in
+    CAPABILITIES_PATH keyed by the binary's path, size and mtime, so runs
+    after the first only do a PATH lookup and a stat.
+    """
+    global _capabilities
+    if _capabilities is not None:
+        return _capabilities
+    ffmpeg = shutil.which('ffmpeg')
+    caps = {'ffmpeg': ffmpeg, 'ffprobe': shutil.which('ffprobe'), 'version': None, 'libopus': False,
+            'pyav': importlib.util.find_spec('av') is not None}
+    if ffmpeg:
+        real_path = os.path.realpath(ffmpeg)
+        st = os.stat(real_path)
+        binary = f'{real_path}:{st.st_size}:{st.st_mtime_ns}'
+        try:
+            with open(CAPABILITIES_PATH, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+        if stored.get('binary') == binary:
+            caps.update(version=stored['version'], libopus=stored['libopus'])
+        else:
+            try:
+                version = subprocess.run([ffmpeg, '-hide_banner', '-version'], stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, text=True, errors='replace').stdout
+                encoders = subprocess.run([ffmpeg, '-hide_banner', '-encoders'], stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL, text=True, errors='replace').stdout
+                caps.update(version=(version.splitlines() or [''])[0], libopus=' libopus ' in encoders)
+                os.makedirs(os.path.dirname(CAPABILITIES_PATH), exist_ok=True)
+                with open(CAPABILITIES_PATH, 'w', encoding='utf-8') as f:
+                    json.dump({'binary': binary, 'version': caps['version'], 'libopus': caps['libopus']}, f)
+            except OSError:
+                pass
+    _capabilities = caps
+    return caps
+
+def require_ffmpeg():
+    """Raise EngineError unless an ffmpeg with the libopus encoder is on PATH."""
+    caps = capabilities()
+    if not caps['ffmpeg']:
+        raise EngineError("ffmpeg is not installed or not in PATH.")
+    if not caps['libopus']:
+        raise EngineError(f"{caps['ffmpeg']} was built without the libopus encoder.")
+
+def hash_file(path, chunk_size=1 << 20):
+    """Return a BLAKE2b digest of the file contents."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class TranscodeCache:
+    """Persistent manifest of finished conversions.
+
+    Entries are keyed by the source path relative to the input directory and
+    record the source size/mtime (plus an optional content hash), the encoder
+    settings and the size of the output that was written.  A file is only
+    skipped when all of those still match, so partial outputs from a crashed
+    run or a bitrate change cause a re-encode.
+
+    Safe to share between threads: prefetch_iter checks files on its producer
+    thread while the consumer records and saves.
+    """
+
+    def __init__(self, output_dir, settings, use_hash=False):
+        self.path = os.path.join(output_dir, CACHE_FILENAME)
+        self.settings = settings
+        self.use_hash = use_hash
+        self.entries = {}
+        self.dirty = 0
+        self.lock = threading.RLock()  # Guards entries and dirty; held while saving
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f'Ignoring unreadable cache {self.path}: {e}')
+            return
+        if data.get('version') == CACHE_VERSION:
+            self.entries = data.get('entries', {})
+
+    def save(self):
+        """Atomically write the manifest next to the outputs."""
+        tmp_path = self.path + '.tmp'
+        with self.lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': CACHE_VERSION, 'entries': self.entries}, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            self.dirty = 0
+
+    def is_current(self, key, input_file, output_file):
+        """Return True if output_file is a finished encode of the current input_file."""
+        entry = self.entries.get(key)
+        if entry is None or entry.get('settings') != self.settings:
+            return False
+        try:
+            src = os.stat(input_file)
+            out = os.stat(output_file)
+        except OSError:
+            return False
+        if out.st_size != entry.get('output_size') or src.st_size != entry.get('size'):
+            return False
+        if src.st_mtime_ns == entry.get('mtime_ns'):
+            return True
+        # Same size but a new mtime (copied or touched file): fall back to the content hash
+        if self.use_hash and entry.get('hash') and hash_file(input_file) == entry['hash']:
+            with self.lock:
+                if self.entries.get(key) is entry:  # Not replaced by record() while hashing
+                    entry['mtime_ns'] = src.st_mtime_ns
+                    self.dirty += 1
+            return True
+        return False
+
+    def record(self, key, input_file, output_file):
+        """Remember a successful conversion of input_file."""
+        src = os.stat(input_file)
+        entry = {
+            'size': src.st_size,
+            'mtime_ns': src.st_mtime_ns,
+            'output_size': os.path.getsize(output_file),
+            'settings': self.settings,
+        }
+        if self.use_hash:
+            entry['hash'] = hash_file(input_file)
+        self.put_entry(key, entry)
+
+    def put_entry(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.dirty += 1
+            if self.dirty >= CACHE_SAVE_INTERVAL:
+                self.save()
+
+    def pop_entries(self, rel):
+        """Remove and return {key: entry} for rel and every key under rel/."""
+        prefix = rel + '/'
+        with self.lock:
+            popped = {key: self.entries.pop(key) for key in [key for key in self.entries
+                                                             if key == rel or key.startswith(prefix)]}
+            self.dirty += len(popped)
+        return popped
+
+# ffmpeg children started by this process, so they can be killed on interrupt or cancel
+running_encoders = set()
+running_encoders_lock = threading.Lock()
+# In an EncodePool worker process, the pool's cancel event: the parent cannot reach this process's
+# ffmpeg children, so run_ffmpeg watches the event and kills its own child once it is set
+worker_cancel_event = None
+
+def init_worker(cancel_event):
+    global worker_cancel_event
+    worker_cancel_event = cancel_event
+
+def cancelled():
+    return worker_cancel_event is not None and worker_cancel_event.is_set()
+
+def run_ffmpeg(cmd, timeout=None, progress_callback=None):
+    """Run an ffmpeg command under supervision.
+
+    The child is killed if it runs longer than timeout seconds. With
+    progress_callback, ffmpeg's -progress stream is parsed and the callback
+    gets the seconds of output written so far; an exception raised by the
+    callback kills the child and propagates. Returns (returncode,
+    stderr_tail); returncode is None when the job timed out. Raises
+    EngineError if the pool running the job was cancelled.
+    """
+    if cancelled():
+        raise EngineError('Encode cancelled.')
+    if progress_callback is not None:
+        cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            stdout=subprocess.PIPE if progress_callback is not None else subprocess.DEVNULL)
+    with running_encoders_lock:
+        running_encoders.add(proc)
+    try:
+        if progress_callback is None:
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            while True:
+                wait_seconds = CANCEL_POLL_SECONDS if worker_cancel_event is not None else None
+                if deadline is not None:
+                    remaining = max(0.0, deadline - time.monotonic())
+                    wait_seconds = remaining if wait_seconds is None else min(wait_seconds, remaining)
+                try:
+                    _, stderr = proc.communicate(timeout=wait_seconds)
+                    returncode = proc.returncode
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancelled():
+                        proc.kill()
+                        proc.communicate()
+                        raise EngineError('Encode cancelled.')
+                    if deadline is not None and time.monotonic() >= deadline:
+                        proc.kill()
+                        _, stderr = proc.communicate()
+                        returncode = None
+                        break
+                except BaseException:
+                    proc.kill()  # Ctrl+C reached this process: never leave the encoder running
+                    proc.communicate()
+                    raise
+        else:
+            stderr_chunks = []
+            # Drain stderr on its own thread so a chatty ffmpeg cannot block on a full pipe
+            stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+            stderr_reader.start()
+            timed_out = threading.Event()
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(timeout, lambda: (timed_out.set(), proc.kill()))
+                timer.start()
+            try:
+                for line in proc.stdout:
+                    if cancelled():
+                        raise EngineError('Encode cancelled.')
+                    key, _, value = line.decode(errors='replace').strip().partition('=')
+                    if key == 'out_time_us':
+                        try:
+                            seconds = int(value) / 1000000
+                        except ValueError:
+                            continue  # 'N/A' before the first packet is written
+                        progress_callback(seconds)
+            except BaseException:
+                proc.kill()
+                raise
+            finally:
+                proc.wait()
+                stderr_reader.join()
+                if timer is not None:
+                    timer.cancel()
+            stderr = b''.join(stderr_chunks)
+            returncode = None if timed_out.is_set() else proc.returncode
+    finally:
+        with running_encoders_lock:
+            running_encoders.discard(proc)
+    stderr_tail = '\n'.join(stderr.decode(errors='replace').strip().splitlines()[-STDERR_TAIL_LINES:])
+    return returncode, stderr_tail
+
+def kill_running_encoders():
+    """Kill every ffmpeg child this process is still supervising."""
+    with running_encoders_lock:
+        procs = list(running_encoders)
+    for proc in procs:
+        proc.kill()
+
+def parse_rendition(spec):
+    """Parse 'bitrate[:sample_rate[:channels]]', e.g. '64k' or '32k:24000:1'."""
+    parts = spec.split(':')
+    if not 1 <= len(parts) <= 3 or not parts[0]:
+        raise ValueError(f"Invalid rendition '{spec}', expected bitrate[:sample_rate[:channels]]")
+    bitrate, sample_rate, channels = (parts + [None, None])[:3]
+    return Rendition(bitrate, int(sample_rate) if sample_rate else None, int(channels) if channels else None)
+
+def rendition_name(rendition):
+    """Directory name for a rendition's output tree, e.g. '32k_24000_1ch'."""
+    name = rendition.bitrate
+    if rendition.sample_rate:
+        name += f'_{rendition.sample_rate}'
+    if rendition.channels:
+        name += f'_{rendition.channels}ch'
+    return name
+
+def rendition_settings(rendition):
+    """Encoder settings recorded in the cache for a rendition."""
+    settings = {'codec': 'libopus', 'bitrate': rendition.bitrate}
+    if rendition.sample_rate:
+        settings['sample_rate'] = rendition.sample_rate
+    if rendition.channels:
+        settings['channels'] = rendition.channels
+    return settings
+
+def build_command(input_file, outputs, extra_args=()):
+    """Build one ffmpeg command encoding input_file to every (path, rendition) in outputs.
+
+    extra_args are encoder options added to each output, e.g. ['-vbr', 'off'].
+    """
+    cmd = ['ffmpeg', '-y', '-nostdin', '-hide_banner', '-loglevel', 'error', '-i', input_file]
+    for output_file, rendition in outputs:
+        cmd += ['-map', '0:a:0', '-c:a', 'libopus', '-b:a', rendition.bitrate]
+        if rendition.sample_rate:
+            cmd += ['-ar', str(rendition.sample_rate)]
+        if rendition.channels:
+            cmd += ['-ac', str(rendition.channels)]
+        cmd += list(extra_args) + ['-f', 'opus', output_file]
+    return cmd
+
+def encode(input_file, outputs, timeout=None, progress_callback=None, extra_args=(), converter='opus_engine',
+           label=None, **extra):
+    """Encode input_file to every (output_file, rendition) in outputs from a single decode.
+
+    One ffmpeg process decodes the input once and feeds an encoder per
+    output. Each encode is written to a temporary file and renamed into
+    place, so an interrupted run never leaves a truncated .opus behind.
+    Every output is logged to the run metrics under converter, with extra
+    as additional event fields. label names the input in messages and
+    metrics when input_file is only a stand-in for it, such as a read-ahead
+    scratch copy. Returns (success, error_text).
+    """
+    started = time.time()
+    name = label or input_file
+    cmd = build_command(input_file, [(output_file + '.part', rendition) for output_file, rendition in outputs],
+                        extra_args)
+    print(f"Converting: {name} to {', '.join(output_file for output_file, _ in outputs)}")
+    error = None
+    try:
+        returncode, stderr_tail = run_ffmpeg(cmd, timeout, progress_callback)
+        if returncode == 0:
+            for output_file, rendition in outputs:
+                os.replace(output_file + '.part', output_file)
+                run_metrics.record_file(converter, name, output_file, started, 0, bitrate=rendition.bitrate, **extra)
+            return True, None
+        reason = f'timed out after {timeout} s' if returncode is None else f'ffmpeg exited with status {returncode}'
+        error = f'{reason}\n{stderr_tail}'.strip()
+        print(f'Error converting {name}: {error}')
+    except OSError as e:
+        returncode, stderr_tail = None, str(e)
+        error = str(e)
+        print(f'Error converting {name}: {e}')
+    finally:
+        # Also reached when a progress callback cancels the encode
+        for output_file, _ in outputs:
+            if os.path.exists(output_file + '.part'):
+                os.remove(output_file + '.part')
+    for output_file, rendition in outputs:
+        run_metrics.record_file(converter, name, output_file, started, returncode, stderr_tail,
+                                bitrate=rendition.bitrate, **extra)
+    return False, error
+
+def convert_renditions(input_file, outputs, timeout=None, converter='flac_to_opusHT2', progress_callback=None,
+                       extra_args=(), label=None):
+    """Encode input_file to every (output_file, rendition) in outputs. Returns True on success."""
+    return encode(input_file, outputs, timeout, progress_callback, extra_args, converter=converter, label=label)[0]
+
+def convert_file(input_file, output_file, bitrate='128k', timeout=None, converter='flac_to_opusHT2'):
+    """Convert a single audio file to Opus format. Returns True on success."""
+    return convert_renditions(input_file, [(output_file, Rendition(bitrate, None, None))], timeout, converter)
+
+def plan_segments(duration, segments):
+    """Split duration seconds into up to segments ranges of whole 20 ms packets.
+
+    Returns (first_packet, end_packet) pairs on the packet grid of a single
+    encode of the whole file; the last end_packet is None (to end of input).
+    """
+    total_packets = math.ceil(duration * ogg_opus.OPUS_RATE / PACKET_SAMPLES)
+    per_segment = max(1, math.ceil(total_packets / segments))
+    starts = list(range(0, total_packets, per_segment))
+    return [(start, starts[i + 1] if i + 1 < len(starts) else None) for i, start in enumerate(starts)]
+
+def encode_segment(input_file, segment_file, rendition, first_packet, end_packet, timeout=None, label=None):
+    """Encode one segment of input_file to segment_file. Returns True on success.
+
+    Encoding starts SEGMENT_WARMUP_PACKETS before the cut so that after those
+    packets are dropped, the encoder state at the seam matches a continuous
+    encode; it also runs one packet past the end to fill the encoder lookahead.
+    label names the input in error messages, as for encode().
+    """
+    warmup = min(SEGMENT_WARMUP_PACKETS, first_packet)
+    packet_seconds = PACKET_SAMPLES / ogg_opus.OPUS_RATE
+    cmd = ['ffmpeg', '-y', '-nostdin', '-hide_banner', '-loglevel', 'error']
+    if first_packet:
+        cmd += ['-ss', f'{(first_packet - warmup) * packet_seconds:.6f}']
+    if end_packet is not None:
+        cmd += ['-t', f'{(end_packet - first_packet + warmup + 1) * packet_seconds:.6f}']
+    cmd += ['-i', input_file, '-map', '0:a:0', '-c:a', 'libopus', '-b:a', rendition.bitrate, '-frame_duration', '20']
+    if rendition.sample_rate:
+        cmd += ['-ar', str(rendition.sample_rate)]
+    if rendition.channels:
+        cmd += ['-ac', str(rendition.channels)]
+    cmd += ['-f', 'opus', segment_file]
+    returncode, stderr_tail = run_ffmpeg(cmd, timeout)
+    if returncode != 0:
+        reason = f'timed out after {timeout} s' if returncode is None else f'ffmpeg exited with status {returncode}'
+        print(f'Error encoding segment {first_packet}-{end_packet} of {label or input_file}: {reason}\n{stderr_tail}')
+        return False
+    return True
+
+def join_segments(segment_files, plan, output_file):
+    """Stitch segment encodes into one Ogg Opus stream at output_file.
+
+    Warm-up packets are dropped, the remaining packets are concatenated and
+    granule positions are rewritten for the joined stream.
+    """
+    head, tags, _, _ = ogg_opus.read_packets(segment_files[0])
+    packets = []
+    for segment_file, (first_packet, end_packet) in zip(segment_files, plan):
+        segment_head, _, segment_packets, final_granule = ogg_opus.read_packets(segment_file)
+        if ogg_opus.pre_skip(segment_head) != ogg_opus.pre_skip(head):
+            raise ValueError(f'{segment_file}: encoder pre-skip differs between segments')
+        warmup = min(SEGMENT_WARMUP_PACKETS, first_packet)
+        if end_packet is None:
+            kept = segment_packets[warmup:]
+        else:
+            kept = segment_packets[warmup:warmup + end_packet - first_packet]
+            if len(kept) != end_packet - first_packet:
+                raise ValueError(f'{segment_file}: segment ended early')
+        packets += kept
+    # The last segment's own final granule tells where the audio ends relative to its start
+    last_start = (plan[-1][0] - min(SEGMENT_WARMUP_PACKETS, plan[-1][0])) * PACKET_SAMPLES
+    partial_file = output_file + '.part'
+    ogg_opus.write_stream(partial_file, head, tags, packets, last_start + final_granule)
+    os.replace(partial_file, output_file)
+
+def segment_plan(input_file, segment_over, max_workers):
+    """Return a segment plan for input_file, or None to encode it whole.
+
+    Only inputs longer than segment_over seconds are split, into at most
+    max_workers segments of at least MIN_SEGMENT_SECONDS each.
+    """
+    if not segment_over or max_workers < 2 or os.path.getsize(input_file) < SEGMENT_MIN_BYTES:
+        return None
+    duration = probe_duration(input_file)
+    if not duration or duration <= segment_over:
+        return None
+    segments = min(max_workers, int(duration // MIN_SEGMENT_SECONDS))
+    return plan_segments(duration, segments) if segments > 1 else None
+
+class SegmentedEncode:
+    """One output encoded as segments on separate workers and joined once the last one finishes.
+
+    Submit encode_segment(*args) for every args in segment_args() and pass
+    each finished future to segment_done(). The call that completes the set
+    joins the segments into output_file, removes the segment files and
+    returns (success, error_text); error_text is None when only a segment
+    encode failed, since that has already been reported. Earlier calls
+    return None. source, if given, is read instead of input_file, which
+    still names the input in messages.
+    """
+
+    def __init__(self, input_file, output_file, rendition, plan, timeout=None, source=None):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.rendition = rendition
+        self.plan = plan
+        self.timeout = timeout
+        self.source = source or input_file
+        self.files = [f'{output_file}.seg{i}.part' for i in range(len(plan))]
+        self.remaining = len(plan)
+        self.ok = True
+        self.started = time.time()
+
+    def segment_args(self):
+        return [(self.source, segment_file, self.rendition, first_packet, end_packet, self.timeout, self.input_file)
+                for segment_file, (first_packet, end_packet) in zip(self.files, self.plan)]
+
+    def segment_done(self, future):
+        try:
+            self.ok = future.result() and self.ok
+        except Exception as e:
+            print(f'Error converting {self.input_file}: {e}')
+            self.ok = False
+        self.remaining -= 1
+        if self.remaining:
+            return None
+        try:
+            if not self.ok:
+                return False, None
+            join_segments(self.files, self.plan, self.output_file)
+            return True, None
+        except (OSError, ValueError) as e:
+            print(f'Error joining segments of {self.input_file}: {e}')
+            return False, str(e)
+        finally:
+            for segment_file in self.files:
+                if os.path.exists(segment_file):
+                    os.remove(segment_file)
+
+def iter_media_files(input_dir, output_dir, cache=None, extensions=AUDIO_EXTENSIONS, recursive=True):
+    """Yield (cache_key, input_file, output_file) for each file with one of extensions as the tree is scanned.
+
+    Uses os.scandir so entries are produced while the walk is still running and
+    nothing is held in memory beyond the directories left to visit. Files the
+    cache reports as already converted with the current settings are skipped.
+    """
+    pending_dirs = ['']
+    while pending_dirs:
+        rel_dir = pending_dirs.pop()
+        try:
+            with os.scandir(os.path.join(input_dir, rel_dir)) as entries:
+                for entry in entries:
+                    rel_path = os.path.join(rel_dir, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            pending_dirs.append(rel_path)
+                    elif entry.name.lower().endswith(extensions) and entry.is_file():
+                        # Mirror the relative path under output_dir to maintain folder structure
+                        output_file = os.path.join(output_dir, os.path.splitext(rel_path)[0] + '.opus')
+                        key = rel_path.replace(os.sep, '/')
+                        if cache is not None and cache.is_current(key, entry.path, output_file):
+                            print(f'Skipping up-to-date file: {output_file}')
+                            continue
+                        yield key, entry.path, output_file
+        except OSError as e:
+            print(f'Error scanning {os.path.join(input_dir, rel_dir)}: {e}')
+
+def collect_media_files(input_dir, output_dir, cache=None, extensions=AUDIO_EXTENSIONS, recursive=True):
+    """Collect all matching files and their corresponding output paths into a list."""
+    return list(iter_media_files(input_dir, output_dir, cache, extensions, recursive))
+
+def prefetch_iter(iterable, maxsize):
+    """Run iterable on a background thread, yielding its items through a bounded queue."""
+    items = queue.Queue(maxsize)
+    finished = object()
+
+    def producer():
+        try:
+            for item in iterable:
+                items.put(item)
+        except Exception as e:
+            print(f'Error collecting files: {e}')
+        finally:
+            items.put(finished)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is finished:
+            return
+        yield item
+
+def probe_duration(input_file):
+    """Return the duration of input_file in seconds, or None if it cannot be probed.
+
+    Uses ffprobe, falling back to PyAV when ffprobe is not installed.
+    """
+    if capabilities()['ffprobe']:
+        cmd = [
+            'ffprobe', '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            input_file
+        ]
+        try:
+            result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            return float(result.stdout.strip())
+        except FileNotFoundError:
+            pass
+        except (subprocess.CalledProcessError, ValueError):
+            return None
+    try:
+        import av
+        with av.open(input_file) as container:
+            if container.duration is not None:
+                return container.duration / av.time_base
+    except Exception:
+        pass
+    return None
+
+def probe_durations(input_files, max_workers=PROBE_WORKERS):
+    """Probe the durations of input_files in parallel, preserving order."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(probe_duration, input_files))
+
+def default_worker_count():
+    """Size the worker pool from the cores available to us minus the current load."""
+    if hasattr(os, 'sched_getaffinity'):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        load = 0.0
+    return max(1, cores - int(load))
+
+class EncodePool:
+    """The executor all converters submit encodes to.
+
+    At most max_in_flight jobs are queued at once, so a producer walking a
+    huge tree never gets far ahead of the encoders; each job's on_done
+    callback runs on the submitting thread as the job completes.
+    supervisor='threads' runs ffmpeg children straight from a thread pool,
+    'processes' wraps each job in a worker process. Leaving the pool waits
+    for the remaining jobs, or on Ctrl+C kills the running encoders (in
+    worker processes too, through a shared cancel event) and drops the
+    queued ones.
+    """
+
+    def __init__(self, max_workers=None, supervisor='processes', max_in_flight=None):
+        self.max_workers = max_workers or default_worker_count()
+        self.max_in_flight = max_in_flight or self.max_workers * 2
+        self.cancel_event = None
+        if supervisor == 'threads':
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        else:
+            self.cancel_event = multiprocessing.Event()
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker,
+                                                initargs=(self.cancel_event,))
+        self.in_flight = {}  # future -> on_done callback
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.drain()
+        elif issubclass(exc_type, KeyboardInterrupt):
+            if self.cancel_event is not None:
+                self.cancel_event.set()
+            kill_running_encoders()
+        self.executor.shutdown(wait=True, cancel_futures=exc_type is not None)
+        return False
+
+    def submit(self, fn, *args, on_done=None):
+        """Submit fn(*args), first waiting for a slot if max_in_flight jobs are queued."""
+        while len(self.in_flight) >= self.max_in_flight:
+            self.wait_any()
+        future = self.executor.submit(fn, *args)
+        self.in_flight[future] = on_done
+        return future
+
+    def _finish(self, done):
+        for future in done:
+            on_done = self.in_flight.pop(future)
+            if on_done is not None:
+                on_done(future)
+
+    def wait_any(self):
+        """Wait for at least one job and run the callbacks of every finished one."""
+        done, _ = wait(self.in_flight, return_when=FIRST_COMPLETED)
+        self._finish(done)
+
+    def drain(self):
+        """Wait for every submitted job."""
+        while self.in_flight:
+            self._finish(wait(self.in_flight).done)
+
+if __name__ == '__main__':
+    caps = capabilities()
+    print(f"ffmpeg:  {caps['ffmpeg'] or 'not found'}" + (f" ({caps['version']})" if caps['version'] else ''))
+    print(f"libopus: {'yes' if caps['libopus'] else 'no'}")
+    print(f"ffprobe: {caps['ffprobe'] or 'not found (PyAV is used to probe durations)'}")
+    print(f"PyAV:    {'yes' if caps['pyav'] else 'no'}")
+    print(f"Workers: {default_worker_count()} by default")
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+
+"""Spread a flac_to_opusHT2 conversion over several machines.
+
+The coordinator scans the library, skips files its manifest already has and
+serves the rest over HTTP. Workers lease one job at a time, renew the lease
+with heartbeats while ffmpeg runs and then either upload the encode or, when
+they see the same storage as the coordinator, just commit it. A job whose
+lease runs out (worker crashed, host went away) goes back in the queue.
+
+    python opus_farm.py coordinator /music /opus --port 8765
+    python opus_farm.py worker http://coordinator:8765 --workers 8
+    python opus_farm.py worker http://coordinator:8765 --shared /mnt/music /mnt/opus
+
+Everything is plain JSON over HTTP, so a farm can be tried with several
+local worker processes pointed at 127.0.0.1.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from opus_engine import (TranscodeCache, Rendition, collect_media_files, convert_file, kill_running_encoders,
+                         rendition_settings)
+
+DEFAULT_PORT = 8765
+LEASE_SECONDS = 60  # A job goes back in the queue if its worker is silent this long
+MAX_ATTEMPTS = 3  # Leases handed out per job before it is marked failed
+IDLE_WAIT = 2.0  # Seconds a worker waits when every remaining job is leased
+CHUNK_SIZE = 1 << 20
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+class Coordinator:
+    """Job table for one farm run: leases, expiry and results."""
+
+    def __init__(self, input_dir, output_dir, bitrate='128k', use_hash=False, lease_seconds=LEASE_SECONDS):
+        self.output_dir = output_dir
+        self.bitrate = bitrate
+        self.lease_seconds = lease_seconds
+        self.cache = TranscodeCache(output_dir, rendition_settings(Rendition(bitrate, None, None)), use_hash=use_hash)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.jobs = {}
+        self.queue = []  # Keys waiting for a worker, in scan order (popped from the end)
+        # (expires, key, attempt) per lease handed out; heartbeats only move job['expires'], and
+        # _expire_leases re-files an entry whose job was renewed and drops entries of finished leases
+        self.expiry = []
+        for key, input_file, output_file in collect_media_files(input_dir, output_dir, self.cache):
+            self.jobs[key] = {'input_file': input_file, 'output_file': output_file, 'state': PENDING,
+                              'worker': None, 'expires': 0.0, 'attempts': 0, 'error': None}
+            self.queue.append(key)
+        self.queue.reverse()
+        self.unfinished = len(self.jobs)  # Jobs not yet DONE or FAILED
+        if not self.jobs:
+            self.finished.set()
+
+    def lease(self, worker):
+        """Hand the next pending job to worker, or say whether to wait or stop."""
+        while True:
+            with self.lock:
+                self._expire_leases()
+                if not self.queue:
+                    if self.finished.is_set():
+                        return {'done': True}
+                    return {'wait': IDLE_WAIT}
+                key = self.queue.pop()  # Still PENDING and unfinished, so the run cannot end meanwhile
+                input_file = self.jobs[key]['input_file']
+            # Stat the source outside the lock, before the job counts as leased
+            try:
+                size = os.path.getsize(input_file)
+            except OSError as e:
+                with self.lock:
+                    job = self.jobs[key]
+                    job['error'] = f'Source unreadable: {e}'
+                    print(f"Error converting {input_file}: {job['error']}")
+                    self._set_state(job, FAILED)
+                continue
+            with self.lock:
+                job = self.jobs[key]
+                job.update(state=LEASED, worker=worker, expires=time.monotonic() + self.lease_seconds)
+                job['attempts'] += 1
+                heapq.heappush(self.expiry, (job['expires'], key, job['attempts']))
+                return {'key': key, 'bitrate': self.bitrate, 'lease_seconds': self.lease_seconds, 'size': size}
+
+    def _set_state(self, job, state):
+        """Move job to state, keeping the unfinished count and the finished event up to date."""
+        if state in (DONE, FAILED) and job['state'] not in (DONE, FAILED):
+            self.unfinished -= 1
+        job['state'] = state
+        if self.unfinished == 0:
+            self.finished.set()
+
+    def heartbeat(self, worker, keys):
+        """Renew worker's leases on keys; return the keys it no longer holds."""
+        lost = []
+        with self.lock:
+            for key in keys:
+                job = self.jobs.get(key)
+                if job and job['state'] == LEASED and job['worker'] == worker:
+                    job['expires'] = time.monotonic() + self.lease_seconds
+                else:
+                    lost.append(key)
+        return lost
+
+    def holds(self, worker, key):
+        with self.lock:
+            job = self.jobs.get(key)
+            return bool(job and job['state'] == LEASED and job['worker'] == worker)
+
+    def complete(self, worker, key, error=None):
+        """Record the outcome of a leased job once its output is in place."""
+        with self.lock:
+            job = self.jobs.get(key)
+            if not job or job['state'] != LEASED or job['worker'] != worker:
+                return False
+            if error is None:
+                try:
+                    self.cache.record(key, job['input_file'], job['output_file'])
+                    self._set_state(job, DONE)
+                    print(f"Done: {job['output_file']} ({worker})")
+                except OSError as e:
+                    error = f'Output missing after commit: {e}'
+            if error is not None:
+                job['error'] = error
+                print(f"Error converting {job['input_file']} on {worker}: {error}")
+                self._requeue(key)
+            return error is None
+
+    def _requeue(self, key):
+        job = self.jobs[key]
+        job['worker'] = None
+        if job['attempts'] >= MAX_ATTEMPTS:
+            self._set_state(job, FAILED)
+        else:
+            self._set_state(job, PENDING)
+            self.queue.append(key)
+
+    def _expire_leases(self):
+        """Requeue the jobs whose lease ran out; costs O(log n) per lease that has come due."""
+        now = time.monotonic()
+        expiry = self.expiry
+        while expiry and expiry[0][0] < now:
+            _, key, attempt = heapq.heappop(expiry)
+            job = self.jobs[key]
+            if job['state'] != LEASED or job['attempts'] != attempt:
+                continue  # That lease already ended
+            if job['expires'] >= now:
+                heapq.heappush(expiry, (job['expires'], key, attempt))  # Renewed by heartbeats
+                continue
+            print(f"Lease expired: {job['input_file']} ({job['worker']})")
+            job['error'] = f"Lease expired on {job['worker']}"
+            self._requeue(key)
+
+    def expire_leases(self):
+        with self.lock:
+            self._expire_leases()
+
+    def status(self):
+        with self.lock:
+            counts = {state: 0 for state in (PENDING, LEASED, DONE, FAILED)}
+            for job in self.jobs.values():
+                counts[job['state']] += 1
+            counts['workers'] = sorted({job['worker'] for job in self.jobs.values() if job['state'] == LEASED})
+            return counts
+
+    def failures(self):
+        with self.lock:
+            return [(job['input_file'], job['error']) for job in self.jobs.values() if job['state'] == FAILED]
+
+class FarmHandler(BaseHTTPRequestHandler):
+    """HTTP front end of a Coordinator (set as the server's coordinator attribute)."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def route(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        return parsed.path, params
+
+    def authorized(self):
+        token = self.server.token
+        if token and self.headers.get('X-Farm-Token') != token:
+            self.send_json({'error': 'bad token'}, 403)
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        coordinator = self.server.coordinator
+        path, params = self.route()
+        if path == '/status':
+            self.send_json(coordinator.status())
+        elif path == '/source':
+            key, worker = params.get('key'), params.get('worker')
+            if not coordinator.holds(worker, key):
+                self.send_json({'error': 'lease not held'}, 409)
+                return
+            input_file = coordinator.jobs[key]['input_file']
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.path.getsize(input_file)))
+            self.end_headers()
+            with open(input_file, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        coordinator = self.server.coordinator
+        path, params = self.route()
+        if path == '/lease':
+            self.send_json(coordinator.lease(self.read_json()['worker']))
+        elif path == '/heartbeat':
+            data = self.read_json()
+            self.send_json({'lost': coordinator.heartbeat(data['worker'], data['keys'])})
+        elif path == '/commit':
+            # The worker wrote the output itself on shared storage, or reports a failure
+            data = self.read_json()
+            self.send_json({'ok': coordinator.complete(data['worker'], data['key'], data.get('error'))})
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_PUT(self):
+        if not self.authorized():
+            return
+        coordinator = self.server.coordinator
+        path, params = self.route()
+        key, worker = params.get('key'), params.get('worker')
+        if path != '/result':
+            self.send_json({'error': 'not found'}, 404)
+            return
+        if not coordinator.holds(worker, key):
+            # Drain the upload so the connection stays usable, then refuse it
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.send_json({'error': 'lease not held'}, 409)
+            return
+        output_file = coordinator.jobs[key]['output_file']
+        tmp_path = f'{output_file}.{threading.get_ident()}.part'
+        remaining = int(self.headers.get('Content-Length', 0))
+        try:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                while remaining:
+                    chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise OSError('upload ended early')
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            os.replace(tmp_path, output_file)
+        except OSError as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            coordinator.complete(worker, key, f'Upload failed: {e}')
+            self.send_json({'ok': False, 'error': str(e)}, 500)
+            return
+        self.send_json({'ok': coordinator.complete(worker, key)})
+
+def run_coordinator(input_dir, output_dir, host='0.0.0.0', port=DEFAULT_PORT, bitrate='128k', use_hash=False,
+                    lease_seconds=LEASE_SECONDS, token=None):
+    """Serve the conversion of input_dir until every job is done or failed."""
+    coordinator = Coordinator(input_dir, output_dir, bitrate, use_hash, lease_seconds)
+    server = ThreadingHTTPServer((host, port), FarmHandler)
+    server.daemon_threads = True
+    server.coordinator = coordinator
+    server.token = token
+    print(f'Serving {len(coordinator.jobs)} jobs on {host}:{server.server_address[1]}')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        while not coordinator.finished.wait(lease_seconds / 4):
+            coordinator.expire_leases()
+        # Give workers one more poll so they hear that the run is over
+        time.sleep(IDLE_WAIT * 2)
+    except KeyboardInterrupt:
+        print('Interrupted, saving progress.')
+    finally:
+        server.shutdown()
+        server.server_close()
+        if coordinator.cache.dirty:
+            coordinator.cache.save()
+    counts = coordinator.status()
+    print(f"Finished: {counts[DONE]} done, {counts[FAILED]} failed, {counts[PENDING] + counts[LEASED]} left")
+    for input_file, error in coordinator.failures():
+        print(f'  FAILED: {input_file}: {error}')
+    return counts
+
+class WorkerClient:
+    """HTTP client side of the farm protocol for one worker process."""
+
+    def __init__(self, url, name, token=None):
+        self.url = url.rstrip('/')
+        self.name = name
+        self.token = token
+        self.held = set()
+        self.held_lock = threading.Lock()
+
+    def request(self, method, path, data=None, body=None, params=None, timeout=60):
+        query = urllib.parse.urlencode(dict(params or {}, worker=self.name))
+        headers = {}
+        if self.token:
+            headers['X-Farm-Token'] = self.token
+        if data is not None:
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if body is not None and not isinstance(body, bytes):
+            headers['Content-Length'] = str(os.fstat(body.fileno()).st_size)
+        req = urllib.request.Request(f'{self.url}{path}?{query}', data=body, headers=headers, method=method)
+        return urllib.request.urlopen(req, timeout=timeout)
+
+    def call(self, method, path, data=None, **kwargs):
+        with self.request(method, path, data, **kwargs) as response:
+            return json.loads(response.read())
+
+    def lease(self):
+        job = self.call('POST', '/lease', {'worker': self.name})
+        if 'key' in job:
+            with self.held_lock:
+                self.held.add(job['key'])
+        return job
+
+    def release(self, key):
+        with self.held_lock:
+            self.held.discard(key)
+
+    def heartbeat(self):
+        with self.held_lock:
+            keys = list(self.held)
+        if keys:
+            lost = self.call('POST', '/heartbeat', {'worker': self.name, 'keys': keys})['lost']
+            for key in lost:
+                print(f'Lost lease on {key}')
+
+    def commit(self, key, error=None):
+        return self.call('POST', '/commit', {'worker': self.name, 'key': key, 'error': error})['ok']
+
+    def download(self, key, path):
+        with self.request('GET', '/source', params={'key': key}, timeout=600) as response, open(path, 'wb') as f:
+            shutil.copyfileobj(response, f, CHUNK_SIZE)
+
+    def upload(self, key, path):
+        with open(path, 'rb') as f:
+            with self.request('PUT', '/result', body=f, params={'key': key}, timeout=600) as response:
+                return json.loads(response.read())['ok']
+
+def run_job(client, job, shared=None, timeout=None):
+    """Encode one leased job; shared is (input_dir, output_dir) as mounted on this host."""
+    key = job['key']
+    try:
+        if shared:
+            input_file = os.path.join(shared[0], *key.split('/'))
+            output_file = os.path.join(shared[1], *(os.path.splitext(key)[0] + '.opus').split('/'))
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            if convert_file(input_file, output_file, job['bitrate'], timeout):
+                client.commit(key)
+            else:
+                client.commit(key, f'ffmpeg failed on {client.name}')
+            return
+        with tempfile.TemporaryDirectory(prefix='opus_farm_') as work_dir:
+            input_file = os.path.join(work_dir, 'source' + os.path.splitext(key)[1])
+            output_file = os.path.join(work_dir, 'output.opus')
+            client.download(key, input_file)
+            if convert_file(input_file, output_file, job['bitrate'], timeout):
+                client.upload(key, output_file)
+            else:
+                client.commit(key, f'ffmpeg failed on {client.name}')
+    except (OSError, urllib.error.URLError) as e:
+        print(f'Error on job {key}: {e}')
+        try:
+            client.commit(key, f'{client.name}: {e}')
+        except (OSError, urllib.error.URLError):
+            pass  # The lease will expire and the job will be re-queued
+    finally:
+        client.release(key)
+
+def run_worker(url, workers=None, shared=None, name=None, token=None, timeout=None):
+    """Lease and encode jobs from the coordinator at url until it has none left."""
+    workers = workers or os.cpu_count() or 1
+    client = WorkerClient(url, name or f'{socket.gethostname()}-{os.getpid()}', token)
+    stop = threading.Event()
+    lease_seconds = [LEASE_SECONDS]
+
+    def heartbeats():
+        while not stop.wait(lease_seconds[0] / 3):
+            try:
+                client.heartbeat()
+            except (OSError, urllib.error.URLError) as e:
+                print(f'Heartbeat failed: {e}')
+
+    def loop():
+        while not stop.is_set():
+            try:
+                job = client.lease()
+            except (OSError, urllib.error.URLError) as e:
+                print(f'Cannot reach coordinator: {e}')
+                stop.wait(IDLE_WAIT)
+                continue
+            if job.get('done'):
+                return
+            if 'wait' in job:
+                stop.wait(job['wait'])
+                continue
+            lease_seconds[0] = job['lease_seconds']
+            run_job(client, job, shared, timeout)
+
+    threading.Thread(target=heartbeats, daemon=True).start()
+    threads = [threading.Thread(target=loop) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        stop.set()
+        kill_running_encoders()
+        raise
+    finally:
+        stop.set()
+    print(f'Worker {client.name} finished.')
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed Opus conversion: coordinator and workers')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    coordinator = subparsers.add_parser('coordinator', help='Serve the jobs for a library')
+    coordinator.add_argument('input_dir', help='Input directory')
+    coordinator.add_argument('output_dir', help='Output directory')
+    coordinator.add_argument('--host', default='0.0.0.0', help='Address to listen on (default: 0.0.0.0)')
+    coordinator.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port (default: {DEFAULT_PORT})')
+    coordinator.add_argument('--bitrate', default='128k', help='Opus bitrate (default: 128k)')
+    coordinator.add_argument('--hash', action='store_true', help='Store content hashes in the manifest')
+    coordinator.add_argument('--lease', type=float, default=LEASE_SECONDS,
+                             help=f'Seconds without a heartbeat before a job is re-queued (default: {LEASE_SECONDS})')
+    coordinator.add_argument('--token', default=os.environ.get('OPUS_FARM_TOKEN'),
+                             help='Shared secret workers must send (default: $OPUS_FARM_TOKEN)')
+
+    worker = subparsers.add_parser('worker', help='Encode jobs leased from a coordinator')
+    worker.add_argument('url', help='Coordinator URL, e.g. http://host:8765')
+    worker.add_argument('--workers', type=int, default=None, help='Concurrent encodes (default: CPU count)')
+    worker.add_argument('--shared', nargs=2, metavar=('INPUT_DIR', 'OUTPUT_DIR'),
+                        help='Read and write the library directly where it is mounted on this host')
+    worker.add_argument('--name', help='Worker name shown by the coordinator (default: host-pid)')
+    worker.add_argument('--token', default=os.environ.get('OPUS_FARM_TOKEN'),
+                        help='Shared secret (default: $OPUS_FARM_TOKEN)')
+    worker.add_argument('--timeout', type=float, default=None, help='Kill an encode after this many seconds')
+    args = parser.parse_args()
+
+    if args.mode == 'coordinator':
+        if not os.path.isdir(args.input_dir):
+            print(f'The input directory {args.input_dir} does not exist.')
+            sys.exit(1)
+        os.makedirs(args.output_dir, exist_ok=True)
+        counts = run_coordinator(args.input_dir, args.output_dir, args.host, args.port, args.bitrate, args.hash,
+                                 args.lease, args.token)
+        sys.exit(1 if counts[FAILED] else 0)
+    run_worker(args.url, args.workers, args.shared, args.name, args.token, args.timeout)
+
+if __name__ == '__main__':
+    main()
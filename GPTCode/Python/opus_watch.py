@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+"""Keep an Opus mirror of a library up to date as files arrive.
+
+The input tree is watched with inotify (through ctypes, no extra packages)
+or, where that is unavailable, by polling. New and modified audio files are
+converted once they have stopped changing for a few seconds; deletes and
+renames are mirrored into the output tree and the manifest, so nothing is
+re-encoded after a move.
+
+    python opus_watch.py /music /opus
+    python flac_to_opusHT2.py /music /opus --watch
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from opus_engine import (AUDIO_EXTENSIONS, TranscodeCache, Rendition, convert_file, default_worker_count,
+                         iter_media_files, kill_running_encoders, rendition_settings)
+
+DEBOUNCE_SECONDS = 3.0  # A file is converted once it has been quiet this long
+POLL_INTERVAL = 10.0
+IDLE_SAVE_SECONDS = 5.0  # Flush the manifest after this long with nothing converting
+MOVE_GRACE_SECONDS = 0.5  # How long an IN_MOVED_FROM waits for its IN_MOVED_TO in a later read
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+def is_audio(rel_path):
+    return rel_path.lower().endswith(AUDIO_EXTENSIONS)
+
+def join_rel(rel_dir, name):
+    return f'{rel_dir}/{name}' if rel_dir else name
+
+class InotifyWatcher:
+    """Recursive inotify watch on root, reporting events as paths relative to root.
+
+    read_events() returns a list of ('changed', rel), ('deleted', rel),
+    ('moved', old_rel, new_rel) or ('rescan', '') tuples; rel may name a
+    directory for deletes and moves.
+    """
+
+    def __init__(self, root):
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.root = root
+        self.paths = {}  # Watch descriptor -> directory relative to root
+        self.moved_from = {}  # cookie -> (rel_path, is_dir, deadline) until the matching IN_MOVED_TO arrives
+        self.add_tree('')
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_watch(self, rel_dir):
+        path = os.path.join(self.root, *rel_dir.split('/')) if rel_dir else self.root
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                print('Out of inotify watches; raise fs.inotify.max_user_watches')
+            return
+        self.paths[wd] = rel_dir
+
+    def add_tree(self, rel_dir):
+        """Watch rel_dir and everything below it; return the audio files already inside."""
+        found = []
+        pending = [rel_dir]
+        while pending:
+            current = pending.pop()
+            self.add_watch(current)
+            try:
+                with os.scandir(os.path.join(self.root, *current.split('/')) if current else self.root) as entries:
+                    for entry in entries:
+                        rel_path = join_rel(current, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(rel_path)
+                        elif is_audio(entry.name):
+                            found.append(rel_path)
+            except OSError:
+                pass
+        return found
+
+    def read_events(self, timeout):
+        if self.moved_from:
+            # Wake up in time to report renames whose other half never came
+            deadline = min(deadline for _, _, deadline in self.moved_from.values())
+            timeout = max(0, min(timeout, deadline - time.monotonic()))
+        data = b''
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                pass
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            name = os.fsdecode(data[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + length].rstrip(b'\0'))
+            pos += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append(('rescan', ''))
+                continue
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            rel_dir = self.paths.get(wd)
+            if rel_dir is None or not name:
+                continue
+            rel_path = join_rel(rel_dir, name)
+            is_dir = bool(mask & IN_ISDIR)
+            if mask & IN_MOVED_FROM:
+                self.moved_from[cookie] = rel_path, is_dir, time.monotonic() + MOVE_GRACE_SECONDS
+            elif mask & IN_MOVED_TO:
+                if cookie in self.moved_from:
+                    old_path, _, _ = self.moved_from.pop(cookie)
+                    events.append(('moved', old_path, rel_path))
+                    if is_dir:
+                        self.rename_watches(old_path, rel_path)
+                elif is_dir:
+                    events += [('changed', rel) for rel in self.add_tree(rel_path)]
+                else:
+                    events.append(('changed', rel_path))
+            elif mask & IN_DELETE:
+                events.append(('deleted', rel_path))
+            elif mask & IN_CREATE and is_dir:
+                # Files copied in before the watch existed would otherwise be missed
+                events += [('changed', rel) for rel in self.add_tree(rel_path)]
+            elif mask & (IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE) and not is_dir:
+                events.append(('changed', rel_path))
+        # A pair can straddle two reads; only once the grace period is over was it
+        # moved out of the watched tree, which is as good as deleted
+        now = time.monotonic()
+        for cookie, (rel_path, _, deadline) in list(self.moved_from.items()):
+            if deadline <= now:
+                del self.moved_from[cookie]
+                events.append(('deleted', rel_path))
+        return events
+
+    def rename_watches(self, old_dir, new_dir):
+        for wd, rel_dir in self.paths.items():
+            if rel_dir == old_dir or rel_dir.startswith(old_dir + '/'):
+                self.paths[wd] = new_dir + rel_dir[len(old_dir):]
+
+class PollingWatcher:
+    """Fallback watcher that rescans root every interval seconds and diffs the results."""
+
+    def __init__(self, root, interval=POLL_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.snapshot = self.scan()
+        self.next_scan = time.monotonic() + interval
+
+    def fileno(self):
+        return None
+
+    def close(self):
+        pass
+
+    def scan(self):
+        snapshot = {}
+        for key, input_file, _ in iter_media_files(self.root, ''):
+            try:
+                st = os.stat(input_file)
+            except OSError:
+                continue
+            snapshot[key] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def read_events(self, timeout):
+        delay = self.next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(delay, 0))
+        self.next_scan = time.monotonic() + self.interval
+        previous, self.snapshot = self.snapshot, self.scan()
+        removed = {key: stat for key, stat in previous.items() if key not in self.snapshot}
+        added = [key for key, stat in self.snapshot.items() if previous.get(key) != stat]
+        events = []
+        # A file that vanished and one that appeared with the same size and mtime was renamed
+        by_stat = {stat: key for key, stat in removed.items()}
+        for key in added:
+            old_key = by_stat.pop(self.snapshot[key], None) if key not in previous else None
+            if old_key is not None:
+                del removed[old_key]
+                events.append(('moved', old_key, key))
+            else:
+                events.append(('changed', key))
+        events += [('deleted', key) for key in removed]
+        return events
+
+def open_watcher(root, polling=False, interval=POLL_INTERVAL):
+    """Return an InotifyWatcher for root, or a PollingWatcher if inotify cannot be used."""
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root)
+        except OSError as e:
+            print(f'inotify unavailable ({e}), polling every {interval:g} s instead')
+    return PollingWatcher(root, interval)
+
+class WatchDaemon:
+    """Convert, move and delete outputs in output_dir as the watcher reports changes."""
+
+    def __init__(self, input_dir, output_dir, bitrate='128k', max_workers=None, use_hash=False,
+                 debounce=DEBOUNCE_SECONDS, timeout=None):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.bitrate = bitrate
+        self.debounce = debounce
+        self.timeout = timeout
+        self.cache = TranscodeCache(output_dir, rendition_settings(Rendition(bitrate, None, None)), use_hash=use_hash)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or default_worker_count())
+        self.pending = {}  # rel -> (deadline, last seen (size, mtime_ns))
+        self.in_flight = {}  # future -> (rel, (size, mtime_ns) when started)
+        self.last_activity = time.monotonic()
+
+    def input_path(self, rel):
+        return os.path.join(self.input_dir, *rel.split('/'))
+
+    def output_path(self, rel):
+        return os.path.join(self.output_dir, *(os.path.splitext(rel)[0] + '.opus').split('/'))
+
+    def stat(self, rel):
+        try:
+            st = os.stat(self.input_path(rel))
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def handle(self, event):
+        kind, rel = event[0], event[1]
+        self.last_activity = time.monotonic()
+        if kind == 'changed':
+            if is_audio(rel):
+                self.pending[rel] = (time.monotonic() + self.debounce, self.stat(rel))
+        elif kind == 'deleted':
+            self.delete(rel)
+        elif kind == 'moved':
+            self.move(rel, event[2])
+        elif kind == 'rescan':
+            print('Watch queue overflowed, rescanning')
+            self.scan()
+
+    def scan(self):
+        """Queue every file whose output is missing or stale."""
+        for key, _, _ in iter_media_files(self.input_dir, self.output_dir, self.cache):
+            self.pending[key] = (time.monotonic(), self.stat(key))
+
+    def delete(self, rel):
+        """Drop the output (or output subtree) mirroring rel."""
+        self.pending.pop(rel, None)
+        for key in self.cache.pop_entries(rel):
+            output_file = self.output_path(key)
+            if os.path.exists(output_file):
+                os.remove(output_file)
+                print(f'Removed: {output_file}')
+            self.prune_dirs(os.path.dirname(output_file))
+
+    def move(self, old_rel, new_rel):
+        """Rename the output (or output subtree) of old_rel instead of re-encoding it."""
+        prefix = old_rel + '/'
+        for key, entry in self.cache.pop_entries(old_rel).items():
+            new_key = new_rel + key[len(old_rel):]
+            old_output, new_output = self.output_path(key), self.output_path(new_key)
+            try:
+                if not is_audio(new_key):
+                    os.remove(old_output)
+                else:
+                    os.makedirs(os.path.dirname(new_output), exist_ok=True)
+                    os.replace(old_output, new_output)
+                    self.cache.put_entry(new_key, entry)
+                    print(f'Moved: {old_output} -> {new_output}')
+            except OSError:
+                pass
+            self.prune_dirs(os.path.dirname(old_output))
+        for key in [key for key in self.pending if key == old_rel or key.startswith(prefix)]:
+            del self.pending[key]
+        # Anything not converted yet (e.g. an upload renamed from song.flac.tmp) is queued
+        # under its new name; start_ready() skips whatever the renamed manifest covers
+        new_path = self.input_path(new_rel)
+        if os.path.isdir(new_path):
+            for key, _, _ in iter_media_files(new_path, ''):
+                self.handle(('changed', join_rel(new_rel, key)))
+        else:
+            self.handle(('changed', new_rel))
+
+    def prune_dirs(self, directory):
+        """Remove directory and its parents inside output_dir while they are empty."""
+        output_root = os.path.abspath(self.output_dir)
+        directory = os.path.abspath(directory)
+        while directory != output_root and directory.startswith(output_root + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    def start_ready(self):
+        """Submit pending files that have been quiet for the debounce period."""
+        now = time.monotonic()
+        running = {rel for rel, _ in self.in_flight.values()}
+        for rel, (deadline, seen) in list(self.pending.items()):
+            if deadline > now or rel in running:
+                continue
+            current = self.stat(rel)
+            if current is None:
+                del self.pending[rel]
+            elif current != seen:
+                # Still being written
+                self.pending[rel] = (now + self.debounce, current)
+            else:
+                del self.pending[rel]
+                if self.cache.is_current(rel, self.input_path(rel), self.output_path(rel)):
+                    continue
+                output_file = self.output_path(rel)
+                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                future = self.executor.submit(convert_file, self.input_path(rel), output_file, self.bitrate,
+                                              self.timeout)
+                self.in_flight[future] = (rel, current)
+
+    def finish(self, done):
+        for future in done:
+            rel, started = self.in_flight.pop(future)
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f'Error converting {rel}: {e}')
+                continue
+            if not ok:
+                continue
+            current = self.stat(rel)
+            if current is None:
+                # Deleted while it was being encoded
+                self.delete(rel)
+                output_file = self.output_path(rel)
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+            elif current == started:
+                self.cache.record(rel, self.input_path(rel), self.output_path(rel))
+            # Otherwise the file changed mid-encode and is already pending again
+        self.last_activity = time.monotonic()
+
+    def next_timeout(self):
+        if self.in_flight:
+            return 0.5
+        if self.pending:
+            return max(0.05, min(deadline for deadline, _ in self.pending.values()) - time.monotonic())
+        return IDLE_SAVE_SECONDS
+
+    def run(self, watcher, stop=None, initial_scan=True):
+        """Process watcher events until stop (a threading.Event) is set or Ctrl+C."""
+        if initial_scan:
+            self.scan()
+        print(f'Watching {self.input_dir}')
+        try:
+            while stop is None or not stop.is_set():
+                for event in watcher.read_events(self.next_timeout()):
+                    self.handle(event)
+                self.start_ready()
+                if self.in_flight:
+                    done, _ = wait(self.in_flight, timeout=0, return_when=FIRST_COMPLETED)
+                    self.finish(done)
+                elif self.cache.dirty and time.monotonic() - self.last_activity >= IDLE_SAVE_SECONDS:
+                    self.cache.save()
+        except KeyboardInterrupt:
+            kill_running_encoders()
+        finally:
+            self.finish(wait(self.in_flight).done)
+            self.executor.shutdown()
+            watcher.close()
+            if self.cache.dirty:
+                self.cache.save()
+
+def watch(input_dir, output_dir, bitrate='128k', max_workers=None, use_hash=False, polling=False,
+          interval=POLL_INTERVAL, debounce=DEBOUNCE_SECONDS, timeout=None, initial_scan=True):
+    """Mirror input_dir into output_dir as Opus until interrupted."""
+    daemon = WatchDaemon(input_dir, output_dir, bitrate, max_workers, use_hash, debounce, timeout)
+    daemon.run(open_watcher(input_dir, polling, interval), initial_scan=initial_scan)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Watch a directory and keep an Opus copy of it up to date')
+    parser.add_argument('input_dir', help='Input directory')
+    parser.add_argument('output_dir', help='Output directory')
+    parser.add_argument('--bitrate', default='128k', help='Opus bitrate (default: 128k)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Concurrent encodes (default: available cores minus load average)')
+    parser.add_argument('--hash', action='store_true',
+                        help='Store content hashes so touched-but-unchanged files are not re-encoded')
+    parser.add_argument('--poll', action='store_true', help='Poll instead of using inotify')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL,
+                        help=f'Seconds between polls (default: {POLL_INTERVAL:g})')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS,
+                        help=f'Seconds a file must be unchanged before converting (default: {DEBOUNCE_SECONDS:g})')
+    parser.add_argument('--timeout', type=float, default=None, help='Kill an encode after this many seconds')
+    parser.add_argument('--no-initial-scan', action='store_true',
+                        help='Only react to new events instead of first catching up on the whole tree')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input_dir):
+        print(f'The input directory {args.input_dir} does not exist.')
+        sys.exit(1)
+    os.makedirs(args.output_dir, exist_ok=True)
+    watch(args.input_dir, args.output_dir, args.bitrate, args.workers, args.hash, args.poll, args.interval,
+          args.debounce, args.timeout, not args.no_initial_scan)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""In-process Opus encoding with PyAV.
+
+Decoding and encoding happen inside the Python process, so converting many
+small files does not pay an ffmpeg process start-up per file.
+"""
+
+import os
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# Inputs up to this size are encoded in-process when the backend is 'auto';
+# larger files go to the ffmpeg CLI, where start-up cost is negligible
+PYAV_MAX_BYTES = 16 * 1024 * 1024
+
+OPUS_SAMPLE_RATES = (48000, 24000, 16000, 12000, 8000)
+
+def available():
+    """Return True if PyAV is installed."""
+    return av is not None
+
+def choose_backend(input_file, backend='auto'):
+    """Pick 'pyav' or 'ffmpeg' for input_file."""
+    if backend != 'auto':
+        return backend
+    if not available():
+        return 'ffmpeg'
+    try:
+        size = os.path.getsize(input_file)
+    except OSError:
+        return 'ffmpeg'
+    return 'pyav' if size <= PYAV_MAX_BYTES else 'ffmpeg'
+
+def parse_bitrate(bitrate):
+    """Convert an ffmpeg-style bitrate such as '128k' to bits per second."""
+    bitrate = str(bitrate).strip().lower()
+    if bitrate.endswith('k'):
+        return int(float(bitrate[:-1]) * 1000)
+    if bitrate.endswith('m'):
+        return int(float(bitrate[:-1]) * 1000000)
+    return int(bitrate)
+
+def encode_file(input_file, output_file, bitrate='128k', sample_rate=None, constant_bitrate=False,
+                progress_callback=None):
+    """Encode the first audio stream of input_file to an Ogg Opus output_file.
+
+    sample_rate defaults to the input rate; a rate libopus cannot encode,
+    such as 44100, is resampled to 48000 as the ffmpeg CLI does. The output
+    is written to a temporary file and renamed into place, so a failed
+    encode never leaves a truncated file. progress_callback, if given, is
+    called with the number of seconds of input decoded so far. Raises
+    ValueError for inputs without audio and av.error.FFmpegError for
+    unreadable ones.
+    """
+    if av is None:
+        raise RuntimeError("PyAV is not installed.")
+    with av.open(input_file) as source:
+        if not source.streams.audio:
+            raise ValueError(f"'{input_file}' has no audio stream.")
+        in_stream = source.streams.audio[0]
+        rate = int(sample_rate) if sample_rate else in_stream.rate
+        if rate not in OPUS_SAMPLE_RATES:
+            rate = 48000
+        layout = 'mono' if in_stream.channels == 1 else 'stereo'
+
+        tmp_path = output_file + '.part'
+        try:
+            encode_stream(source, in_stream, tmp_path, bitrate, rate, layout, constant_bitrate, progress_callback)
+            os.replace(tmp_path, output_file)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def encode_stream(source, in_stream, output_file, bitrate, rate, layout, constant_bitrate, progress_callback):
+    """Decode in_stream from the open container source and encode it to output_file."""
+    with av.open(output_file, 'w', format='ogg') as target:
+        out_stream = target.add_stream('libopus', rate=rate, layout=layout)
+        out_stream.bit_rate = parse_bitrate(bitrate)
+        out_stream.format = 'flt'
+        if constant_bitrate:
+            out_stream.codec_context.options = {'vbr': 'off'}
+
+        # One resampler per encode: it is a stateful filter graph holding buffered samples,
+        # so sharing one between files (or threads) would mix their audio
+        resampler = av.AudioResampler(format='flt', layout=layout, rate=rate)
+        for frame in source.decode(in_stream):
+            if progress_callback is not None and frame.time is not None:
+                progress_callback(frame.time)
+            frame.pts = None
+            for resampled in resampler.resample(frame):
+                for packet in out_stream.encode(resampled):
+                    target.mux(packet)
+        for resampled in resampler.resample(None):
+            for packet in out_stream.encode(resampled):
+                target.mux(packet)
+        for packet in out_stream.encode(None):
+            target.mux(packet)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""Structured per-file events and a Prometheus summary for conversion runs.
+
+start_run() points the converters at a JSONL log through environment
+variables, so encodes running in worker processes append to the same file.
+Each encode adds one line; finish_run() summarises the run's lines in
+Prometheus text format, ready for the node_exporter textfile collector.
+
+    python run_metrics.py events.jsonl [summary.prom]   # summarise a log
+"""
+
+import json
+import math
+import os
+import sys
+import time
+import uuid
+
+import ogg_opus
+
+METRICS_LOG_ENV = 'OPUS_METRICS_LOG'
+METRICS_RUN_ENV = 'OPUS_METRICS_RUN'
+
+def start_run(log_path):
+    """Send this process's (and its future children's) file events to log_path; return the run id."""
+    run_id = uuid.uuid4().hex[:12]
+    os.environ[METRICS_LOG_ENV] = os.path.abspath(log_path)
+    os.environ[METRICS_RUN_ENV] = run_id
+    os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+    return run_id
+
+def enabled():
+    return METRICS_LOG_ENV in os.environ
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+def write_event(event):
+    """Append one event as a single write, so concurrent writers never interleave lines."""
+    line = (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+    fd = os.open(os.environ[METRICS_LOG_ENV], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+def record_file(converter, input_file, output_file, started, exit_code, stderr_tail='', **extra):
+    """Log one finished encode; started is its time.time() start. Does nothing unless a run is active."""
+    if not enabled():
+        return
+    ended = time.time()
+    audio_seconds = None
+    if exit_code == 0 and output_file:
+        try:
+            audio_seconds = round(ogg_opus.stream_duration(output_file), 3)
+        except (OSError, ValueError):
+            pass
+    event = {
+        'event': 'file',
+        'run': os.environ.get(METRICS_RUN_ENV),
+        'converter': converter,
+        'pid': os.getpid(),
+        'input': input_file,
+        'output': output_file,
+        'start': round(started, 3),
+        'end': round(ended, 3),
+        'seconds': round(ended - started, 3),
+        'input_bytes': file_size(input_file),
+        'output_bytes': file_size(output_file) if exit_code == 0 else None,
+        'audio_seconds': audio_seconds,
+        'exit_code': exit_code,
+        'ok': exit_code == 0,
+        'stderr_tail': stderr_tail or '',
+    }
+    event.update(extra)
+    try:
+        write_event(event)
+    except OSError as e:
+        print(f'Could not write metrics event: {e}', file=sys.stderr)
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values (which must be sorted)."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def summarize(log_path, run_id=None):
+    """Aggregate the file events of one run (the last run in the log if run_id is None)."""
+    events = []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by a crash
+            if event.get('event') == 'file':
+                events.append(event)
+    if run_id is None and events:
+        run_id = events[-1].get('run')
+    events = [event for event in events if event.get('run') == run_id]
+    latencies = sorted(event['seconds'] for event in events)
+    ok = [event for event in events if event['ok']]
+    wall = (max(event['end'] for event in events) - min(event['start'] for event in events)) if events else 0.0
+    # A source encoded to several renditions logs one event per output; count its bytes once
+    input_bytes = sum({event['input']: event['input_bytes'] or 0 for event in ok}.values())
+    return {
+        'run': run_id,
+        'converter': events[0]['converter'] if events else '',
+        'files': len(ok),
+        'failures': len(events) - len(ok),
+        'wall_seconds': wall,
+        'files_per_second': len(ok) / wall if wall else 0.0,
+        'input_bytes': input_bytes,
+        'output_bytes': sum(event['output_bytes'] or 0 for event in ok),
+        'input_bytes_per_second': input_bytes / wall if wall else 0.0,
+        'audio_seconds': sum(event['audio_seconds'] or 0.0 for event in ok),
+        'latency_p50': percentile(latencies, 0.50),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_sum': sum(latencies),
+        'latency_count': len(latencies),
+    }
+
+def format_value(value):
+    return str(value) if isinstance(value, int) else repr(round(float(value), 6))
+
+def prometheus_text(summary):
+    """Render a summary in the Prometheus text exposition format."""
+    labels = f'converter="{summary["converter"]}"'
+    metrics = [
+        ('opus_run_files', 'gauge', 'Files converted successfully in the last run', summary['files']),
+        ('opus_run_failures', 'gauge', 'Files that failed to convert in the last run', summary['failures']),
+        ('opus_run_wall_seconds', 'gauge', 'Wall time of the last run', summary['wall_seconds']),
+        ('opus_run_files_per_second', 'gauge', 'Files converted per second', summary['files_per_second']),
+        ('opus_run_input_bytes', 'gauge', 'Source bytes converted', summary['input_bytes']),
+        ('opus_run_output_bytes', 'gauge', 'Opus bytes written', summary['output_bytes']),
+        ('opus_run_input_bytes_per_second', 'gauge', 'Source bytes converted per second',
+         summary['input_bytes_per_second']),
+        ('opus_run_audio_seconds', 'gauge', 'Seconds of audio encoded', summary['audio_seconds']),
+    ]
+    lines = []
+    for name, kind, help_text, value in metrics:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name}{{{labels}}} {format_value(value)}']
+    lines += [
+        '# HELP opus_run_file_latency_seconds Per-file encode time',
+        '# TYPE opus_run_file_latency_seconds summary',
+        f'opus_run_file_latency_seconds{{{labels},quantile="0.5"}} {format_value(summary["latency_p50"])}',
+        f'opus_run_file_latency_seconds{{{labels},quantile="0.95"}} {format_value(summary["latency_p95"])}',
+        f'opus_run_file_latency_seconds_sum{{{labels}}} {format_value(summary["latency_sum"])}',
+        f'opus_run_file_latency_seconds_count{{{labels}}} {summary["latency_count"]}',
+        '# HELP opus_run_completed_timestamp_seconds When the last run finished',
+        '# TYPE opus_run_completed_timestamp_seconds gauge',
+        f'opus_run_completed_timestamp_seconds{{{labels}}} {time.time():.0f}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+def write_summary(summary, path):
+    """Atomically write the Prometheus summary (the textfile collector may read it at any time)."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text(summary))
+    os.replace(tmp_path, path)
+
+def finish_run(summary_path=None):
+    """Summarise the active run, write summary_path (default: the log with .prom) and stop logging."""
+    log_path = os.environ.pop(METRICS_LOG_ENV, None)
+    run_id = os.environ.pop(METRICS_RUN_ENV, None)
+    if log_path is None or not os.path.exists(log_path):
+        return None
+    summary = summarize(log_path, run_id)
+    write_summary(summary, summary_path or os.path.splitext(log_path)[0] + '.prom')
+    return summary
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python run_metrics.py events.jsonl [summary.prom]')
+        sys.exit(1)
+    summary = summarize(sys.argv[1])
+    if len(sys.argv) > 2:
+        write_summary(summary, sys.argv[2])
+    else:
+        sys.stdout.write(prometheus_text(summary))
+
+if __name__ == '__main__':
+    main()
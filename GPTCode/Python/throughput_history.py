@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+"""Per-machine record of conversion throughput, used to estimate batch wall time.
+
+Every finished run adds (workers, files, seconds of audio, wall time) for its
+converter. The estimate fits a per-file overhead plus a per-audio-second cost
+to those runs and replays the batch on the requested number of workers.
+
+    python throughput_history.py            # show what has been recorded
+"""
+
+import heapq
+import json
+import os
+import socket
+import time
+
+HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'opus_throughput.json')
+MAX_RUNS = 50  # Runs kept per converter; older ones stop counting
+DEFAULT_SECONDS_PER_FILE = 0.05  # Encoder start-up and file open, before any history exists
+DEFAULT_SPEED = 100.0  # Seconds of audio one worker encodes per wall-clock second
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f'{seconds // 3600}h {seconds % 3600 // 60:02d}m'
+    if seconds >= 60:
+        return f'{seconds // 60}m {seconds % 60:02d}s'
+    return f'{seconds}s'
+
+class ThroughputHistory:
+    """Throughput of past runs on this host, stored as JSON shared by all converters."""
+
+    def __init__(self, path=HISTORY_PATH, host=None):
+        self.path = path
+        self.host = host or socket.gethostname()
+        self.data = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f'Ignoring unreadable throughput history {path}: {e}')
+
+    def runs(self, converter):
+        return self.data.get(self.host, {}).get(converter, [])
+
+    def record(self, converter, workers, files, audio_seconds, wall_seconds):
+        """Add a finished run and save the history."""
+        if not files or wall_seconds <= 0:
+            return
+        runs = self.data.setdefault(self.host, {}).setdefault(converter, [])
+        runs.append({'time': time.time(), 'workers': workers, 'cpu_count': os.cpu_count(), 'files': files,
+                     'audio_seconds': round(audio_seconds, 3), 'wall_seconds': round(wall_seconds, 3)})
+        del runs[:-MAX_RUNS]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def model(self, converter):
+        """Return (seconds_per_file, seconds_per_audio_second) of worker time for converter.
+
+        Fitted by least squares to the recorded runs, where a run's worker time
+        is its wall time multiplied by the workers that could actually run at
+        once. Falls back to the defaults until there is history.
+        """
+        rows = []
+        for run in self.runs(converter):
+            busy = min(run['workers'], run.get('cpu_count') or run['workers'], run['files'])
+            rows.append((run['files'], run['audio_seconds'], run['wall_seconds'] * busy))
+        if not rows:
+            return DEFAULT_SECONDS_PER_FILE, 1 / DEFAULT_SPEED
+        sff = sum(f * f for f, _, _ in rows)
+        sfa = sum(f * a for f, a, _ in rows)
+        saa = sum(a * a for _, a, _ in rows)
+        sfw = sum(f * w for f, _, w in rows)
+        saw = sum(a * w for _, a, w in rows)
+        det = sff * saa - sfa * sfa
+        if det > 1e-9 * sff * saa:
+            per_file = (sfw * saa - saw * sfa) / det
+            per_second = (saw * sff - sfw * sfa) / det
+            if per_file >= 0 and per_second > 0:
+                return per_file, per_second
+        # Too few or too similar runs to separate the two costs: keep the default overhead
+        total_files = sum(f for f, _, _ in rows)
+        total_audio = sum(a for _, a, _ in rows)
+        total_work = sum(w for _, _, w in rows)
+        per_file = min(DEFAULT_SECONDS_PER_FILE, total_work / (2 * total_files))
+        return per_file, max(total_work - per_file * total_files, 1e-9) / max(total_audio, 1e-9)
+
+    def estimate(self, converter, durations, workers):
+        """Predict the wall time in seconds to convert files of the given durations on workers."""
+        per_file, per_second = self.model(converter)
+        busy = max(1, min(workers, os.cpu_count() or workers))
+        finish_times = [0.0] * busy
+        for duration in sorted(durations, reverse=True):
+            heapq.heapreplace(finish_times, finish_times[0] + per_file + duration * per_second)
+        return max(finish_times)
+
+    def plan_report(self, converter, total_files, skipped, durations, workers, unprobed=0):
+        """Return the lines of a --plan report for a batch; durations are those of the files to encode."""
+        audio_seconds = sum(durations)
+        per_file, per_second = self.model(converter)
+        runs = len(self.runs(converter))
+        lines = [
+            f'Files found:      {total_files}',
+            f'Up to date:       {skipped}',
+            f'To encode:        {len(durations) + unprobed}' + (f' ({unprobed} could not be probed)' if unprobed else ''),
+            f'Audio to encode:  {audio_seconds / 3600:.2f} h',
+            f'Model:            {1 / per_second:.0f}x realtime per worker, {per_file * 1000:.0f} ms per file '
+            + (f'(from {runs} recorded runs on {self.host})' if runs else '(defaults, no runs recorded yet)'),
+            f'Estimated time:   {format_duration(self.estimate(converter, durations, workers))} on {workers} workers',
+        ]
+        counts = sorted({1, 2, 4, 8, 16, 32, os.cpu_count() or 1, workers})
+        lines.append('  ' + ', '.join(f'{count}: {format_duration(self.estimate(converter, durations, count))}'
+                                      for count in counts if count <= max(workers, os.cpu_count() or 1)))
+        return lines
+
+def main():
+    history = ThroughputHistory()
+    converters = history.data.get(history.host, {})
+    if not converters:
+        print(f'No runs recorded for {history.host} in {history.path}')
+        return
+    for converter, runs in converters.items():
+        per_file, per_second = history.model(converter)
+        print(f'{converter}: {len(runs)} runs, {1 / per_second:.0f}x realtime per worker, '
+              f'{per_file * 1000:.0f} ms per file')
+        for run in runs[-5:]:
+            started = time.strftime('%Y-%m-%d %H:%M', time.localtime(run['time']))
+            print(f"  {started}  {run['files']} files, {run['audio_seconds'] / 3600:.2f} h audio, "
+                  f"{run['workers']} workers, {format_duration(run['wall_seconds'])}")
+
+if __name__ == '__main__':
+    main()